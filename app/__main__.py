@@ -0,0 +1,81 @@
+"""Command line entry point: `python -m app batch ...` renders many CVs at once.
+
+Run it from the application directory (the one holding data/, cv_templates/
+and static/), like the server.
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+def batch(args: argparse.Namespace) -> int:
+    from fastapi import HTTPException
+    from app.config import BATCH_WORKERS
+    from app.services.batch_service import BatchRenderService, build_items, check_settings, check_templates, document_name
+    from app.services.pdf_service import check_formats
+    from app.services.template_service import TemplateService
+    
+    documents = {}
+    for markdown_file in args.markdown_files:
+        name = document_name(markdown_file)
+        # Keep outputs of equally named files from different folders apart
+        unique_name, suffix = name, 2
+        while unique_name in documents:
+            unique_name, suffix = f"{name}-{suffix}", suffix + 1
+        documents[unique_name] = markdown_file.read_text()
+    
+    available_templates = [template["id"] for template in TemplateService().get_templates()]
+    templates = args.template or available_templates
+    output_formats = args.format or ["html"]
+    paper_sizes = args.paper_size or ["a4"]
+    theme_colors = args.theme_color or ["blue"]
+    try:
+        check_templates(templates, available_templates)
+        check_settings(paper_sizes, theme_colors)
+        check_formats(output_formats)
+    except HTTPException as e:
+        print(e.detail, file=sys.stderr)
+        return 2
+    
+    items = build_items(documents, templates, paper_sizes, theme_colors, output_formats)
+    
+    done = 0
+    
+    def progress(result: Dict[str, Any]) -> None:
+        nonlocal done
+        done += 1
+        status = f"failed: {result['error'].strip()}" if "error" in result else f"{result['seconds']:.2f}s"
+        print(f"[{done}/{len(items)}] {result['output']} {status}", file=sys.stderr, flush=True)
+    
+    service = BatchRenderService(workers=args.workers or BATCH_WORKERS)
+    try:
+        summary = service.render(items, args.output, progress)
+    finally:
+        service.shutdown()
+    
+    print(f"Rendered {summary['rendered']} of {summary['total']} CVs to {summary['output']} in {summary['seconds']:.1f}s")
+    return 1 if summary["failed"] else 0
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app", description="MarkCV command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    batch_parser = subparsers.add_parser(
+        "batch", help="Render markdown CVs for every combination of template, paper size, theme color and format"
+    )
+    batch_parser.add_argument("markdown_files", nargs="+", type=Path, help="Markdown CVs to render")
+    batch_parser.add_argument("--template", action="append", help="Template id, repeatable (default: all templates)")
+    batch_parser.add_argument("--paper-size", action="append", help="Paper size, repeatable (default: a4)")
+    batch_parser.add_argument("--theme-color", action="append", help="Theme color, repeatable (default: blue)")
+    batch_parser.add_argument("--format", action="append", help="html or pdf (needs WeasyPrint), repeatable (default: html)")
+    batch_parser.add_argument(
+        "--output", type=Path, required=True, help="Zip file (if it ends in .zip) or directory to write to"
+    )
+    batch_parser.add_argument("--workers", type=int, help="Worker processes (default: MARKCV_BATCH_WORKERS)")
+    batch_parser.set_defaults(handler=batch)
+    
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,129 @@
+import os
 from pathlib import Path
 
 # Application paths
 DATA_DIR = Path("data")
-MARKDOWN_FILE = DATA_DIR / "cv.md"
-PDF_FILE = DATA_DIR / "cv.pdf"
 TEMPLATE_DIR = Path("cv_templates")
-IMAGE_DIR = DATA_DIR / "images"
+# Uploads are received here before they are stored
+UPLOAD_DIR = DATA_DIR / "uploads"
+THEME_CSS_DIR = Path("static") / "css" / "themes"
+RENDER_CACHE_DIR = DATA_DIR / "cache" / "renders"
+CSS_BUNDLE_DIR = DATA_DIR / "cache" / "css"
+IMAGE_DERIVATIVE_DIR = DATA_DIR / "cache" / "images"
+BATCH_DIR = DATA_DIR / "batches"
 
-# Ensure directories exist
-DATA_DIR.mkdir(exist_ok=True)
-IMAGE_DIR.mkdir(exist_ok=True)
+# Where documents, revision logs, published renders and uploaded images are kept: "local" as
+# files under data/, "sqlite" in one database file that several MarkCV processes or machines
+# can share, standing in for an object store. Caches stay on each machine's local disk.
+STORAGE_BACKEND = os.environ.get("MARKCV_STORAGE", "local")
+STORAGE_DB_FILE = Path(os.environ.get("MARKCV_STORAGE_DB", str(DATA_DIR / "storage.db")))
+# Local copies of stored objects for code that needs a file, like pandoc and Pillow
+STORAGE_CACHE_DIR = DATA_DIR / "cache" / "storage"
+# Seconds to wait for a document's lock, and after how long the lock of a crashed process expires
+STORAGE_LOCK_TIMEOUT = float(os.environ.get("MARKCV_STORAGE_LOCK_TIMEOUT", "10"))
+STORAGE_LOCK_LEASE_SECONDS = 30
+# Image metadata goes into the shared database too, so every process sees every upload
+LOCAL_IMAGE_DB_FILE = DATA_DIR / "images.db"
+IMAGE_DB_FILE = STORAGE_DB_FILE if STORAGE_BACKEND == "sqlite" else LOCAL_IMAGE_DB_FILE
+
+# Document served when a request names none; it keeps using data/cv.md and data/cv.html
+DEFAULT_DOCUMENT_ID = "default"
 
 # Default markdown content
 DEFAULT_MARKDOWN = "# Your CV\n\nStart editing your CV here!"
 
+# Warm-up after startup: load templates, start pandoc, render the default CV with every
+# template and prime the caches before /health/ready reports ready
+WARMUP_ENABLED = os.environ.get("MARKCV_WARMUP", "1") == "1"
+
+# Seconds between checks of cv_templates/ and theme CSS for changes (0 disables hot reload)
+TEMPLATE_POLL_INTERVAL = float(os.environ.get("MARKCV_TEMPLATE_POLL_SECONDS", "2"))
+
+# Render cache settings
+RENDER_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Theme CSS is compiled into a minified bundle per template, paper size and theme color;
+# the warm-up compiles every template's paper sizes with these theme colors
+THEME_COLORS = tuple(color.strip() for color in os.environ.get("MARKCV_THEME_COLORS", "blue").split(",") if color.strip())
+CSS_BUNDLE_CACHE_SIZE = 256
+
+# Cached renders with these suffixes get .gz (and, with the brotli package, .br) copies
+PRECOMPRESS_SUFFIXES = (".html",)
+PRECOMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# Post-processing of rendered HTML, streamed in chunks of this many characters. The print
+# script is always injected; minification and inlining of app-local assets are optional
+POST_PROCESS_CHUNK_SIZE = 64 * 1024
+MINIFY_HTML = os.environ.get("MARKCV_MINIFY_HTML", "0") == "1"
+INLINE_ASSETS = os.environ.get("MARKCV_INLINE_ASSETS", "0") == "1"
+
+# Revision log of saved markdown: revisions kept, and how often one is stored in full instead of as edits
+REVISION_HISTORY = int(os.environ.get("MARKCV_REVISION_HISTORY", "200"))
+REVISION_SNAPSHOT_INTERVAL = 25
+
+# Live editing: how long to wait for the rest of a burst of edits before saving them together
+LIVE_COALESCE_SECONDS = float(os.environ.get("MARKCV_LIVE_COALESCE_SECONDS", "0.1"))
+
+# Pandoc conversion engine settings
+PANDOC_SERVER_ENABLED = os.environ.get("MARKCV_PANDOC_SERVER", "1") == "1"
+PANDOC_POOL_SIZE = int(os.environ.get("MARKCV_PANDOC_POOL_SIZE", "2"))
+PANDOC_TIMEOUT = float(os.environ.get("MARKCV_PANDOC_TIMEOUT", "60"))
+PANDOC_WORKER_MAX_JOBS = int(os.environ.get("MARKCV_PANDOC_WORKER_MAX_JOBS", "500"))
+
+# Templates with "renderEngine": "native" in metadata.json render in-process instead of with pandoc
+NATIVE_RENDER_ENABLED = os.environ.get("MARKCV_NATIVE_RENDER", "1") == "1"
+# Converted markdown sections and section items the native renderer keeps in memory
+NATIVE_FRAGMENT_CACHE_SIZE = 512
+
+# Render concurrency: renders beyond this limit queue instead of running in parallel
+RENDER_CONCURRENCY = int(os.environ.get("MARKCV_RENDER_CONCURRENCY", str(os.cpu_count() or 2)))
+
+# Render job queue behind /api/jobs and /api/pdf: worker tasks, queued jobs accepted, and how long finished jobs are kept
+RENDER_JOB_WORKERS = int(os.environ.get("MARKCV_RENDER_JOB_WORKERS", str(RENDER_CONCURRENCY)))
+RENDER_JOB_QUEUE_SIZE = 256
+RENDER_JOB_TTL_SECONDS = float(os.environ.get("MARKCV_RENDER_JOB_TTL_SECONDS", "600"))
+
+# Output formats of /api/pdf and batch renders; PDF needs the optional weasyprint package
+# and is converted on a pool of warm worker processes
+OUTPUT_FORMATS = ("html", "pdf")
+PDF_WORKERS = int(os.environ.get("MARKCV_PDF_WORKERS", "2"))
+
+# Batch renders: worker processes, and finished batch jobs (and their zip files) kept
+BATCH_WORKERS = int(os.environ.get("MARKCV_BATCH_WORKERS", str(os.cpu_count() or 2)))
+BATCH_JOB_HISTORY = 32
+
+# Number of scanned markdown documents kept in memory
+SCAN_CACHE_SIZE = 64
+
+# Live preview: rendered sections and preview versions kept in memory
+PREVIEW_CACHE_SIZE = 512
+PREVIEW_VERSION_HISTORY = 256
+
+# Uploads are streamed to disk in chunks of this many bytes and rejected above the limit
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MARKCV_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Print derivatives of uploaded images: longest side in pixels and JPEG/WebP quality
+PRINT_IMAGE_MAX_PX = 1200
+PRINT_IMAGE_QUALITY = 85
+
+# Exports resize images to their display size at this DPI before embedding them
+OPTIMIZE_PRINT_IMAGES = os.environ.get("MARKCV_OPTIMIZE_PRINT_IMAGES", "1") == "1"
+PRINT_IMAGE_DPI = int(os.environ.get("MARKCV_PRINT_IMAGE_DPI", "300"))
+
+# Render metrics: latency histogram buckets in seconds, output size buckets in bytes,
+# and whether responses carry a Server-Timing header with per-stage durations
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024, 20 * 1024 * 1024)
+SERVER_TIMING_ENABLED = os.environ.get("MARKCV_SERVER_TIMING", "0") == "1"
+
 # Server settings
 HOST = "0.0.0.0"
-PORT = 9876
\ No newline at end of file
+PORT = 9876
+
+def ensure_directories() -> None:
+    """Create the data directories; done at startup rather than when config is imported"""
+    for directory in (DATA_DIR, UPLOAD_DIR, RENDER_CACHE_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
@@ -1,10 +1,22 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import logging
-from pathlib import Path
 
-from app.routes import router
-from app.config import DATA_DIR, MARKDOWN_FILE, DEFAULT_MARKDOWN, HOST, PORT
+from app.routes import (
+    router,
+    batch_service,
+    document_store,
+    html_service,
+    pandoc_service,
+    render_job_service,
+    template_service,
+    warmup_service,
+)
+from app.config import DEFAULT_DOCUMENT_ID, DEFAULT_MARKDOWN, HOST, PORT, SERVER_TIMING_ENABLED, ensure_directories
+from app.services.metrics import collect_request_timings, format_server_timing, render_metrics
 
 # Configure logging
 logging.basicConfig(
@@ -13,21 +25,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger("markcv")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Prepare the data directory and warm up on startup; stop worker pools and processes on shutdown"""
+    ensure_directories()
+    # Initialize default markdown file if it doesn't exist
+    markdown_key = document_store.markdown_key(DEFAULT_DOCUMENT_ID)
+    if not document_store.storage.exists(markdown_key):
+        document_store.storage.write_text(markdown_key, DEFAULT_MARKDOWN)
+    
+    # Requests are served while warming up; /health/ready tells when it is done
+    warmup = asyncio.create_task(warmup_service.run())
+    yield
+    
+    warmup.cancel()
+    await asyncio.gather(warmup, return_exceptions=True)
+    await render_job_service.shutdown()
+    batch_service.shutdown()
+    html_service.pdf_service.shutdown()
+    pandoc_service.shutdown()
+    template_service.stop()
+
 # Initialize FastAPI app
-app = FastAPI(title="MarkCV")
+app = FastAPI(title="MarkCV", lifespan=lifespan)
 
 # Mount static directories
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/data", StaticFiles(directory="data"), name="data")
 app.mount("/cv_templates", StaticFiles(directory="cv_templates"), name="cv_templates")
 
-# Include API routes
+# Include API routes; /data is served from the storage backend by one of them
 app.include_router(router)
 
-# Initialize default markdown file if it doesn't exist
-if not MARKDOWN_FILE.exists():
-    with open(MARKDOWN_FILE, "w") as f:
-        f.write(DEFAULT_MARKDOWN)
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """Report the duration of each render stage of a request in a Server-Timing header"""
+    if not SERVER_TIMING_ENABLED:
+        return await call_next(request)
+    
+    with collect_request_timings() as timings:
+        response = await call_next(request)
+    if timings:
+        response.headers["Server-Timing"] = format_server_timing(timings)
+    return response
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 503 until the startup warm-up has finished, with how long each stage took"""
+    return JSONResponse(warmup_service.report(), status_code=200 if warmup_service.ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Render metrics in the Prometheus text exposition format"""
+    cache_stats = html_service.render_cache.stats()
+    image_stats = html_service.image_processor.stats()
+    extra_lines = [
+        "# HELP markcv_render_cache_hits_total Render cache hits",
+        "# TYPE markcv_render_cache_hits_total counter",
+        f"markcv_render_cache_hits_total {cache_stats['hits']}",
+        "# HELP markcv_render_cache_misses_total Render cache misses",
+        "# TYPE markcv_render_cache_misses_total counter",
+        f"markcv_render_cache_misses_total {cache_stats['misses']}",
+        "# HELP markcv_print_image_bytes_saved_total Bytes saved by embedding print-sized images",
+        "# TYPE markcv_print_image_bytes_saved_total counter",
+        f"markcv_print_image_bytes_saved_total {image_stats['bytes_saved']}",
+    ]
+    return PlainTextResponse(
+        render_metrics.render_prometheus(extra_lines),
+        media_type="text/plain; version=0.0.4"
+    )
 
 if __name__ == "__main__":
     import uvicorn
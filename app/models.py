@@ -3,6 +3,35 @@ from typing import List, Optional
 
 class MarkdownContent(BaseModel):
     markdown: str
+    base_version: Optional[str] = None
+
+class MarkdownEdit(BaseModel):
+    start: int
+    end: int
+    text: str = ""
+
+class MarkdownPatch(BaseModel):
+    base_version: str
+    edits: List[MarkdownEdit]
+    version: Optional[str] = None
+
+class PreviewRequest(BaseModel):
+    markdown: str
+    version: Optional[str] = None
+
+class BatchRenderRequest(BaseModel):
+    document_ids: List[str] = ["default"]
+    template_ids: List[str] = ["europass"]
+    paper_sizes: List[str] = ["a4"]
+    theme_colors: List[str] = ["blue"]
+    formats: List[str] = ["html"]
+
+class RenderJobRequest(BaseModel):
+    template_id: str = "europass"
+    paper_size: str = "a4"
+    theme_color: str = "blue"
+    document_id: str = "default"
+    format: str = "html"
 
 class TemplateSettings(BaseModel):
     template_id: str
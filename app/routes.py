@@ -1,57 +1,142 @@
-from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form, Depends
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form, Depends, Query, WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 
-from app.models import MarkdownContent, TemplateSettings, ImageData
+from app.config import DEFAULT_DOCUMENT_ID
+from app.models import BatchRenderRequest, MarkdownContent, MarkdownPatch, PreviewRequest, RenderJobRequest, TemplateSettings, ImageData
+from app.services.batch_service import BatchRenderService, build_items, check_settings, check_templates
+from app.services.document_store import DOCUMENT_ID_PATTERN, DocumentStore
 from app.services.template_service import TemplateService
 from app.services.markdown_service import MarkdownService
 from app.services.image_service import ImageService
+from app.services.live_service import LiveEditSession
 from app.services.html_service import HTMLService
+from app.services.http_cache import CachedFileResponse, cache_headers, conditional_json, is_not_modified
+from app.services.pandoc_service import PandocService
+from app.services.pdf_service import check_formats
+from app.services.preview_service import PreviewService
+from app.services.render_job_service import RenderJobService
+from app.services.revision_log import content_version
+from app.services.warmup_service import WarmupService
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 # Service instances
+pandoc_service = PandocService()
+document_store = DocumentStore()
 template_service = TemplateService()
-markdown_service = MarkdownService()
+markdown_service = MarkdownService(pandoc_service, document_store)
 image_service = ImageService()
-html_service = HTMLService(template_service, markdown_service)
+html_service = HTMLService(
+    template_service,
+    markdown_service,
+    pandoc_service=pandoc_service,
+    image_processor=image_service.image_processor
+)
+preview_service = PreviewService(markdown_service)
+render_job_service = RenderJobService(html_service)
+batch_service = BatchRenderService()
+warmup_service = WarmupService(html_service, preview_service)
 
 @router.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@router.get("/api/documents")
+async def list_documents():
+    return await run_in_threadpool(document_store.list_documents)
+
 @router.get("/api/markdown")
-async def get_markdown():
-    content = markdown_service.get_markdown()
-    return {"content": content}
+async def get_markdown(request: Request, document_id: str = DEFAULT_DOCUMENT_ID):
+    content = await markdown_service.get_markdown_async(document_id)
+    stored = await run_in_threadpool(document_store.storage.stat, document_store.markdown_key(document_id))
+    last_modified = stored.modified if stored else None
+    return conditional_json(
+        request,
+        {"content": content, "version": content_version(content)},
+        last_modified=last_modified
+    )
 
 @router.post("/api/markdown")
-async def save_markdown(content: MarkdownContent):
-    success = markdown_service.save_markdown(content.markdown)
-    return {"status": "success" if success else "error"}
+async def save_markdown(content: MarkdownContent, document_id: str = DEFAULT_DOCUMENT_ID):
+    revision = await markdown_service.save_markdown_async(content.markdown, document_id, content.base_version)
+    return {"status": "success", "version": revision.version, "revision": revision.revision}
+
+@router.patch("/api/markdown")
+async def patch_markdown(patch: MarkdownPatch, document_id: str = DEFAULT_DOCUMENT_ID):
+    edits = [(edit.start, edit.end, edit.text) for edit in patch.edits]
+    revision = await markdown_service.patch_markdown_async(edits, patch.base_version, document_id, patch.version)
+    return {"status": "success", "version": revision.version, "revision": revision.revision}
+
+@router.get("/api/markdown/revisions")
+async def list_revisions(document_id: str = DEFAULT_DOCUMENT_ID):
+    document_store.validate(document_id)
+    return await run_in_threadpool(markdown_service.list_revisions, document_id)
+
+@router.get("/api/markdown/revisions/{revision}")
+async def get_revision(revision: int, document_id: str = DEFAULT_DOCUMENT_ID):
+    document_store.validate(document_id)
+    content = await run_in_threadpool(markdown_service.get_revision, revision, document_id)
+    return {"revision": revision, "content": content, "version": content_version(content)}
+
+@router.websocket("/api/live")
+async def live_edit(websocket: WebSocket, document_id: str = DEFAULT_DOCUMENT_ID):
+    """Save edits and push preview updates over one connection per editor"""
+    if not DOCUMENT_ID_PATTERN.match(document_id):
+        await websocket.close(code=1008)
+        return
+    await LiveEditSession(websocket, document_id, markdown_service, preview_service).run()
+
+@router.post("/api/preview")
+async def render_preview(request: PreviewRequest):
+    return await preview_service.render_preview_async(request.markdown, request.version)
 
 @router.get("/api/templates")
-async def get_templates():
-    templates = template_service.get_templates()
-    return templates
+async def get_templates(request: Request):
+    # Templates only change when their files do, so the version hash answers revalidations without listing them
+    etag = f'"{template_service.get_templates_version()}"'
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    
+    return JSONResponse(template_service.get_templates(), headers=cache_headers(etag))
 
 @router.post("/api/images/upload")
 async def upload_image(
     file: UploadFile = File(...),
-    alt_text: str = Form("")
+    alt_text: str = Form(""),
+    document_id: str = DEFAULT_DOCUMENT_ID
 ):
-    result = image_service.upload_image(file, alt_text)
+    document_store.validate(document_id)
+    result = await image_service.upload_image_async(file, alt_text, document_id)
     return result
 
 @router.get("/api/images")
-async def list_images():
-    images = image_service.list_images()
-    return images
+async def list_images(
+    request: Request,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    document_id: str = DEFAULT_DOCUMENT_ID
+):
+    document_store.validate(document_id)
+    images = await run_in_threadpool(image_service.list_images, offset, limit, document_id)
+    total = await run_in_threadpool(image_service.count_images, document_id)
+    return conditional_json(request, images, headers={"X-Total-Count": str(total)})
 
 @router.post("/api/images/{image_id}/position")
-async def update_image_position(image_id: str, x_offset: int = 0, y_offset: int = 0):
-    success = image_service.update_image_position(image_id, x_offset, y_offset)
+async def update_image_position(
+    image_id: str,
+    x_offset: int = 0,
+    y_offset: int = 0,
+    document_id: str = DEFAULT_DOCUMENT_ID
+):
+    document_store.validate(document_id)
+    success = await run_in_threadpool(image_service.update_image_position, image_id, x_offset, y_offset, document_id)
     if not success:
         raise HTTPException(status_code=404, detail="Image not found")
     return {"status": "success"}
@@ -60,10 +145,95 @@ async def update_image_position(image_id: str, x_offset: int = 0, y_offset: int
 async def generate_printable_html(
     template_id: str = "europass",
     paper_size: str = "a4",
-    theme_color: str = "blue"
+    theme_color: str = "blue",
+    document_id: str = DEFAULT_DOCUMENT_ID,
+    output_format: str = Query("html", alias="format")
 ):
-    return html_service.generate_printable_html(
+    # Waits on a render job, so identical concurrent requests share one render
+    return await render_job_service.render(
         template_id=template_id,
         paper_size=paper_size,
-        theme_color=theme_color
-    )
\ No newline at end of file
+        theme_color=theme_color,
+        document_id=document_id,
+        output_format=output_format
+    )
+
+@router.post("/api/jobs", status_code=202)
+async def start_render_job(request: RenderJobRequest):
+    return await render_job_service.submit(
+        template_id=request.template_id,
+        paper_size=request.paper_size,
+        theme_color=request.theme_color,
+        document_id=request.document_id,
+        output_format=request.format
+    )
+
+@router.get("/api/jobs/{job_id}")
+async def get_render_job(job_id: str, wait: float = Query(0, ge=0, le=30)):
+    """Render job status; with wait, hold the request up to that many seconds for the job to finish"""
+    if wait:
+        return await render_job_service.wait(job_id, wait)
+    return render_job_service.job_status(job_id)
+
+@router.get("/api/jobs/{job_id}/result")
+async def get_render_job_result(job_id: str):
+    return render_job_service.job_response(job_id)
+
+@router.post("/api/batch")
+async def start_batch_render(request: BatchRenderRequest):
+    templates = template_service.get_templates()
+    check_templates(request.template_ids, [template["id"] for template in templates])
+    check_settings(request.paper_sizes, request.theme_colors)
+    check_formats(request.formats)
+    
+    documents = {}
+    for document_id in request.document_ids:
+        document_store.validate(document_id)
+        if not await run_in_threadpool(document_store.exists, document_id):
+            raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
+        documents[document_id] = await markdown_service.get_markdown_async(document_id)
+    
+    items = build_items(documents, request.template_ids, request.paper_sizes, request.theme_colors, request.formats)
+    return batch_service.start_job(items)
+
+@router.get("/api/batch/{job_id}")
+async def get_batch_render(job_id: str):
+    return batch_service.job_status(job_id)
+
+@router.get("/api/batch/{job_id}/events")
+async def stream_batch_render(job_id: str):
+    """Stream a batch job's progress as newline-delimited JSON until it finishes"""
+    batch_service.job_status(job_id)
+    
+    async def events():
+        sent = 0
+        while True:
+            new_events = batch_service.job_events(job_id, sent)
+            for event in new_events:
+                yield json.dumps(event) + "\n"
+                if "status" in event:
+                    return
+            sent += len(new_events)
+            await asyncio.sleep(0.2)
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@router.get("/api/batch/{job_id}/download")
+async def download_batch_render(job_id: str):
+    return FileResponse(
+        path=str(batch_service.job_output(job_id)),
+        filename=f"markcv-batch-{job_id[:8]}.zip",
+        media_type="application/zip"
+    )
+
+@router.get("/data/{key:path}")
+async def get_data_file(key: str):
+    """Serve a stored object (uploaded images, published cv.html and cv.pdf) from the storage backend"""
+    try:
+        stored = await run_in_threadpool(document_store.storage.stat, key)
+        path = await run_in_threadpool(document_store.storage.local_path, key) if stored else None
+    except ValueError:
+        stored = path = None
+    if not stored or not path.is_file():
+        raise HTTPException(status_code=404, detail="Not Found")
+    return CachedFileResponse(path, etag=f'"{stored.etag}"')
\ No newline at end of file
@@ -0,0 +1,289 @@
+import itertools
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+import logging
+
+from fastapi import HTTPException
+from app.config import BATCH_DIR, BATCH_JOB_HISTORY, BATCH_WORKERS
+
+logger = logging.getLogger("markcv")
+
+# Paper sizes and theme colors become parts of output file names
+SETTING_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+class BatchItem(NamedTuple):
+    """One render of a batch: a CV in one template, paper size, theme color and format"""
+    name: str
+    content: str
+    template_id: str
+    paper_size: str
+    theme_color: str
+    output_format: str = "html"
+    
+    @property
+    def output_name(self) -> str:
+        return f"{self.name}/{self.template_id}-{self.paper_size}-{self.theme_color}.{self.output_format}"
+
+# Services of a batch worker process, created once and shared by all its jobs
+_worker_html_service = None
+
+def _init_worker() -> None:
+    global _worker_html_service
+    from app.services.html_service import HTMLService
+    from app.services.markdown_service import MarkdownService
+    from app.services.pandoc_service import PandocService
+    from app.services.pdf_service import PDFService
+    from app.services.render_cache import RenderCache
+    from app.services.template_service import TemplateService
+    
+    # Every worker process runs its own renders; one warm pandoc server each is enough,
+    # and PDFs are converted in the worker itself rather than on another pool
+    pandoc_service = PandocService(pool_size=1)
+    render_cache = RenderCache()
+    _worker_html_service = HTMLService(
+        TemplateService(),
+        MarkdownService(pandoc_service),
+        render_cache=render_cache,
+        pandoc_service=pandoc_service,
+        pdf_service=PDFService(render_cache, workers=0)
+    )
+
+def _render_item(item: BatchItem) -> Dict[str, Any]:
+    """Render one batch item in a worker process"""
+    start = time.perf_counter()
+    try:
+        output_file = _worker_html_service.render_content(item.content, item.template_id, item.paper_size, item.theme_color)
+        if item.output_format == "pdf":
+            output_file = _worker_html_service.pdf_service.render_pdf(output_file, item.paper_size)
+        return {"output": item.output_name, "path": str(output_file), "seconds": time.perf_counter() - start}
+    except Exception as e:
+        error = getattr(e, "stderr", None) or str(e)
+        return {"output": item.output_name, "error": error, "seconds": time.perf_counter() - start}
+
+def build_items(
+    documents: Dict[str, str],
+    templates: Iterable[str],
+    paper_sizes: Iterable[str],
+    theme_colors: Iterable[str],
+    output_formats: Iterable[str] = ("html",)
+) -> List[BatchItem]:
+    """Expand named markdown documents x templates x paper sizes x theme colors x formats into batch items"""
+    return [
+        BatchItem(name, content, template_id, paper_size, theme_color, output_format)
+        for (name, content), template_id, paper_size, theme_color, output_format
+        in itertools.product(documents.items(), templates, paper_sizes, theme_colors, output_formats)
+    ]
+
+def check_templates(template_ids: Iterable[str], available_ids: Iterable[str]) -> None:
+    """Reject a batch naming templates that do not exist before any work starts"""
+    unknown = sorted(set(template_ids) - set(available_ids))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown templates: {', '.join(unknown)}")
+
+def check_settings(paper_sizes: Iterable[str], theme_colors: Iterable[str]) -> None:
+    """Reject paper sizes and theme colors that are not plain names, as they are used in output paths"""
+    for label, values in (("paper sizes", paper_sizes), ("theme colors", theme_colors)):
+        invalid = sorted(value for value in set(values) if not SETTING_PATTERN.match(value))
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid {label}: {', '.join(map(repr, invalid))}")
+
+class BatchRenderService:
+    """Renders many CVs across templates in parallel on a pool of worker processes"""
+    
+    def __init__(self, workers: int = BATCH_WORKERS, batch_dir: Path = BATCH_DIR):
+        self.workers = workers
+        self.batch_dir = batch_dir
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def render(
+        self,
+        items: List[BatchItem],
+        output: Path,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Render all items and write them to a zip file (if output ends in .zip) or a directory.
+        
+        progress is called with each finished item's result as it completes.
+        """
+        start = time.perf_counter()
+        results = []
+        
+        with self._open_output(output) as write_output:
+            futures = [self._get_pool().submit(_render_item, item) for item in items]
+            for future in as_completed(futures):
+                result = future.result()
+                if "path" in result:
+                    write_output(result["output"], Path(result.pop("path")))
+                results.append(result)
+                if progress:
+                    progress(result)
+        
+        failed = [result for result in results if "error" in result]
+        logger.info(f"Batch rendered {len(results) - len(failed)} of {len(items)} CVs to {output}")
+        return {
+            "output": str(output),
+            "total": len(items),
+            "rendered": len(results) - len(failed),
+            "failed": failed,
+            "seconds": time.perf_counter() - start
+        }
+    
+    def start_job(self, items: List[BatchItem]) -> Dict[str, Any]:
+        """Start rendering items to a zip file in the background and return the job"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "running",
+            "total": len(items),
+            "done": 0,
+            "failed": 0,
+            "events": [],
+            "output": self.batch_dir / f"{job_id}.zip",
+            "summary": None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._expire_jobs()
+        
+        threading.Thread(target=self._run_job, args=(job, items), name=f"markcv-batch-{job_id[:8]}", daemon=True).start()
+        return self.job_status(job_id)
+    
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        job = self._get_job(job_id)
+        with self._lock:
+            return {
+                "id": job["id"],
+                "status": job["status"],
+                "total": job["total"],
+                "done": job["done"],
+                "failed": job["failed"],
+                "summary": job["summary"]
+            }
+    
+    def job_events(self, job_id: str, since: int = 0) -> List[Dict[str, Any]]:
+        """Progress events of a job after the first `since` ones"""
+        job = self._get_job(job_id)
+        with self._lock:
+            return job["events"][since:]
+    
+    def job_output(self, job_id: str) -> Path:
+        """The zip of a finished job; a partial job's holds the items that rendered"""
+        job = self._get_job(job_id)
+        if job["status"] not in ("done", "partial"):
+            raise HTTPException(status_code=409, detail=f"Batch job is {job['status']}")
+        return job["output"]
+    
+    def shutdown(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def _run_job(self, job: Dict[str, Any], items: List[BatchItem]) -> None:
+        def progress(result: Dict[str, Any]) -> None:
+            with self._lock:
+                job["done"] += 1
+                job["failed"] += "error" in result
+                job["events"].append({"done": job["done"], "total": job["total"], **result})
+        
+        try:
+            summary = self.render(items, job["output"], progress)
+            if not summary["failed"]:
+                status = "done"
+            elif summary["rendered"]:
+                status = "partial"
+            else:
+                status = "failed"
+        except Exception as e:
+            logger.error(f"Batch job {job['id']} failed: {e}")
+            summary = {"error": str(e)}
+            status = "failed"
+        
+        with self._lock:
+            job["summary"] = summary
+            job["status"] = status
+            job["events"].append({"status": status})
+    
+    def _get_job(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Batch job not found")
+        return job
+    
+    def _expire_jobs(self) -> None:
+        """Forget the oldest finished jobs beyond BATCH_JOB_HISTORY and delete their output"""
+        finished = [job for job in self._jobs.values() if job["status"] != "running"]
+        for job in finished[:max(0, len(self._jobs) - BATCH_JOB_HISTORY)]:
+            del self._jobs[job["id"]]
+            job["output"].unlink(missing_ok=True)
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that runs threads (the server, pandoc pools) is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+            return self._pool
+    
+    def _open_output(self, output: Path):
+        if output.suffix == ".zip":
+            return _ZipOutput(output)
+        return _DirectoryOutput(output)
+
+class _ZipOutput:
+    """Writes rendered files into a zip archive, published atomically when complete"""
+    
+    def __init__(self, output: Path):
+        self.output = output
+        self.temp_output = output.with_name(f".{output.name}.{uuid.uuid4().hex}")
+    
+    def __enter__(self):
+        self.output.parent.mkdir(parents=True, exist_ok=True)
+        self.archive = zipfile.ZipFile(self.temp_output, "w", zipfile.ZIP_DEFLATED)
+        return self.write
+    
+    def write(self, name: str, source: Path) -> None:
+        self.archive.write(source, name)
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.archive.close()
+        if exc_type is None:
+            os.replace(self.temp_output, self.output)
+        else:
+            self.temp_output.unlink(missing_ok=True)
+
+class _DirectoryOutput:
+    """Copies rendered files into a directory tree"""
+    
+    def __init__(self, output: Path):
+        self.output = output
+    
+    def __enter__(self):
+        self.output.mkdir(parents=True, exist_ok=True)
+        return self.write
+    
+    def write(self, name: str, source: Path) -> None:
+        destination = self.output / name
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(source, destination)
+    
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+def document_name(path: Path) -> str:
+    """Output folder name for a markdown file"""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", path.stem) or "cv"
@@ -0,0 +1,317 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Set, Tuple, Union
+import logging
+
+from app.config import CSS_BUNDLE_CACHE_SIZE, CSS_BUNDLE_DIR, THEME_COLORS
+from app.services.template_service import TemplateService
+
+logger = logging.getLogger("markcv")
+
+# Paper sizes a template is compiled for when its metadata.json lists none
+DEFAULT_PAPER_SIZES = ("a4", "letter")
+
+CLASS_ATTRIBUTE_PATTERN = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+# Strings and comments, which the minifier leaves alone or drops
+CSS_TOKEN_PATTERN = re.compile(r""""(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|/\*.*?(?:\*/|\Z)""", re.DOTALL)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+SELECTOR_SPACE_PATTERN = re.compile(r"\s*([,>+~])\s*")
+VALUE_SPACE_PATTERN = re.compile(r"\s*,\s*")
+SELECTOR_CLASS_PATTERN = re.compile(r"\.(-?[A-Za-z_][\w-]*)")
+# Pseudo-class arguments (:not(.x) does not require .x) and attribute selectors
+SELECTOR_ARGUMENT_PATTERN = re.compile(r":[\w-]+\([^()]*\)|\[[^\]]*\]")
+
+class CSSBundle(NamedTuple):
+    """A compiled stylesheet: the file renders reference, and a hash of its content"""
+    path: Path
+    digest: str
+
+class CSSNode(NamedTuple):
+    """A rule (prelude and declarations), an at-rule with nested nodes, or a statement (block None)"""
+    prelude: str
+    block: Union[None, str, List["CSSNode"]]
+
+class CSSBundler:
+    """Theme CSS compiled per template, paper size and theme color.
+    
+    A bundle is the template's theme CSS minified, without the rules for
+    classes the template markup only has with other paper sizes or theme
+    colors (e.g. `.letter .page` in an a4 bundle, when the template has
+    `<body class="$papersize$">`). Bundles are written to CSS_BUNDLE_DIR,
+    named by their content hash, so pandoc and the native renderer inline a
+    small prebuilt file. A template change gives it a new version, and its
+    bundles are compiled again on next use.
+    """
+    
+    def __init__(
+        self,
+        template_service: TemplateService,
+        bundle_dir: Path = CSS_BUNDLE_DIR,
+        cache_size: int = CSS_BUNDLE_CACHE_SIZE
+    ):
+        self.template_service = template_service
+        self.bundle_dir = bundle_dir
+        self.cache_size = cache_size
+        # (template id, version, paper size, theme color) -> bundle, most recently used last
+        self._bundles: OrderedDict[Tuple[str, str, str, str], CSSBundle] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def bundle(self, template_id: str, paper_size: str, theme_color: str) -> CSSBundle:
+        """The stylesheet a render of the template with these settings inlines, compiled on first use"""
+        key = (template_id, self.template_service.get_template_version(template_id), paper_size, theme_color)
+        with self._lock:
+            bundle = self._bundles.get(key)
+            if bundle:
+                self._bundles.move_to_end(key)
+        if bundle and bundle.path.exists():
+            return bundle
+        
+        bundle = self._compile(template_id, paper_size, theme_color)
+        with self._lock:
+            self._bundles[key] = bundle
+            while len(self._bundles) > self.cache_size:
+                self._bundles.popitem(last=False)
+        return bundle
+    
+    def precompile(self, theme_colors: Iterable[str] = THEME_COLORS) -> int:
+        """Compile the bundles of every template for its paper sizes and the given theme colors"""
+        count = 0
+        for template in self.template_service.get_templates():
+            for paper_size in template.get("paperSizes") or DEFAULT_PAPER_SIZES:
+                for theme_color in theme_colors:
+                    self.bundle(template["id"], paper_size, theme_color)
+                    count += 1
+        return count
+    
+    def _compile(self, template_id: str, paper_size: str, theme_color: str) -> CSSBundle:
+        css_file = self.template_service.get_template_css(template_id)
+        try:
+            css = css_file.read_text()
+        except FileNotFoundError:
+            # Rendered as before, with the missing stylesheet
+            return CSSBundle(css_file, "missing")
+        
+        dead_classes = self._variant_classes(template_id, paper_size, theme_color)
+        bundle_css = serialize_css(strip_rules(parse_css(css), dead_classes))
+        digest = hashlib.sha256(bundle_css.encode("utf-8")).hexdigest()
+        
+        path = self.bundle_dir / f"{template_id}-{digest[:16]}.css"
+        if not path.exists():
+            self.bundle_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = self.bundle_dir / f".{uuid.uuid4().hex}.tmp"
+            temp_path.write_text(bundle_css)
+            os.replace(temp_path, path)
+            logger.info(
+                f"Compiled CSS bundle for {template_id} ({paper_size}, {theme_color}): "
+                f"{len(css.encode('utf-8'))} -> {len(bundle_css.encode('utf-8'))} bytes"
+            )
+        return CSSBundle(path, digest)
+    
+    def _variant_classes(self, template_id: str, paper_size: str, theme_color: str) -> Set[str]:
+        """Classes the template markup has with other paper sizes or theme colors, but not with these"""
+        try:
+            source = self.template_service.get_template_path(template_id).read_text()
+        except FileNotFoundError:
+            return set()
+        
+        metadata = self.template_service.get_template_metadata(template_id)
+        paper_sizes = {paper_size, *(metadata.get("paperSizes") or DEFAULT_PAPER_SIZES)}
+        theme_colors = {theme_color, *THEME_COLORS}
+        other_classes: Set[str] = set()
+        for other_paper_size in paper_sizes:
+            for other_theme_color in theme_colors:
+                if (other_paper_size, other_theme_color) != (paper_size, theme_color):
+                    other_classes |= template_classes(source, other_paper_size, other_theme_color)
+        return other_classes - template_classes(source, paper_size, theme_color)
+
+def template_classes(source: str, paper_size: str, theme_color: str) -> Set[str]:
+    """Class names in a pandoc template's markup with the paper size and theme color filled in"""
+    for name, value in (("papersize", paper_size), ("themecolor", theme_color)):
+        source = source.replace(f"${name}$", value).replace(f"${{{name}}}", value)
+    
+    classes = set()
+    for match in CLASS_ATTRIBUTE_PATTERN.finditer(source):
+        # Names still containing template directives are not known until render time
+        classes.update(name for name in (match.group(1) or match.group(2) or "").split() if "$" not in name)
+    return classes
+
+def parse_css(css: str) -> List[CSSNode]:
+    """Split a stylesheet into rules, at-rules and statements, dropping comments"""
+    css = CSS_TOKEN_PATTERN.sub(lambda match: "" if match.group(0).startswith("/*") else match.group(0), css)
+    nodes, _ = _parse_block(css, 0)
+    return nodes
+
+def _parse_block(css: str, position: int) -> Tuple[List[CSSNode], int]:
+    """Parse nodes from position up to the closing brace of the block (or the end), returning after it"""
+    nodes = []
+    start = position
+    depth = 0
+    while position < len(css):
+        char = css[position]
+        if char in "\"'":
+            match = CSS_TOKEN_PATTERN.match(css, position)
+            position = match.end() if match else position + 1
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif depth:
+            pass
+        elif char == ";":
+            if css[start:position].strip():
+                nodes.append(CSSNode(css[start:position].strip(), None))
+            start = position + 1
+        elif char == "{":
+            prelude = css[start:position].strip()
+            end = _block_end(css, position + 1)
+            body = css[position + 1:end]
+            if _has_blocks(body):
+                children, _ = _parse_block(body, 0)
+                nodes.append(CSSNode(prelude, children))
+            else:
+                nodes.append(CSSNode(prelude, body))
+            position = end + 1
+            start = position
+            continue
+        elif char == "}":
+            break
+        position += 1
+    
+    if css[start:position].strip():
+        nodes.append(CSSNode(css[start:position].strip(), None))
+    return nodes, position + 1
+
+def _block_end(css: str, position: int) -> int:
+    """Index of the brace closing a block that starts at position"""
+    depth = 1
+    while position < len(css):
+        char = css[position]
+        if char in "\"'":
+            match = CSS_TOKEN_PATTERN.match(css, position)
+            position = match.end() if match else position + 1
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if not depth:
+                return position
+        position += 1
+    return position
+
+def _has_blocks(body: str) -> bool:
+    return "{" in CSS_TOKEN_PATTERN.sub("", body)
+
+def strip_rules(nodes: List[CSSNode], dead_classes: Set[str]) -> List[CSSNode]:
+    """Drop selectors that need one of dead_classes, and rules and at-rules left empty by that"""
+    if not dead_classes:
+        return nodes
+    
+    kept = []
+    for node in nodes:
+        if isinstance(node.block, list):
+            if node.prelude.lower().lstrip("@-").split("-")[-1].startswith("keyframes"):
+                # Keyframe selectors are percentages, not classes
+                kept.append(node)
+                continue
+            children = strip_rules(node.block, dead_classes)
+            if children:
+                kept.append(CSSNode(node.prelude, children))
+        elif isinstance(node.block, str) and not node.prelude.startswith("@"):
+            selectors = [
+                selector for selector in _split_selectors(node.prelude)
+                if not required_classes(selector) & dead_classes
+            ]
+            if selectors:
+                kept.append(CSSNode(",".join(selectors), node.block))
+        else:
+            kept.append(node)
+    return kept
+
+def required_classes(selector: str) -> Set[str]:
+    """Classes an element (or its ancestors and siblings) must have to match a selector"""
+    if "\\" in selector:
+        # Escaped class names: assume nothing rather than misread them
+        return set()
+    selector = CSS_TOKEN_PATTERN.sub("", selector)
+    previous = None
+    while previous != selector:
+        previous = selector
+        selector = SELECTOR_ARGUMENT_PATTERN.sub("", selector)
+    return set(SELECTOR_CLASS_PATTERN.findall(selector))
+
+def _split_selectors(prelude: str) -> List[str]:
+    selectors = []
+    depth = 0
+    start = 0
+    position = 0
+    while position < len(prelude):
+        char = prelude[position]
+        if char in "\"'":
+            match = CSS_TOKEN_PATTERN.match(prelude, position)
+            position = match.end() if match else position + 1
+            continue
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth = max(depth - 1, 0)
+        elif char == "," and not depth:
+            selectors.append(prelude[start:position].strip())
+            start = position + 1
+        position += 1
+    selectors.append(prelude[start:].strip())
+    return [selector for selector in selectors if selector]
+
+def serialize_css(nodes: List[CSSNode]) -> str:
+    """Write nodes back as minified CSS: no comments, no optional whitespace, no empty rules"""
+    parts = []
+    for node in nodes:
+        if node.block is None:
+            parts.append(f"{_minify(node.prelude, _minify_value)};")
+        elif isinstance(node.block, list):
+            children = serialize_css(node.block)
+            if children:
+                parts.append(f"{_minify(node.prelude, _minify_at_prelude)}{{{children}}}")
+        else:
+            declarations = _minify_declarations(node.block)
+            if declarations:
+                parts.append(f"{_minify(node.prelude, _minify_selector)}{{{declarations}}}")
+    return "".join(parts)
+
+def _minify(text: str, minify_segment) -> str:
+    """Apply minify_segment to the text outside strings"""
+    parts = []
+    position = 0
+    for match in CSS_TOKEN_PATTERN.finditer(text):
+        parts.append(minify_segment(text[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(minify_segment(text[position:]))
+    return "".join(parts).strip()
+
+def _minify_selector(text: str) -> str:
+    return SELECTOR_SPACE_PATTERN.sub(r"\1", WHITESPACE_PATTERN.sub(" ", text))
+
+def _minify_at_prelude(text: str) -> str:
+    return WHITESPACE_PATTERN.sub(" ", text)
+
+def _minify_value(text: str) -> str:
+    return VALUE_SPACE_PATTERN.sub(",", WHITESPACE_PATTERN.sub(" ", text))
+
+def _minify_declarations(block: str) -> str:
+    declarations = []
+    for node in _parse_block(block, 0)[0]:
+        declaration = node.prelude
+        name, colon, value = declaration.partition(":")
+        if not colon:
+            continue
+        value = _minify(value, _minify_value)
+        if value:
+            declarations.append(f"{name.strip()}:{value}")
+    return ";".join(declarations)
\ No newline at end of file
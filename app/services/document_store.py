@@ -0,0 +1,72 @@
+import re
+from pathlib import Path
+from typing import List, Optional
+import logging
+
+from fastapi import HTTPException
+from app.config import DEFAULT_DOCUMENT_ID
+from app.services.storage import Storage, default_storage
+
+logger = logging.getLogger("markcv")
+
+DOCUMENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+DOCUMENT_KEY_PATTERN = re.compile(r"^documents/([A-Za-z0-9_-]{1,64})/cv\.md$")
+
+class DocumentStore:
+    """Maps CV ids to their storage keys.
+    
+    The default document lives where the single CV always has (cv.md in
+    data/), every other one gets its own prefix under documents/.
+    """
+    
+    def __init__(self, storage: Optional[Storage] = None):
+        self.storage = storage or default_storage()
+    
+    def validate(self, document_id: str) -> str:
+        """Reject ids that are not safe to use as a directory name"""
+        if not DOCUMENT_ID_PATTERN.match(document_id or ""):
+            raise HTTPException(
+                status_code=400,
+                detail="Document ids may only contain letters, digits, '-' and '_' (at most 64 characters)"
+            )
+        return document_id
+    
+    def document_prefix(self, document_id: str) -> str:
+        if self.validate(document_id) == DEFAULT_DOCUMENT_ID:
+            return ""
+        return f"documents/{document_id}/"
+    
+    def markdown_key(self, document_id: str) -> str:
+        return f"{self.document_prefix(document_id)}cv.md"
+    
+    def revisions_key(self, document_id: str) -> str:
+        """Log of the document's saved revisions"""
+        return f"{self.document_prefix(document_id)}cv.revisions.jsonl"
+    
+    def html_key(self, document_id: str) -> str:
+        """Where the latest render of a document is published"""
+        return f"{self.document_prefix(document_id)}cv.html"
+    
+    def pdf_key(self, document_id: str) -> str:
+        """Where the latest PDF export of a document is published"""
+        return f"{self.document_prefix(document_id)}cv.pdf"
+    
+    def exists(self, document_id: str) -> bool:
+        """Whether the document has markdown saved"""
+        return self.storage.exists(self.markdown_key(document_id))
+    
+    def publish(self, document_id: str, source: Path, key: Optional[str] = None) -> str:
+        """Atomically store a finished render as the document's cv.html (or under key) and return the key"""
+        key = key or self.html_key(document_id)
+        # Concurrent renders each publish a complete object, never a half-written one
+        self.storage.write_file(key, source)
+        return key
+    
+    def list_documents(self) -> List[str]:
+        """Ids of all documents that have markdown saved"""
+        documents = [DEFAULT_DOCUMENT_ID] if self.exists(DEFAULT_DOCUMENT_ID) else []
+        for key in self.storage.list("documents/"):
+            match = DOCUMENT_KEY_PATTERN.match(key)
+            if match:
+                documents.append(match.group(1))
+        return documents
\ No newline at end of file
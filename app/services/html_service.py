@@ -1,214 +1,547 @@
+import asyncio
+import contextvars
+import functools
+import re
+import shutil
 import subprocess
 import tempfile
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import logging
 
 from fastapi import HTTPException
 from fastapi.responses import FileResponse
 
-from app.config import DATA_DIR, IMAGE_DIR
+from app.config import (
+    DEFAULT_DOCUMENT_ID,
+    NATIVE_RENDER_ENABLED,
+    OPTIMIZE_PRINT_IMAGES,
+    PRINT_IMAGE_DPI,
+    PRINT_IMAGE_QUALITY,
+    RENDER_CONCURRENCY,
+)
 from app.services.template_service import TemplateService
+from app.services.css_bundler import CSSBundler
+from app.services.image_processing import ImageProcessor
+from app.services.markdown_scanner import scan_markdown
 from app.services.markdown_service import MarkdownService
+from app.services.http_cache import CachedFileResponse
+from app.services.metrics import render_metrics
+from app.services.native_renderer import NativeRenderer, UnsupportedTemplate
+from app.services.pdf_service import PDFService, check_formats
+from app.services.post_processing import PostProcessor, default_post_processors, post_process, read_chunks
+from app.services.pandoc_service import PandocService
+from app.services.render_cache import RenderCache
 
 logger = logging.getLogger("markcv")
 
+ALT_WIDTH_PATTERN = re.compile(r"\|\s*width\s*=\s*(\d+)px")
+
 class HTMLService:
-    def __init__(self, template_service: TemplateService, markdown_service: MarkdownService):
+    def __init__(
+        self,
+        template_service: TemplateService,
+        markdown_service: MarkdownService,
+        render_cache: Optional[RenderCache] = None,
+        pandoc_service: Optional[PandocService] = None,
+        image_processor: Optional[ImageProcessor] = None,
+        native_renderer: Optional[NativeRenderer] = None,
+        pdf_service: Optional[PDFService] = None,
+        post_processors: Optional[List[PostProcessor]] = None,
+        css_bundler: Optional[CSSBundler] = None
+    ):
         self.template_service = template_service
         self.markdown_service = markdown_service
+        self.render_cache = render_cache or RenderCache()
+        self.pandoc_service = pandoc_service or markdown_service.pandoc_service
+        self.image_processor = image_processor or ImageProcessor()
+        self.native_renderer = native_renderer or NativeRenderer()
+        self.pdf_service = pdf_service or PDFService(self.render_cache)
+        self.post_processors = default_post_processors() if post_processors is None else post_processors
+        self.css_bundler = css_bundler or CSSBundler(template_service)
+        self.document_store = markdown_service.document_store
+        self._render_slots = asyncio.Semaphore(RENDER_CONCURRENCY)
+        self._executor = ThreadPoolExecutor(max_workers=RENDER_CONCURRENCY, thread_name_prefix="markcv-render")
     
     def generate_printable_html(
         self,
         template_id: str = "europass",
         paper_size: str = "a4",
-        theme_color: str = "blue"
+        theme_color: str = "blue",
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        output_format: str = "html"
     ) -> FileResponse:
-        """Generate a printable HTML version of the CV with the selected template"""
+        """Generate a printable HTML (or PDF) version of a CV, for callers without a running event loop"""
+        return asyncio.run(
+            self.generate_printable_html_async(template_id, paper_size, theme_color, document_id, output_format)
+        )
+    
+    def render_content(
+        self,
+        content: str,
+        template_id: str = "europass",
+        paper_size: str = "a4",
+        theme_color: str = "blue",
+        document_id: Optional[str] = None
+    ) -> Path:
+        """Render markdown with a template and return the rendered file in the render cache.
+        
+        The render is published as the document's cv.html when a document_id is given.
+        For callers without a running event loop, like the batch worker processes.
+        """
+        template_id = self.template_service.resolve_id(template_id)
+        return asyncio.run(self._render_html_async(content, template_id, paper_size, theme_color, document_id))
+    
+    async def render_content_async(
+        self,
+        content: str,
+        template_id: str = "europass",
+        paper_size: str = "a4",
+        theme_color: str = "blue",
+        document_id: Optional[str] = None
+    ) -> Path:
+        """Async render_content, sharing the render slots of the requests"""
+        template_id = self.template_service.resolve_id(template_id)
+        async with self._render_slots:
+            with render_metrics.render(template_id):
+                return await self._render_html_async(content, template_id, paper_size, theme_color, document_id)
+    
+    async def generate_printable_html_async(
+        self,
+        template_id: str = "europass",
+        paper_size: str = "a4",
+        theme_color: str = "blue",
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        output_format: str = "html"
+    ) -> FileResponse:
+        """Generate the printable HTML (or PDF) without blocking the event loop"""
+        output_file = await self.render_output_async(template_id, paper_size, theme_color, document_id, output_format)
+        return self.output_response(output_file, output_format)
+    
+    async def render_output_async(
+        self,
+        template_id: str = "europass",
+        paper_size: str = "a4",
+        theme_color: str = "blue",
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        output_format: str = "html",
+        content: Optional[str] = None
+    ) -> Path:
+        """Render a document to printable HTML (or PDF) and return the render cache entry.
+        
+        Renders content when it is given instead of reading the document, so a
+        caller that keyed the render on the content gets exactly that render.
+        """
+        self.document_store.validate(document_id)
+        check_formats([output_format])
+        template_id = self.template_service.resolve_id(template_id)
+        # Bursts of renders queue here instead of forking unbounded pandoc processes
+        async with self._render_slots:
+            with render_metrics.render(template_id):
+                try:
+                    html_file = await self._printable_html_async(template_id, paper_size, theme_color, document_id, content)
+                    if output_format == "pdf":
+                        pdf_file = await self.pdf_service.render_pdf_async(html_file, paper_size)
+                        await self._run_blocking(self._publish_pdf, pdf_file, document_id)
+                        return pdf_file
+                    return html_file
+                except subprocess.CalledProcessError as e:
+                    logger.error(f"HTML generation failed: {e.stderr}")
+                    raise HTTPException(status_code=500, detail=f"HTML generation failed: {e.stderr}")
+                except Exception as e:
+                    logger.error(f"Error generating HTML: {e}")
+                    raise HTTPException(status_code=500, detail=str(e))
+    
+    def output_response(self, output_file: Path, output_format: str = "html") -> FileResponse:
+        """Serve a render cache entry as the download for its format"""
+        if output_format == "pdf":
+            return self._pdf_response(output_file)
+        return self._file_response(output_file)
+    
+    async def _printable_html_async(
+        self,
+        template_id: str,
+        paper_size: str,
+        theme_color: str,
+        document_id: str,
+        content: Optional[str] = None
+    ) -> Path:
+        """Render a document's (or the given content's) printable HTML and return the render cache entry"""
         try:
-            # Get template path
-            try:
-                template_html = self.template_service.get_template_path(template_id)
-            except FileNotFoundError:
-                logger.warning(f"Template HTML not found for {template_id}, using default HTML generation")
-                return self.generate_default_html()
+            self.template_service.get_template_path(template_id)
+        except FileNotFoundError:
+            logger.warning(f"Template HTML not found for {template_id}, using default HTML generation")
+            return await self._run_blocking(self._default_html, document_id, content)
+        
+        if content is None:
+            content = await self.markdown_service.get_markdown_async(document_id)
+        return await self._render_html_async(content, template_id, paper_size, theme_color, document_id)
+    
+    async def _render_html_async(
+        self,
+        content: str,
+        template_id: str,
+        paper_size: str,
+        theme_color: str,
+        document_id: Optional[str]
+    ) -> Path:
+        """The render pipeline behind every entry point, its blocking steps on the render executor.
+        
+        template_id must already be resolved. Serves an identical earlier render
+        from the cache, otherwise renders natively or with pandoc, and publishes
+        the result as the document's cv.html when a document_id is given.
+        """
+        template_html = self.template_service.get_template_path(template_id)
+        # Compiling a bundle reads and minifies the theme CSS: not on the event loop
+        css_bundle = await self._run_blocking(self.css_bundler.bundle, template_id, paper_size, theme_color)
+        css_file = css_bundle.path
+        metadata = await self._run_blocking(self.template_service.get_template_metadata, template_id)
+        print_sizes = metadata.get("printImages", {})
+        
+        # Serve an identical earlier render straight from the cache
+        cache_key = await self._run_blocking(
+            self._render_cache_key, content, template_id, paper_size, theme_color, print_sizes
+        )
+        cached_html = await self._run_blocking(self.render_cache.get, cache_key)
+        if cached_html:
+            logger.info(f"Serving cached render for template {template_id}")
+            await self._run_blocking(self._publish_html, cached_html, document_id)
+            return cached_html
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_dir_path = Path(temp_dir)
+            output_file = temp_dir_path / "cv.html"
             
-            html_file = DATA_DIR / "cv.html"
+            rendered = await self._run_blocking(
+                self._render_native,
+                content, output_file, template_id, template_html, css_file, paper_size, theme_color, print_sizes
+            )
             
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_dir_path = Path(temp_dir)
-                
-                # Get markdown content
-                content = self.markdown_service.get_markdown()
-                
-                # Extract profile image
-                first_image, first_image_id, content = self.markdown_service.extract_profile_image(content)
-                
-                # Extract image attributes for positioning
-                image_attributes = self.markdown_service.extract_image_attributes(content)
-                
-                # Extract and process sections
-                sections = self.markdown_service.extract_sections(content)
-                processed_sections = self.markdown_service.process_sections(sections)
-                
-                # Set up temporary directory for images
-                temp_images_dir = temp_dir_path / "images"
-                temp_images_dir.mkdir(exist_ok=True)
-                
-                # Process image paths in markdown
-                self._process_images(content, temp_images_dir)
-                
-                # Write processed markdown to temp file
-                temp_md_file = temp_dir_path / "input.md"
-                with open(temp_md_file, "w") as f:
-                    f.write(content)
-                
-                # Build pandoc command
-                css_file = f"/app/static/css/themes/{template_id}.css"
-                
-                cmd_html = [
-                    "pandoc",
-                    str(temp_md_file),
-                    "-o", str(html_file),
-                    "--template", str(template_html),
-                    "--standalone",
-                    "--self-contained",
-                    "--css", css_file,
-                    "--variable", f"papersize={paper_size}",
-                    "--variable", f"themecolor={theme_color}"
-                ]
-                
-                # Add profile image if available
-                if first_image:
-                    cmd_html.extend(["--variable", f"first_image={first_image}"])
-                    
-                    # Add image positioning if available
-                    if first_image_id and first_image_id in image_attributes:
-                        x_offset = image_attributes[first_image_id]["x_offset"]
-                        y_offset = image_attributes[first_image_id]["y_offset"]
-                        cmd_html.extend(["--variable", f"image_x_offset={x_offset}"])
-                        cmd_html.extend(["--variable", f"image_y_offset={y_offset}"])
-                
-                # Add processed sections
-                for info in processed_sections["contact_info"]:
-                    cmd_html.extend(["--variable", f"contact_info={info}"])
-                
-                for skill in processed_sections["skills"]:
-                    cmd_html.extend(["--variable", f"skills={skill}"])
-                
-                for language in processed_sections["languages"]:
-                    cmd_html.extend(["--variable", f"languages={language}"])
-                
-                cmd_html.extend(["--resource-path", str(temp_dir_path)])
-                
-                # Run pandoc
-                logger.info(f"Generating print-friendly HTML: {' '.join(cmd_html)}")
-                result_html = subprocess.run(
-                    cmd_html,
-                    check=True,
-                    capture_output=True,
-                    text=True
+            if not rendered:
+                cmd_html = await self._run_blocking(
+                    self._build_render_command,
+                    content, temp_dir_path, output_file, template_html, css_file, paper_size, theme_color, print_sizes
                 )
                 
-                if not html_file.exists():
-                    logger.error("HTML file was not generated")
-                    raise HTTPException(status_code=500, detail="HTML generation failed")
-                
-                # Add print script
-                self._add_print_script(html_file)
-                
-                logger.info(f"Print-friendly HTML generated successfully at {html_file}")
-                
-                return FileResponse(
-                    path=str(html_file),
-                    filename="cv.html",
-                    media_type="text/html"
-                )
-        except subprocess.CalledProcessError as e:
-            logger.error(f"HTML generation failed: {e.stderr}")
-            raise HTTPException(status_code=500, detail=f"HTML generation failed: {e.stderr}")
-        except Exception as e:
-            logger.error(f"Error generating HTML: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+                logger.info(f"Generating print-friendly HTML: {' '.join(cmd_html)}")
+                with render_metrics.stage("pandoc") as stage:
+                    await self.pandoc_service.run_async(cmd_html[1:])
+                    stage.output_bytes = self._output_size(output_file)
+            
+            return await self._run_blocking(self._finish_render, output_file, cache_key, document_id)
     
-    def generate_default_html(self) -> FileResponse:
+    def generate_default_html(self, document_id: str = DEFAULT_DOCUMENT_ID) -> FileResponse:
         """Generate HTML using the default method (fallback)"""
         try:
-            html_file = DATA_DIR / "cv.html"
+            return self._file_response(self._default_html(document_id))
+        except Exception as e:
+            logger.error(f"Error generating default HTML: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    def _default_html(self, document_id: str, content: Optional[str] = None) -> Path:
+        """Render a document without a template and return the render cache entry"""
+        if content is None:
+            content = self.markdown_service.get_markdown(document_id)
+        cache_key = self.render_cache.make_key("default-html", content)
+        cached_html = self.render_cache.get(cache_key)
+        if cached_html:
+            self._publish_html(cached_html, document_id)
+            return cached_html
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_md_file = Path(temp_dir) / "input.md"
+            temp_md_file.write_text(content)
+            output_file = Path(temp_dir) / "cv.html"
             
             cmd_html = [
                 "pandoc",
-                str(DATA_DIR / "cv.md"),
-                "-o", str(html_file),
+                str(temp_md_file),
+                "-o", str(output_file),
                 "--standalone",
                 "--self-contained",
                 "--css=/app/static/css/pdf.css",
             ]
             
             logger.info(f"Generating default print-friendly HTML: {' '.join(cmd_html)}")
-            result_html = subprocess.run(
-                cmd_html,
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            self.pandoc_service.run(cmd_html[1:])
             
-            if not html_file.exists():
-                logger.error("HTML file was not generated")
-                raise HTTPException(status_code=500, detail="HTML generation failed")
+            return self._finish_render(output_file, cache_key, document_id)
+    
+    def _build_render_command(
+        self,
+        content: str,
+        temp_dir_path: Path,
+        output_file: Path,
+        template_html: Path,
+        css_file: Path,
+        paper_size: str,
+        theme_color: str,
+        print_sizes: Dict[str, int]
+    ) -> List[str]:
+        """Prepare the render inputs in a temp directory and build the pandoc command"""
+        with render_metrics.stage("extraction") as stage:
+            # Extract profile image
+            first_image, first_image_id, content = self.markdown_service.extract_profile_image(content)
             
-            self._add_print_script(html_file)
+            # Extract image attributes for positioning
+            image_attributes = self.markdown_service.extract_image_attributes(content)
             
-            logger.info(f"Default print-friendly HTML generated successfully at {html_file}")
+            # Extract sections
+            sections = self.markdown_service.extract_sections(content)
+            stage.output_bytes = len(content.encode("utf-8"))
+        
+        # Process sections
+        processed_sections = self.markdown_service.process_sections(sections)
+        
+        # Set up temporary directory for images
+        temp_images_dir = temp_dir_path / "images"
+        temp_images_dir.mkdir(exist_ok=True)
+        
+        with render_metrics.stage("image_copy") as stage:
+            # Process image paths in markdown
+            content = self._process_images(content, temp_images_dir, print_sizes)
             
-            return FileResponse(
-                path=str(html_file),
-                filename="cv.html",
-                media_type="text/html"
-            )
-        except Exception as e:
-            logger.error(f"Error generating default HTML: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            # The profile image was removed from the content above, copy it separately
+            if first_image_id:
+                profile_source = self._print_image(
+                    first_image_id, print_sizes.get("profileWidth"), print_sizes.get("profileHeight")
+                )
+                if profile_source.exists():
+                    shutil.copy(profile_source, temp_images_dir / first_image_id)
+            stage.output_bytes = sum(f.stat().st_size for f in temp_images_dir.iterdir())
+        
+        # Write processed markdown to temp file
+        temp_md_file = temp_dir_path / "input.md"
+        with open(temp_md_file, "w") as f:
+            f.write(content)
+        
+        # Build pandoc command
+        cmd_html = [
+            "pandoc",
+            str(temp_md_file),
+            "-o", str(output_file),
+            "--template", str(template_html),
+            "--standalone",
+            "--self-contained",
+            "--css", str(css_file.resolve()),
+            "--variable", f"papersize={paper_size}",
+            "--variable", f"themecolor={theme_color}"
+        ]
+        
+        # Add profile image if available
+        if first_image:
+            cmd_html.extend(["--variable", f"first_image={first_image}"])
+            
+            # Add image positioning if available
+            if first_image_id and first_image_id in image_attributes:
+                x_offset = image_attributes[first_image_id]["x_offset"]
+                y_offset = image_attributes[first_image_id]["y_offset"]
+                cmd_html.extend(["--variable", f"image_x_offset={x_offset}"])
+                cmd_html.extend(["--variable", f"image_y_offset={y_offset}"])
+        
+        # Add processed sections
+        for info in processed_sections["contact_info"]:
+            cmd_html.extend(["--variable", f"contact_info={info}"])
+        
+        for skill in processed_sections["skills"]:
+            cmd_html.extend(["--variable", f"skills={skill}"])
+        
+        for language in processed_sections["languages"]:
+            cmd_html.extend(["--variable", f"languages={language}"])
+        
+        cmd_html.extend(["--resource-path", str(temp_dir_path)])
+        return cmd_html
     
-    def _process_images(self, content: str, temp_images_dir: Path) -> str:
-        """Copy images to temp directory and update paths in markdown"""
-        import re
+    def _render_native(
+        self,
+        content: str,
+        output_file: Path,
+        template_id: str,
+        template_html: Path,
+        css_file: Path,
+        paper_size: str,
+        theme_color: str,
+        print_sizes: Dict[str, int]
+    ) -> bool:
+        """Render in-process for templates that select the native engine; False means use pandoc"""
+        if self._render_engine(template_id) != "native":
+            return False
         
-        image_pattern = r"!\[(.*?)\]\(((?:/api/images/|/data/images/)[^)]+)\)"
-        images = re.findall(image_pattern, content)
+        with render_metrics.stage("extraction") as stage:
+            first_image, first_image_id, content = self.markdown_service.extract_profile_image(content)
+            image_attributes = self.markdown_service.extract_image_attributes(content)
+            sections = self.markdown_service.extract_sections(content)
+            stage.output_bytes = len(content.encode("utf-8"))
         
-        for alt_text, image_url in images:
-            image_id = image_url.split("/")[-1]
-            source_path = IMAGE_DIR / image_id
+        with render_metrics.stage("native_render") as stage:
+            content, images = self._resolve_images(content, print_sizes)
+            if not self.native_renderer.supports(content):
+                logger.info("Rendering with pandoc: the CV uses markdown the native engine does not support")
+                return False
             
-            if source_path.exists():
-                dest_path = temp_images_dir / image_id
-                shutil.copy(source_path, dest_path)
-                
-                content = content.replace(
-                    f"![{alt_text}]({image_url})",
-                    f"![{alt_text}](images/{image_id})"
+            # The same variables the pandoc command line passes
+            variables = {"papersize": paper_size, "themecolor": theme_color}
+            if first_image:
+                images[first_image] = self._print_image(
+                    first_image_id, print_sizes.get("profileWidth"), print_sizes.get("profileHeight")
+                )
+                variables["first_image"] = first_image
+                if first_image_id in image_attributes:
+                    variables["image_x_offset"] = str(image_attributes[first_image_id]["x_offset"])
+                    variables["image_y_offset"] = str(image_attributes[first_image_id]["y_offset"])
+            
+            for section_name, section_items in sections.items():
+                variables[section_name] = [self.native_renderer.convert_fragment(item) for item in section_items]
+            
+            try:
+                html = self.native_renderer.render(
+                    template_html,
+                    self.template_service.get_template_version(template_id),
+                    css_file,
+                    variables,
+                    content,
+                    images
                 )
+            except UnsupportedTemplate:
+                return False
+            
+            output_file.write_text(html)
+            stage.output_bytes = self._output_size(output_file)
         
+        logger.info(f"Rendered print-friendly HTML natively for template {template_id}")
+        return True
+    
+    def _render_engine(self, template_id: str) -> str:
+        """Pick "native" for templates whose metadata.json opts in, otherwise "pandoc"""
+        if NATIVE_RENDER_ENABLED and self.template_service.get_template_metadata(template_id).get("renderEngine") == "native":
+            return "native"
+        return "pandoc"
+    
+    def _finish_render(self, output_file: Path, cache_key: str, document_id: Optional[str] = DEFAULT_DOCUMENT_ID) -> Path:
+        """Post-process a fresh render into the cache and publish it as the document's cv.html"""
+        if not output_file.exists():
+            logger.error("HTML file was not generated")
+            raise HTTPException(status_code=500, detail="HTML generation failed")
+        
+        # Streamed straight into the cache entry, a chunk at a time
+        with render_metrics.stage("post_processing") as stage:
+            chunks = post_process(read_chunks(output_file), self.post_processors)
+            cached_html = self.render_cache.put_chunks(cache_key, chunks)
+            stage.output_bytes = self._output_size(cached_html)
+        
+        # The response is served from the cache entry, which is unique to the render's inputs
+        self._publish_html(cached_html, document_id)
+        return cached_html
+    
+    def _publish_html(self, cached_html: Path, document_id: Optional[str]) -> None:
+        """Publish a render as the document's cv.html, cached or fresh, so it always matches the last render"""
+        if document_id is not None:
+            html_key = self.document_store.publish(document_id, cached_html)
+            logger.info(f"Print-friendly HTML generated successfully at {html_key}")
+    
+    def _publish_pdf(self, pdf_file: Path, document_id: str) -> None:
+        published = self.document_store.publish(document_id, pdf_file, self.document_store.pdf_key(document_id))
+        logger.info(f"PDF generated successfully at {published}")
+    
+    def _file_response(self, html_file: Path) -> FileResponse:
+        # Cache entries are named by the hash of their render inputs, which doubles as the ETag
+        return CachedFileResponse(
+            html_file,
+            etag=f'"{html_file.stem}"',
+            filename="cv.html",
+            media_type="text/html"
+        )
+    
+    def _pdf_response(self, pdf_file: Path) -> FileResponse:
+        return CachedFileResponse(
+            pdf_file,
+            etag=f'"{pdf_file.stem}"',
+            filename="cv.pdf",
+            media_type="application/pdf"
+        )
+    
+    def _output_size(self, output_file: Path) -> int:
+        return output_file.stat().st_size if output_file.exists() else 0
+    
+    async def _run_blocking(self, func, *args):
+        """Run blocking work on the bounded render executor"""
+        loop = asyncio.get_running_loop()
+        # Carry context variables over so render metrics are labelled and attributed correctly
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args))
+    
+    def _render_cache_key(
+        self,
+        content: str,
+        template_id: str,
+        paper_size: str,
+        theme_color: str,
+        print_sizes: Dict[str, int]
+    ) -> str:
+        """Build a cache key from every input that affects the rendered HTML"""
+        parts = [content, template_id, paper_size, theme_color, self._render_engine(template_id)]
+        parts.append(f"{sorted(print_sizes.items())}:{OPTIMIZE_PRINT_IMAGES}:{PRINT_IMAGE_DPI}:{PRINT_IMAGE_QUALITY}")
+        
+        # The template version changes whenever its HTML, CSS or metadata does
+        parts.append(self.template_service.get_template_version(template_id))
+        parts.append(self.css_bundler.bundle(template_id, paper_size, theme_color).digest)
+        
+        # Images are identified by name, size and mtime rather than hashing their bytes
+        for image_id in sorted({image.image_id for image in scan_markdown(content).images}):
+            image_path = self.image_processor.print_source(image_id)
+            if image_path.exists():
+                stat = image_path.stat()
+                parts.append(f"{image_id}:{stat.st_size}:{stat.st_mtime_ns}")
+            else:
+                parts.append(f"{image_id}:missing")
+        
+        return self.render_cache.make_key(*parts)
+    
+    def _process_images(self, content: str, temp_images_dir: Path, print_sizes: Dict[str, int]) -> str:
+        """Copy print-sized images to temp directory and update paths in markdown"""
+        content, images = self._resolve_images(content, print_sizes)
+        for image_path, source_path in images.items():
+            shutil.copy(source_path, temp_images_dir / Path(image_path).name)
         return content
     
-    def _add_print_script(self, html_file: Path) -> None:
-        """Add print script to HTML file"""
-        with open(html_file, 'r') as f:
-            html_content = f.read()
-        
-        print_script = """
-        <script>
-        window.onload = function() {
-            setTimeout(function() {
-                window.print();
-            }, 500);
-        }
-        </script>
-        """
+    def _resolve_images(self, content: str, print_sizes: Dict[str, int]) -> Tuple[str, Dict[str, Path]]:
+        """Point uploaded images in the markdown at images/<id> and map each to its print-sized file"""
+        images = {}
+        parts = []
+        position = 0
         
-        html_content = html_content.replace('</body>', f'{print_script}</body>')
+        for image in scan_markdown(content).images:
+            # An explicit |width=NNNpx in the alt text narrows the content width
+            width = print_sizes.get("contentMaxWidth")
+            width_match = ALT_WIDTH_PATTERN.search(image.alt_text)
+            if width and width_match:
+                width = min(width, int(width_match.group(1)))
+            source_path = self._print_image(image.image_id, width)
+            
+            if source_path.exists():
+                images[f"images/{image.image_id}"] = source_path
+                
+                parts.append(content[position:image.start])
+                parts.append(f"![{image.alt_text}](images/{image.image_id})")
+                if image.attributes is not None:
+                    parts.append(f"{{{image.attributes}}}")
+                position = image.end
         
-        with open(html_file, 'w') as f:
-            f.write(html_content)
\ No newline at end of file
+        parts.append(content[position:])
+        return "".join(parts), images
+    
+    def _print_image(self, image_id: str, width: Optional[int], height: Optional[int] = None) -> Path:
+        """Pick the file to embed for an image shown at width x height CSS pixels"""
+        if not width:
+            # The template does not declare a display size
+            return self.image_processor.print_source(image_id)
+        
+        path = self.image_processor.print_image(image_id, width, height)
+        original = self.image_processor.original_path(image_id)
+        if path != original and original.exists():
+            logger.info(
+                f"Embedding {image_id} at {width}px: {path.stat().st_size} bytes "
+                f"instead of {original.stat().st_size}"
+            )
+        return path
\ No newline at end of file
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+import logging
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+from app.config import BROTLI_QUALITY, GZIP_LEVEL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("markcv")
+
+# Preferred first; brotli is only offered when the package is installed
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Clients may keep responses but must revalidate them before each use
+CACHE_CONTROL = "no-cache"
+
+def content_etag(*parts: Union[str, bytes]) -> str:
+    """Strong ETag derived from a hash of the given content"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8") if isinstance(part, str) else part)
+    return f'"{digest.hexdigest()[:32]}"'
+
+def is_not_modified(request_headers: Headers, etag: str, last_modified: Optional[float] = None) -> bool:
+    """Whether a conditional GET can be answered with 304 Not Modified"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since; compare weakly
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def cache_headers(etag: str, last_modified: Optional[float] = None) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+def conditional_json(
+    request: Request,
+    content: Any,
+    headers: Optional[Dict[str, str]] = None,
+    last_modified: Optional[float] = None
+) -> Response:
+    """JSON response with a content-hash ETag, or 304 if the client already has it"""
+    body = json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = headers or {}
+    # Extra headers (like X-Total-Count) are part of what the client caches, so they feed the ETag too
+    etag = content_etag(body, *(f"\n{name}:{value}" for name, value in sorted(headers.items())))
+    headers = {**headers, **cache_headers(etag, last_modified)}
+    if is_not_modified(request.headers, headers["ETag"], last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=JSONResponse.media_type, headers=headers)
+
+def accepted_encodings(request_headers: Headers) -> List[str]:
+    """Encodings from Accept-Encoding that we can serve, in our order of preference"""
+    accepted = set()
+    for item in request_headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return [encoding for encoding in ENCODINGS if encoding in accepted or "*" in accepted]
+
+def precompressed_path(path: Path, encoding: str) -> Path:
+    return path.with_name(path.name + ENCODING_SUFFIXES[encoding])
+
+def precompress(path: Path, block_size: int = 1024 * 1024) -> None:
+    """Write compressed copies of a file next to it, once, for CachedFileResponse to serve"""
+    size = path.stat().st_size
+    for encoding in ENCODINGS:
+        target = precompressed_path(path, encoding)
+        temp_path = target.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            # Compressed block by block, so large renders never sit in memory whole
+            with open(path, "rb") as source, open(temp_path, "wb") as output:
+                if encoding == "br":
+                    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+                    for block in iter(lambda: source.read(block_size), b""):
+                        output.write(compressor.process(block))
+                    output.write(compressor.finish())
+                else:
+                    # No name and mtime=0 keep the output byte-identical for identical input
+                    with gzip.GzipFile(filename="", fileobj=output, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as compressed:
+                        shutil.copyfileobj(source, compressed, block_size)
+            compressed_size = temp_path.stat().st_size
+            if compressed_size >= size:
+                temp_path.unlink()
+                continue
+            os.replace(temp_path, target)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        logger.info(f"Precompressed {path.name} with {encoding}: {size} -> {compressed_size} bytes")
+
+class CachedFileResponse(FileResponse):
+    """FileResponse for immutable files (render cache entries) named by a content hash.
+    
+    Answers If-None-Match/If-Modified-Since with 304, and serves the .br/.gz
+    copy written by precompress() when the client accepts it, so nothing is
+    compressed per request.
+    """
+    
+    def __init__(self, path: Path, etag: str, **kwargs):
+        super().__init__(path=str(path), **kwargs)
+        self.last_modified = os.stat(path).st_mtime
+        self.headers.update(cache_headers(etag, self.last_modified))
+        self.headers["Vary"] = "Accept-Encoding"
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = Headers(scope=scope)
+        if is_not_modified(request_headers, self.headers["etag"], self.last_modified):
+            headers = {name: self.headers[name] for name in ("etag", "last-modified", "cache-control", "vary")}
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+        
+        for encoding in accepted_encodings(request_headers):
+            compressed = precompressed_path(Path(self.path), encoding)
+            if compressed.is_file():
+                # Content-Length comes from the stat of whichever file is sent
+                self.path = str(compressed)
+                self.headers["content-encoding"] = encoding
+                break
+        await super().__call__(scope, receive, send)
\ No newline at end of file
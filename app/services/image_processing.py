@@ -0,0 +1,146 @@
+import math
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+
+from app.config import (
+    IMAGE_DERIVATIVE_DIR,
+    OPTIMIZE_PRINT_IMAGES,
+    PRINT_IMAGE_DPI,
+    PRINT_IMAGE_MAX_PX,
+    PRINT_IMAGE_QUALITY,
+)
+from app.services.storage import Storage, default_storage, image_key
+
+logger = logging.getLogger("markcv")
+
+# Formats we re-encode; anything else (e.g. animated GIFs, SVG) is used as uploaded
+DERIVATIVE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+# CSS pixels per inch
+CSS_DPI = 96
+
+class ImageProcessor:
+    """Creates downscaled, metadata-free derivatives of uploaded images for printing"""
+
+    def __init__(self, derivative_dir: Path = IMAGE_DERIVATIVE_DIR, storage: Optional[Storage] = None):
+        self.derivative_dir = derivative_dir
+        self.storage = storage or default_storage()
+        self.original_bytes = 0
+        self.embedded_bytes = 0
+        self._lock = threading.Lock()
+
+    def print_derivative_path(self, image_id: str) -> Path:
+        return self.derivative_dir / f"print-{image_id}"
+
+    def print_source(self, image_id: str) -> Path:
+        """Return the file the renderer should embed for an image: the print
+        derivative if it has been generated, otherwise the original upload"""
+        derivative = self.print_derivative_path(image_id)
+        if derivative.exists():
+            return derivative
+        return self.original_path(image_id)
+
+    def original_path(self, image_id: str) -> Path:
+        """Local file of the uploaded image; does not exist if there is no such upload"""
+        return self.storage.local_path(image_key(image_id))
+
+    def create_print_derivative(self, image_id: str) -> Optional[Path]:
+        """Downscale an uploaded image to print resolution, keeping its format"""
+        source = self.original_path(image_id)
+        if source.suffix.lower() not in DERIVATIVE_FORMATS or not source.exists():
+            return None
+
+        derivative = self._resize(
+            source, self.print_derivative_path(image_id), PRINT_IMAGE_MAX_PX, PRINT_IMAGE_MAX_PX, cover=False
+        )
+        if derivative:
+            logger.info(f"Created print derivative for {image_id}")
+        return derivative
+
+    def print_image(self, image_id: str, width: int, height: Optional[int] = None) -> Path:
+        """Return the image sized for a display box of width x height CSS pixels
+        at PRINT_IMAGE_DPI, cached per image and size.
+
+        With a height the image covers the box (like `object-fit: cover`),
+        without one it fits the width.
+        """
+        source = self.original_path(image_id)
+        if not OPTIMIZE_PRINT_IMAGES or source.suffix.lower() not in DERIVATIVE_FORMATS or not source.exists():
+            return self.print_source(image_id)
+
+        target_width = math.ceil(width * PRINT_IMAGE_DPI / CSS_DPI)
+        target_height = math.ceil(height * PRINT_IMAGE_DPI / CSS_DPI) if height else 0
+        sized_path = self.derivative_dir / (
+            f"{source.stem}-{target_width}x{target_height}-q{PRINT_IMAGE_QUALITY}{source.suffix}"
+        )
+
+        if not sized_path.exists():
+            if not self._resize(source, sized_path, target_width, target_height, cover=bool(height)):
+                # Re-encoding does not shrink this image, cache the original so we don't retry
+                temp_path = self._temp_path(source.suffix)
+                shutil.copyfile(source, temp_path)
+                os.replace(temp_path, sized_path)
+
+        with self._lock:
+            self.original_bytes += source.stat().st_size
+            self.embedded_bytes += sized_path.stat().st_size
+        return sized_path
+
+    def stats(self) -> Dict[str, int]:
+        """Bytes of original images referenced by exports versus bytes actually embedded"""
+        with self._lock:
+            return {
+                "original_bytes": self.original_bytes,
+                "embedded_bytes": self.embedded_bytes,
+                "bytes_saved": self.original_bytes - self.embedded_bytes
+            }
+
+    def _resize(self, source: Path, destination: Path, width: int, height: int, cover: bool) -> Optional[Path]:
+        """Scale source down to the box, strip metadata and re-encode it in its own format.
+
+        Returns None when the result would not be smaller than the source.
+        """
+        # Imported on first use: Pillow is only needed once an image is resized, not at startup
+        from PIL import Image, ImageOps
+
+        image_format = DERIVATIVE_FORMATS[source.suffix.lower()]
+        # Write under a temp name so the renderer never embeds a partial file
+        temp_path = self._temp_path(source.suffix)
+        try:
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image)
+                if height:
+                    scale = (max if cover else min)(width / image.width, height / image.height)
+                else:
+                    scale = width / image.width
+                if scale < 1:
+                    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                    image = image.resize(size, Image.LANCZOS)
+                if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+
+                save_options = {"optimize": True}
+                if image_format in ("JPEG", "WEBP"):
+                    save_options["quality"] = PRINT_IMAGE_QUALITY
+                image.save(temp_path, image_format, **save_options)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not resize {source.name}: {e}")
+            temp_path.unlink(missing_ok=True)
+            return None
+
+        if temp_path.stat().st_size >= source.stat().st_size:
+            temp_path.unlink()
+            return None
+
+        os.replace(temp_path, destination)
+        return destination
+
+    def _temp_path(self, suffix: str) -> Path:
+        # Created on the first write, not when the service is constructed
+        self.derivative_dir.mkdir(parents=True, exist_ok=True)
+        return self.derivative_dir / f".{uuid.uuid4().hex}{suffix}"
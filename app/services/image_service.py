@@ -1,106 +1,195 @@
-import json
-import shutil
+import asyncio
+import hashlib
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import logging
 
+import aiofiles
 from fastapi import UploadFile, HTTPException
-from app.config import DATA_DIR, IMAGE_DIR
+from app.config import DEFAULT_DOCUMENT_ID, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_DIR
 from app.models import ImageData
+from app.services.image_processing import ImageProcessor
+from app.services.image_store import ImageMetadataStore
+from app.services.storage import Storage, default_storage, image_key
 
 logger = logging.getLogger("markcv")
 
 class ImageService:
-    def upload_image(self, file: UploadFile, alt_text: str) -> Dict[str, str]:
-        """Upload an image for the CV"""
+    def __init__(
+        self,
+        store: Optional[ImageMetadataStore] = None,
+        image_processor: Optional[ImageProcessor] = None,
+        storage: Optional[Storage] = None,
+        upload_dir: Path = UPLOAD_DIR
+    ):
+        self.store = store or ImageMetadataStore()
+        self.storage = storage or default_storage()
+        self.image_processor = image_processor or ImageProcessor(storage=self.storage)
+        self.upload_dir = upload_dir
+        self._derivative_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="markcv-images")
+    
+    def upload_image(self, file: UploadFile, alt_text: str, document_id: str = DEFAULT_DOCUMENT_ID) -> Dict[str, str]:
+        """Upload an image for a CV"""
         try:
-            content_type = file.content_type
-            if not content_type.startswith("image/"):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Only image files are allowed"
-                )
-                
-            file_extension = file.filename.split(".")[-1].lower()
-            unique_filename = f"{uuid.uuid4()}.{file_extension}"
-            file_path = IMAGE_DIR / unique_filename
+            file_extension = self._validate_upload(file)
+            temp_path = self._temp_path()
+            digest = hashlib.sha256()
+            size = 0
             
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            try:
+                with open(temp_path, "wb") as buffer:
+                    while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                        size = self._check_upload_size(size + len(chunk))
+                        digest.update(chunk)
+                        buffer.write(chunk)
                 
-            image_data = {
-                "id": unique_filename,
-                "original_name": file.filename,
-                "path": str(file_path),
-                "alt_text": alt_text,
-                "created_at": datetime.now().isoformat(),
-                "x_offset": 0,
-                "y_offset": 0
-            }
+                return self._store_upload(
+                    temp_path, digest.hexdigest(), size, file.filename, file_extension, alt_text, document_id
+                )
+            finally:
+                temp_path.unlink(missing_ok=True)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error uploading image: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    async def upload_image_async(
+        self,
+        file: UploadFile,
+        alt_text: str,
+        document_id: str = DEFAULT_DOCUMENT_ID
+    ) -> Dict[str, str]:
+        """Async counterpart of upload_image, streaming the upload to disk in chunks"""
+        try:
+            file_extension = self._validate_upload(file)
+            temp_path = self._temp_path()
+            digest = hashlib.sha256()
+            size = 0
             
-            images_metadata_file = DATA_DIR / "images_metadata.json"
-            if images_metadata_file.exists():
-                with open(images_metadata_file, "r") as f:
-                    images_metadata = json.load(f)
-            else:
-                images_metadata = []
+            try:
+                async with aiofiles.open(temp_path, "wb") as buffer:
+                    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                        size = self._check_upload_size(size + len(chunk))
+                        digest.update(chunk)
+                        await buffer.write(chunk)
                 
-            images_metadata.append(image_data)
-            
-            with open(images_metadata_file, "w") as f:
-                json.dump(images_metadata, f, indent=2)
-            
-            return {
-                "id": unique_filename,
-                "url": f"/data/images/{unique_filename}",
-                "alt_text": alt_text
-            }
+                return await asyncio.to_thread(
+                    self._store_upload,
+                    temp_path, digest.hexdigest(), size, file.filename, file_extension, alt_text, document_id
+                )
+            finally:
+                temp_path.unlink(missing_ok=True)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error uploading image: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
     
-    def list_images(self) -> List[ImageData]:
-        """List all uploaded images"""
-        images_metadata_file = DATA_DIR / "images_metadata.json"
-        if not images_metadata_file.exists():
-            return []
-            
-        with open(images_metadata_file, "r") as f:
-            images_metadata = json.load(f)
-            
+    def list_images(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        document_id: str = DEFAULT_DOCUMENT_ID
+    ) -> List[ImageData]:
+        """List a document's uploaded images, optionally one page at a time"""
         return [
             ImageData(
                 id=img["id"],
                 url=f"/data/images/{img['id']}",
                 alt_text=img["alt_text"],
                 created_at=img["created_at"],
-                x_offset=img.get("x_offset", 0),
-                y_offset=img.get("y_offset", 0)
+                x_offset=img["x_offset"],
+                y_offset=img["y_offset"]
             )
-            for img in images_metadata
+            for img in self.store.list(offset, limit, document_id)
         ]
     
-    def update_image_position(self, image_id: str, x_offset: int, y_offset: int) -> bool:
+    def count_images(self, document_id: str = DEFAULT_DOCUMENT_ID) -> int:
+        """Count a document's uploaded images"""
+        return self.store.count(document_id)
+    
+    def update_image_position(
+        self,
+        image_id: str,
+        x_offset: int,
+        y_offset: int,
+        document_id: str = DEFAULT_DOCUMENT_ID
+    ) -> bool:
         """Update the position offsets for an image"""
-        images_metadata_file = DATA_DIR / "images_metadata.json"
-        if not images_metadata_file.exists():
-            return False
-            
-        with open(images_metadata_file, "r") as f:
-            images_metadata = json.load(f)
+        return self.store.update_position(image_id, x_offset, y_offset, document_id)
+    
+    def _validate_upload(self, file: UploadFile) -> str:
+        """Reject non-image uploads and return the file extension"""
+        content_type = file.content_type or ""
+        if not content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400,
+                detail="Only image files are allowed"
+            )
+        return file.filename.split(".")[-1].lower()
+    
+    def _temp_path(self) -> Path:
+        """Uploads are received into a local file, and only stored once complete"""
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        return self.upload_dir / f".upload-{uuid.uuid4().hex}"
+    
+    def _check_upload_size(self, size: int) -> int:
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image is larger than the {MAX_UPLOAD_BYTES} byte limit"
+            )
+        return size
+    
+    def _store_upload(
+        self,
+        temp_path: Path,
+        sha256: str,
+        size: int,
+        original_name: str,
+        file_extension: str,
+        alt_text: str,
+        document_id: str
+    ) -> Dict[str, str]:
+        """Keep a fully received upload, or reuse an identical image the document already has"""
+        existing = self.store.get_by_sha256(sha256, document_id)
+        if existing and self.storage.exists(image_key(existing["id"])):
+            logger.info(f"Upload of {original_name} is a duplicate of {existing['id']}")
+            # The new alt text replaces the stored one, so the record matches the response
+            if alt_text != existing["alt_text"]:
+                self.store.update_alt_text(existing["id"], alt_text, document_id)
+            return {
+                "id": existing["id"],
+                "url": f"/data/images/{existing['id']}",
+                "alt_text": alt_text
+            }
         
-        updated = False
-        for img in images_metadata:
-            if img["id"] == image_id:
-                img["x_offset"] = x_offset
-                img["y_offset"] = y_offset
-                updated = True
-                break
-                
-        if updated:
-            with open(images_metadata_file, "w") as f:
-                json.dump(images_metadata, f, indent=2)
-                
-        return updated
\ No newline at end of file
+        unique_filename = f"{uuid.uuid4()}.{file_extension}"
+        key = image_key(unique_filename)
+        self.storage.write_file(key, temp_path)
+        
+        self.store.add({
+            "id": unique_filename,
+            "document_id": document_id,
+            "original_name": original_name,
+            "path": key,
+            "alt_text": alt_text,
+            "created_at": datetime.now().isoformat(),
+            "x_offset": 0,
+            "y_offset": 0,
+            "sha256": sha256,
+            "size": size
+        })
+        
+        # Print-resolution derivatives are generated off the request path
+        self._derivative_executor.submit(self.image_processor.create_print_derivative, unique_filename)
+        
+        return {
+            "id": unique_filename,
+            "url": f"/data/images/{unique_filename}",
+            "alt_text": alt_text
+        }
\ No newline at end of file
@@ -0,0 +1,204 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import logging
+
+from app.config import DATA_DIR, DEFAULT_DOCUMENT_ID, IMAGE_DB_FILE, LOCAL_IMAGE_DB_FILE, STORAGE_BACKEND
+
+logger = logging.getLogger("markcv")
+
+LEGACY_METADATA_FILE = DATA_DIR / "images_metadata.json"
+
+IMAGE_COLUMNS = (
+    "id", "document_id", "original_name", "path", "alt_text", "created_at", "x_offset", "y_offset", "sha256", "size"
+)
+_INSERT_SQL = "INTO images ({}) VALUES ({})".format(", ".join(IMAGE_COLUMNS), ", ".join("?" * len(IMAGE_COLUMNS)))
+
+class ImageMetadataStore:
+    """Image metadata in SQLite (WAL mode), indexed by image id.
+    
+    Every write is a single atomic transaction, so concurrent uploads from
+    several threads or processes cannot lose each other's records and a
+    crash cannot leave a half-written file behind.
+    """
+    
+    def __init__(
+        self,
+        db_file: Path = IMAGE_DB_FILE,
+        legacy_file: Path = LEGACY_METADATA_FILE,
+        local_db_file: Optional[Path] = LOCAL_IMAGE_DB_FILE if STORAGE_BACKEND == "sqlite" else None
+    ):
+        self.db_file = db_file
+        self.legacy_file = legacy_file
+        self.local_db_file = local_db_file
+        self._local = threading.local()
+        self._prepared = False
+        self._prepare_lock = threading.Lock()
+    
+    def add(self, record: Dict[str, Any]) -> None:
+        """Insert a new image record"""
+        record = {"document_id": DEFAULT_DOCUMENT_ID, **record}
+        values = [record.get(column) for column in IMAGE_COLUMNS]
+        with self._connection() as conn:
+            conn.execute(f"INSERT {_INSERT_SQL}", values)
+    
+    def get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        """Look up one image record by id"""
+        row = self._connection().execute("SELECT * FROM images WHERE id = ?", (image_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def get_by_sha256(self, sha256: str, document_id: str = DEFAULT_DOCUMENT_ID) -> Optional[Dict[str, Any]]:
+        """Look up a document's image record by the SHA-256 of its content"""
+        row = self._connection().execute(
+            "SELECT * FROM images WHERE sha256 = ? AND document_id = ? ORDER BY seq LIMIT 1", (sha256, document_id)
+        ).fetchone()
+        return dict(row) if row else None
+    
+    def update_position(
+        self,
+        image_id: str,
+        x_offset: int,
+        y_offset: int,
+        document_id: str = DEFAULT_DOCUMENT_ID
+    ) -> bool:
+        """Update the position offsets of a document's image, returning False if it does not exist"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE images SET x_offset = ?, y_offset = ? WHERE id = ? AND document_id = ?",
+                (x_offset, y_offset, image_id, document_id)
+            )
+        return cursor.rowcount > 0
+    
+    def update_alt_text(self, image_id: str, alt_text: str, document_id: str = DEFAULT_DOCUMENT_ID) -> bool:
+        """Update the alt text of a document's image, returning False if it does not exist"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE images SET alt_text = ? WHERE id = ? AND document_id = ?",
+                (alt_text, image_id, document_id)
+            )
+        return cursor.rowcount > 0
+    
+    def list(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        document_id: str = DEFAULT_DOCUMENT_ID
+    ) -> List[Dict[str, Any]]:
+        """List a document's image records in upload order, one page at a time"""
+        rows = self._connection().execute(
+            "SELECT * FROM images WHERE document_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+            (document_id, -1 if limit is None else limit, offset)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def count(self, document_id: str = DEFAULT_DOCUMENT_ID) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM images WHERE document_id = ?", (document_id,)
+        ).fetchone()[0]
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._prepare()
+        return conn
+    
+    def _prepare(self) -> None:
+        """Create the schema and run the migrations on first use, not at construction"""
+        with self._prepare_lock:
+            if self._prepared:
+                return
+            self._create_schema()
+            self._migrate_legacy_json()
+            self._import_local_db()
+            self._prepared = True
+    
+    def _create_schema(self) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS images (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    document_id TEXT NOT NULL DEFAULT '{DEFAULT_DOCUMENT_ID}',
+                    original_name TEXT,
+                    path TEXT,
+                    alt_text TEXT NOT NULL DEFAULT '',
+                    created_at TEXT NOT NULL,
+                    x_offset INTEGER NOT NULL DEFAULT 0,
+                    y_offset INTEGER NOT NULL DEFAULT 0,
+                    sha256 TEXT,
+                    size INTEGER
+                )
+                """
+            )
+            
+            # Databases created before content hashing and documents were added lack these columns
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(images)")}
+            for column, column_type in (
+                ("sha256", "TEXT"),
+                ("size", "INTEGER"),
+                ("document_id", f"TEXT NOT NULL DEFAULT '{DEFAULT_DOCUMENT_ID}'")
+            ):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE images ADD COLUMN {column} {column_type}")
+            
+            conn.execute("CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256)")
+            conn.execute("CREATE INDEX IF NOT EXISTS images_document ON images (document_id, seq)")
+            # One-time imports already done, by name
+            conn.execute("CREATE TABLE IF NOT EXISTS imports (name TEXT PRIMARY KEY, imported REAL NOT NULL)")
+    
+    def _migrate_legacy_json(self) -> None:
+        """Import images_metadata.json once, then rename it out of the way"""
+        if not self.legacy_file.exists():
+            return
+        
+        try:
+            with open(self.legacy_file, "r") as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read legacy image metadata {self.legacy_file}: {e}")
+            return
+        
+        with self._connection() as conn:
+            for record in records:
+                record = {"document_id": DEFAULT_DOCUMENT_ID, "x_offset": 0, "y_offset": 0, "alt_text": "", **record}
+                conn.execute(f"INSERT OR IGNORE {_INSERT_SQL}", [record.get(column) for column in IMAGE_COLUMNS])
+        
+        migrated_file = self.legacy_file.with_name(self.legacy_file.name + ".migrated")
+        try:
+            self.legacy_file.replace(migrated_file)
+        except FileNotFoundError:
+            # Another worker process finished the same migration first
+            return
+        logger.info(f"Migrated {len(records)} image records from {self.legacy_file} to {self.db_file}")
+    
+    def _import_local_db(self) -> None:
+        """Import the records of the local images.db once into a shared database"""
+        if self.local_db_file is None or self.local_db_file == self.db_file or not self.local_db_file.exists():
+            return
+        
+        conn = self._connection()
+        conn.execute("ATTACH DATABASE ? AS local", (str(self.local_db_file),))
+        try:
+            # Older local databases may lack some columns; those keep their defaults
+            local_columns = {row["name"] for row in conn.execute("PRAGMA local.table_info(images)")}
+            columns = ", ".join(column for column in IMAGE_COLUMNS if column in local_columns)
+            with conn:
+                cursor = conn.execute("INSERT OR IGNORE INTO imports (name, imported) VALUES ('local_images', ?)", (time.time(),))
+                if cursor.rowcount == 0 or not local_columns:
+                    # Imported before, possibly by another process
+                    return
+                cursor = conn.execute(f"INSERT OR IGNORE INTO images ({columns}) SELECT {columns} FROM local.images ORDER BY seq")
+        finally:
+            conn.execute("DETACH DATABASE local")
+        logger.info(f"Imported {cursor.rowcount} image records from {self.local_db_file} to {self.db_file}")
\ No newline at end of file
@@ -0,0 +1,184 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+import logging
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from app.config import LIVE_COALESCE_SECONDS
+from app.services.markdown_service import MarkdownService
+from app.services.preview_service import PreviewService
+from app.services.revision_log import apply_edits, content_version, diff_edits
+
+logger = logging.getLogger("markcv")
+
+class LiveEditSession:
+    """One editor's live connection to a document.
+    
+    The client first syncs on the version it loaded, then sends edits
+    relative to the text it last sent. Messages that arrive within
+    LIVE_COALESCE_SECONDS, or while a save is running, are applied together,
+    so a burst of keystrokes costs one write and one preview render. Every
+    save is acknowledged with the new version and followed by the preview
+    fragments that changed.
+    
+    Client messages:
+        {"type": "sync", "version": "..."}
+        {"type": "edit", "seq": 1, "edits": [{"start": 0, "end": 0, "text": "..."}]}
+        {"type": "replace", "seq": 2, "markdown": "..."}  (overwrite after a conflict)
+    
+    Server messages: "ready", "saved", "preview", "conflict" and "error".
+    """
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        document_id: str,
+        markdown_service: MarkdownService,
+        preview_service: PreviewService,
+        coalesce_seconds: float = LIVE_COALESCE_SECONDS
+    ):
+        self.websocket = websocket
+        self.document_id = document_id
+        self.markdown_service = markdown_service
+        self.preview_service = preview_service
+        self.coalesce_seconds = coalesce_seconds
+        # The client's text, and the saved text and version it was based on; None until synced
+        self.content: Optional[str] = None
+        self.saved_content: Optional[str] = None
+        self.version: Optional[str] = None
+        self.preview_version: Optional[str] = None
+        self._overwrite = False
+        self._conflicted = False
+        self._closed = False
+        self._queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+    
+    async def run(self) -> None:
+        """Serve the connection until the client goes away, saving any edits still queued"""
+        await self.websocket.accept()
+        worker = asyncio.create_task(self._process())
+        try:
+            while True:
+                try:
+                    message = json.loads(await self.websocket.receive_text())
+                except ValueError:
+                    await self._send({"type": "error", "detail": "Messages must be JSON"})
+                    continue
+                await self._queue.put(message if isinstance(message, dict) else {})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._closed = True
+            await self._queue.put(None)
+            await worker
+    
+    async def _process(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            if batch[0] is not None:
+                # Let the rest of a burst arrive, then take everything that is queued
+                await asyncio.sleep(self.coalesce_seconds)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            closing = None in batch
+            try:
+                await self._handle([message for message in batch if message is not None])
+            except Exception as e:
+                logger.error(f"Error in live session for {self.document_id}: {e}")
+                await self._send({"type": "error", "detail": str(e)})
+            if closing:
+                return
+    
+    async def _handle(self, messages: List[Dict[str, Any]]) -> None:
+        pending_seq = None
+        for message in messages:
+            kind = message.get("type")
+            if kind == "sync":
+                if pending_seq is not None:
+                    await self._flush(pending_seq)
+                    pending_seq = None
+                await self._sync(message.get("version"))
+            elif kind == "replace":
+                self.content = str(message.get("markdown", ""))
+                self._overwrite = True
+                self._conflicted = False
+                pending_seq = message.get("seq")
+            elif kind == "edit":
+                if self.content is None:
+                    # After a conflict the client is already deciding what to do; edits still in flight are dropped
+                    if not self._conflicted:
+                        await self._send({"type": "error", "detail": "Sync before sending edits", "resync": True})
+                    continue
+                try:
+                    edits = [(edit["start"], edit["end"], edit.get("text", "")) for edit in message.get("edits", [])]
+                    self.content = apply_edits(self.content, edits)
+                except (ValueError, KeyError, TypeError) as e:
+                    # The client's text no longer matches ours; drop its unsaved edits and start over
+                    self.content = None
+                    pending_seq = None
+                    await self._send({"type": "error", "detail": f"Invalid edits: {e}", "resync": True})
+                    continue
+                pending_seq = message.get("seq")
+            else:
+                await self._send({"type": "error", "detail": f"Unknown message type: {kind}"})
+        
+        if pending_seq is not None:
+            await self._flush(pending_seq)
+    
+    async def _sync(self, version: Optional[str]) -> None:
+        current = await self.markdown_service.get_markdown_async(self.document_id)
+        current_version = content_version(current)
+        if version is not None and version != current_version:
+            self.content = None
+            self._conflicted = True
+            await self._send({"type": "conflict", "version": current_version})
+            return
+        
+        self.content = self.saved_content = current
+        self.version = current_version
+        self._overwrite = False
+        self._conflicted = False
+        await self._send({"type": "ready", "version": current_version})
+        await self._send_preview()
+    
+    async def _flush(self, seq: Any) -> None:
+        """Save the client's text with one write, then push the preview"""
+        if self.content is None:
+            return
+        
+        content = self.content
+        try:
+            if self._overwrite:
+                revision = await self.markdown_service.save_markdown_async(content, self.document_id)
+            else:
+                revision = await self.markdown_service.patch_markdown_async(
+                    diff_edits(self.saved_content, content), self.version, self.document_id
+                )
+        except HTTPException as e:
+            if e.status_code != 409:
+                raise
+            # Saved elsewhere since we synced: the client decides whether to reload or overwrite
+            self.content = None
+            self._conflicted = True
+            await self._send({"type": "conflict", "seq": seq, "version": e.detail["version"]})
+            return
+        
+        self.saved_content = content
+        self.version = revision.version
+        self._overwrite = False
+        await self._send({"type": "saved", "seq": seq, "version": revision.version, "revision": revision.revision})
+        await self._send_preview()
+    
+    async def _send_preview(self) -> None:
+        if self._closed:
+            return
+        preview = await self.preview_service.render_preview_async(self.saved_content, self.preview_version)
+        self.preview_version = preview["version"]
+        await self._send({"type": "preview", **preview})
+    
+    async def _send(self, message: Dict[str, Any]) -> None:
+        try:
+            await self.websocket.send_json(message)
+        except Exception as e:
+            # Closed while we were working; whatever we saved stays saved
+            logger.debug(f"Could not send {message.get('type')} to a live client: {e}")
\ No newline at end of file
@@ -0,0 +1,113 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from app.config import SCAN_CACHE_SIZE
+
+IMAGE_PATTERN = re.compile(r"!\[(.*?)\]\(((?:/api/images/|/data/images/)[^)]+)\)(?:\{([^}]*)\})?")
+_ATTRIBUTE_PATTERNS = {
+    name: re.compile(rf"\.{name}=(-?\d+)")
+    for name in ("x-offset", "y-offset")
+}
+
+class ImageRef(NamedTuple):
+    """An uploaded image referenced from the markdown"""
+    alt_text: str
+    url: str
+    image_id: str
+    attributes: Optional[str]
+    start: int
+    end: int
+    line: int
+
+class Section(NamedTuple):
+    """A block of the document starting at a `## ` heading (or the document start)"""
+    heading: str
+    start: int
+    end: int
+
+class ScanResult(NamedTuple):
+    """Everything the render pipeline needs to know about a markdown document"""
+    images: Tuple[ImageRef, ...]
+    sections: Tuple[Section, ...]
+    contact_info: Tuple[str, ...]
+    skills: Tuple[str, ...]
+    languages: Tuple[str, ...]
+
+def scan_markdown(content: str) -> ScanResult:
+    """Scan a markdown document once, memoized per content"""
+    return _scan(content)
+
+@lru_cache(maxsize=SCAN_CACHE_SIZE)
+def _scan(content: str) -> ScanResult:
+    line_starts = []
+    sections = []
+    contact_info = []
+    skills = []
+    languages = []
+    
+    section_heading = ""
+    section_start = 0
+    in_contact = False
+    seen_title = False
+    current_list = None
+    
+    offset = 0
+    for line in content.split("\n"):
+        line_starts.append(offset)
+        
+        if line.startswith("## "):
+            sections.append(Section(section_heading, section_start, offset))
+            section_heading = line
+            section_start = offset
+            in_contact = False
+            if line.startswith("## Skills"):
+                current_list = skills
+            elif line.startswith("## Languages"):
+                current_list = languages
+            else:
+                current_list = None
+        elif line.startswith("# ") and not seen_title:
+            # Contact info is everything between the main heading and the first section
+            seen_title = True
+            in_contact = True
+        else:
+            if in_contact and line.strip() and not line.startswith("!["):
+                contact_info.append(line)
+            if current_list is not None and line.startswith("- "):
+                current_list.append(line)
+        
+        offset += len(line) + 1
+    
+    sections.append(Section(section_heading, section_start, len(content)))
+    
+    images = []
+    line_index = 0
+    for match in IMAGE_PATTERN.finditer(content):
+        while line_index + 1 < len(line_starts) and line_starts[line_index + 1] <= match.start():
+            line_index += 1
+        alt_text, url, attributes = match.groups()
+        images.append(ImageRef(
+            alt_text=alt_text,
+            url=url,
+            image_id=url.split("/")[-1],
+            attributes=attributes,
+            start=match.start(),
+            end=match.end(),
+            line=line_index
+        ))
+    
+    return ScanResult(
+        images=tuple(images),
+        sections=tuple(section for section in sections if section.heading or section.end > section.start),
+        contact_info=tuple(contact_info),
+        skills=tuple(skills),
+        languages=tuple(languages)
+    )
+
+def find_attribute(attributes: Optional[str], name: str) -> Optional[int]:
+    """Read an integer `.name=value` attribute from an image attribute block"""
+    if not attributes:
+        return None
+    match = _ATTRIBUTE_PATTERNS[name].search(attributes)
+    return int(match.group(1)) if match else None
@@ -1,185 +1,290 @@
+import asyncio
 import re
-import subprocess
-import tempfile
-from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+import threading
+import uuid
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple, Optional
 import logging
 
 from fastapi import HTTPException
-from app.config import MARKDOWN_FILE, DEFAULT_MARKDOWN
+from app.config import DEFAULT_DOCUMENT_ID, DEFAULT_MARKDOWN
+from app.services.document_store import DocumentStore
+from app.services.markdown_scanner import find_attribute, scan_markdown
+from app.services.metrics import render_metrics
+from app.services.pandoc_service import PandocService
+from app.services.revision_log import Edit, Revision, RevisionLog, apply_edits, content_version
 
 logger = logging.getLogger("markcv")
 
+_BATCH_UNSAFE_PATTERN = re.compile(r"^\s{0,3}[#<]|\[\^|^\s{0,3}\[[^\]]+\]:", re.MULTILINE)
+
 class MarkdownService:
-    def get_markdown(self) -> str:
-        """Get the current markdown content"""
+    def __init__(
+        self,
+        pandoc_service: Optional[PandocService] = None,
+        document_store: Optional[DocumentStore] = None
+    ):
+        self.pandoc_service = pandoc_service or PandocService()
+        self.document_store = document_store or DocumentStore()
+        self.storage = self.document_store.storage
+        self._revision_logs: Dict[str, RevisionLog] = {}
+        self._lock = threading.Lock()
+    
+    def get_markdown(self, document_id: str = DEFAULT_DOCUMENT_ID) -> str:
+        """Get the current markdown content of a document"""
+        markdown_key = self.document_store.markdown_key(document_id)
         try:
-            with open(MARKDOWN_FILE, "r") as f:
-                content = f.read()
-            return content
+            return self.storage.read_text(markdown_key)
         except FileNotFoundError:
-            logger.error(f"Markdown file not found: {MARKDOWN_FILE}")
-            with open(MARKDOWN_FILE, "w") as f:
-                f.write(DEFAULT_MARKDOWN)
+            logger.error(f"Markdown file not found: {markdown_key}")
+            with self._document_lock(document_id):
+                # Another process may have saved the document meanwhile; never overwrite that
+                current = self._read_current(document_id)
+                if current is not None:
+                    return current
+                self.storage.write_text(markdown_key, DEFAULT_MARKDOWN)
             return DEFAULT_MARKDOWN
         except Exception as e:
             logger.error(f"Error reading markdown file: {e}")
             raise HTTPException(status_code=500, detail=str(e))
     
-    def save_markdown(self, content: str) -> bool:
-        """Save markdown content to file"""
-        try:
-            with open(MARKDOWN_FILE, "w") as f:
-                f.write(content)
-            logger.info("Markdown file saved successfully")
-            return True
-        except Exception as e:
-            logger.error(f"Error saving markdown file: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+    def save_markdown(
+        self,
+        content: str,
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        base_version: Optional[str] = None
+    ) -> Revision:
+        """Save the full markdown content of a document, refusing it if the document moved on from base_version"""
+        with self._document_lock(document_id):
+            current = self._read_current(document_id)
+            if base_version is not None and current is not None:
+                self._check_base(current, base_version)
+            return self._commit(document_id, current, content)
+    
+    def patch_markdown(
+        self,
+        edits: Sequence[Edit],
+        base_version: str,
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        version: Optional[str] = None
+    ) -> Revision:
+        """Apply edits made against base_version of a document and save the result.
+        
+        version, if given, is the hash the client expects the result to have,
+        so offsets computed against the wrong text are never saved.
+        """
+        with self._document_lock(document_id):
+            current = self._read_current(document_id) or ""
+            self._check_base(current, base_version)
+            try:
+                content = apply_edits(current, edits)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if version is not None and content_version(content) != version:
+                raise HTTPException(status_code=400, detail="Edits do not produce the expected version")
+            return self._commit(document_id, current, content, edits)
+    
+    def list_revisions(self, document_id: str = DEFAULT_DOCUMENT_ID) -> List[Revision]:
+        """Saved revisions of a document still in its revision log, oldest first"""
+        return self._revision_log(document_id).revisions()
+    
+    def get_revision(self, revision: int, document_id: str = DEFAULT_DOCUMENT_ID) -> str:
+        """Content of a document at a logged revision"""
+        content = self._revision_log(document_id).content_at(revision)
+        if content is None:
+            raise HTTPException(status_code=404, detail=f"Revision {revision} not found")
+        return content
+    
+    async def get_markdown_async(self, document_id: str = DEFAULT_DOCUMENT_ID) -> str:
+        """Async counterpart of get_markdown"""
+        return await asyncio.to_thread(self.get_markdown, document_id)
+    
+    async def save_markdown_async(
+        self,
+        content: str,
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        base_version: Optional[str] = None
+    ) -> Revision:
+        """Async counterpart of save_markdown"""
+        return await asyncio.to_thread(self.save_markdown, content, document_id, base_version)
+    
+    async def patch_markdown_async(
+        self,
+        edits: Sequence[Edit],
+        base_version: str,
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        version: Optional[str] = None
+    ) -> Revision:
+        """Async counterpart of patch_markdown"""
+        return await asyncio.to_thread(self.patch_markdown, edits, base_version, document_id, version)
     
     def extract_profile_image(self, content: str) -> Tuple[Optional[str], Optional[str], str]:
         """Extract the first image from markdown content and return image info and updated content"""
-        image_pattern = r"!\[(.*?)\]\(((?:/api/images/|/data/images/)[^)]+)(?:\{[^}]*\})?\)"
-        images = re.findall(image_pattern, content)
+        images = scan_markdown(content).images
+        if not images:
+            return None, None, content
         
-        first_image = None
-        first_image_id = None
-        first_image_markdown = None
-        
-        if images:
-            first_alt_text, first_image_url = images[0]
-            first_image_id = first_image_url.split("/")[-1]
-            first_image = f"images/{first_image_id}"
-            
-            # Look for the full markdown including any attributes
-            first_image_markdown_pattern = r"(!\[.*?\]\(" + re.escape(first_image_url) + r"\)(?:\{[^}]*\})?)"
-            first_image_match = re.search(first_image_markdown_pattern, content)
-            if first_image_match:
-                first_image_markdown = first_image_match.group(1)
+        first = images[0]
+        first_image_id = first.image_id
+        first_image = f"images/{first_image_id}"
         
         # Remove the first image from content if it's near the top
-        if first_image_markdown:
-            lines = content.split('\n')
-            for i, line in enumerate(lines):
-                if first_image_markdown in line and i < 5:
-                    lines[i] = lines[i].replace(first_image_markdown, '')
-                    content = '\n'.join(lines)
-                    break
+        if first.line < 5:
+            content = content[:first.start] + content[first.end:]
         
         return first_image, first_image_id, content
     
     def extract_image_attributes(self, markdown: str) -> Dict[str, Dict[str, int]]:
         """Extract custom attributes from image markdown"""
-        image_pattern = r"!\[(.*?)\]\(((?:/api/images/|/data/images/)[^)]+)\)(?:\{([^}]*)\})?"
-        images = re.findall(image_pattern, markdown)
-        
         image_attributes = {}
         
-        for alt_text, image_url, attrs_str in images:
-            image_id = image_url.split("/")[-1]
-            attrs = {"x_offset": 0, "y_offset": 0}
-            
-            if attrs_str:
-                x_offset_match = re.search(r'\.x-offset=(-?\d+)', attrs_str)
-                if x_offset_match:
-                    attrs["x_offset"] = int(x_offset_match.group(1))
-                
-                y_offset_match = re.search(r'\.y-offset=(-?\d+)', attrs_str)
-                if y_offset_match:
-                    attrs["y_offset"] = int(y_offset_match.group(1))
-            
-            image_attributes[image_id] = attrs
+        for image in scan_markdown(markdown).images:
+            image_attributes[image.image_id] = {
+                "x_offset": find_attribute(image.attributes, "x-offset") or 0,
+                "y_offset": find_attribute(image.attributes, "y-offset") or 0
+            }
         
         return image_attributes
     
     def extract_sections(self, content: str) -> Dict[str, List[str]]:
         """Extract contact info, skills, and languages sections from markdown"""
-        sections = {
-            "contact_info": [],
-            "skills": [],
-            "languages": []
+        scan = scan_markdown(content)
+        return {
+            "contact_info": list(scan.contact_info),
+            "skills": list(scan.skills),
+            "languages": list(scan.languages)
         }
-        
-        lines = content.split("\n")
-        
-        # Extract contact info (lines after the main heading)
-        for i, line in enumerate(lines):
-            if line.startswith("# "):
-                j = i + 1
-                while j < len(lines) and not lines[j].startswith("## "):
-                    if lines[j].strip() and not lines[j].startswith("!["):
-                        sections["contact_info"].append(lines[j])
-                    j += 1
-                break
-        
-        # Extract skills and languages
-        in_skills = False
-        in_languages = False
-        
-        for line in lines:
-            if line.startswith("## Skills"):
-                in_skills = True
-                in_languages = False
-                continue
-            elif line.startswith("## Languages"):
-                in_skills = False
-                in_languages = True
-                continue
-            elif line.startswith("## ") and line != "## Skills" and line != "## Languages":
-                in_skills = False
-                in_languages = False
-                continue
-            
-            if in_skills and line.strip() and line.startswith("- "):
-                sections["skills"].append(line)
-            elif in_languages and line.strip() and line.startswith("- "):
-                sections["languages"].append(line)
-        
-        return sections
     
     def process_markdown_text(self, text: str) -> str:
         """Process markdown text to HTML using pandoc"""
         try:
-            with tempfile.NamedTemporaryFile(suffix=".md", mode="w+", delete=False) as temp_file:
-                temp_file.write(text)
-                temp_file_path = temp_file.name
-            
-            cmd = [
-                "pandoc",
-                temp_file_path,
-                "-f", "markdown",
-                "-t", "html"
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            Path(temp_file_path).unlink()  # Delete the temp file
-            
-            # Remove wrapping <p> tags if it's a simple line
-            html = result.stdout.strip()
-            if html.startswith("<p>") and html.endswith("</p>") and html.count("<p>") == 1:
-                html = html[3:-4]
-            
-            return html
+            return self._unwrap_paragraph(self._run_pandoc(text))
         except Exception as e:
             logger.error(f"Error processing markdown: {e}")
             return text  # Return original text if processing fails
     
+    def process_markdown_batch(self, texts: List[str]) -> List[str]:
+        """Process several markdown fragments to HTML with a single pandoc run"""
+        results: List[Optional[str]] = [None] * len(texts)
+        batch_indexes = []
+        
+        for i, text in enumerate(texts):
+            if self._is_batch_safe(text):
+                batch_indexes.append(i)
+            else:
+                # Fragments that can link to each other are converted on their own
+                results[i] = self.process_markdown_text(text)
+        
+        if len(batch_indexes) == 1:
+            i = batch_indexes[0]
+            results[i] = self.process_markdown_text(texts[i])
+        elif batch_indexes:
+            sentinel = f"<!-- markcv-split-{uuid.uuid4().hex} -->"
+            joined = f"\n\n{sentinel}\n\n".join(texts[i] for i in batch_indexes)
+            
+            try:
+                parts = self._run_pandoc(joined).split(sentinel)
+            except Exception as e:
+                logger.error(f"Error processing markdown batch: {e}")
+                parts = []
+            
+            if len(parts) == len(batch_indexes):
+                for i, part in zip(batch_indexes, parts):
+                    results[i] = self._unwrap_paragraph(part)
+            else:
+                # A fragment swallowed a sentinel (e.g. unclosed raw HTML), convert one by one
+                logger.warning("Markdown batch could not be split, falling back to per-item conversion")
+                for i in batch_indexes:
+                    results[i] = self.process_markdown_text(texts[i])
+        
+        return results
+    
     def process_sections(self, sections: Dict[str, List[str]]) -> Dict[str, List[str]]:
-        """Process each section item through pandoc to convert markdown to HTML"""
+        """Convert every section item from markdown to HTML in one pandoc run"""
+        items = [item for section_items in sections.values() for item in section_items]
+        processed_items = iter(self.process_markdown_batch(items))
+        
         processed_sections = {}
+        for section_name, section_items in sections.items():
+            processed_sections[section_name] = [next(processed_items) for _ in section_items]
         
-        for section_name, items in sections.items():
-            processed_items = []
-            for item in items:
-                processed_item = self.process_markdown_text(item)
-                processed_items.append(processed_item)
-            
-            processed_sections[section_name] = processed_items
+        return processed_sections
+    
+    def _read_current(self, document_id: str) -> Optional[str]:
+        try:
+            return self.storage.read_text(self.document_store.markdown_key(document_id))
+        except FileNotFoundError:
+            return None
+    
+    def _check_base(self, current: str, base_version: str) -> None:
+        current_version = content_version(current)
+        if current_version != base_version:
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "message": "The document was changed since this version was loaded",
+                    "version": current_version
+                }
+            )
+    
+    def _commit(self, document_id: str, previous: Optional[str], content: str, edits: Optional[Sequence[Edit]] = None) -> Revision:
+        """Atomically replace the document's markdown and log the new revision"""
+        revision_log = self._revision_log(document_id)
+        head = revision_log.head()
+        if previous == content and head and head.version == content_version(content):
+            # Autosave without changes: nothing to write
+            return head
         
-        return processed_sections
\ No newline at end of file
+        markdown_key = self.document_store.markdown_key(document_id)
+        try:
+            # Readers see the old or the new document, never a truncated one
+            self.storage.write_text(markdown_key, content)
+            revision = revision_log.append(content, previous, edits)
+        except Exception as e:
+            logger.error(f"Error saving markdown file: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        
+        logger.info(f"Markdown file saved successfully: {markdown_key} (revision {revision.revision})")
+        return revision
+    
+    def _revision_log(self, document_id: str) -> RevisionLog:
+        with self._lock:
+            if document_id not in self._revision_logs:
+                self._revision_logs[document_id] = RevisionLog(
+                    self.storage, self.document_store.revisions_key(document_id)
+                )
+            return self._revision_logs[document_id]
+    
+    @contextmanager
+    def _document_lock(self, document_id: str) -> Iterator[None]:
+        """Serialize saves of a document across every process sharing the storage"""
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(self.storage.lock(self.document_store.markdown_key(document_id)))
+            except TimeoutError:
+                raise HTTPException(
+                    status_code=503,
+                    detail="The document is being saved by someone else",
+                    headers={"Retry-After": "1"}
+                )
+            yield
+    
+    def _run_pandoc(self, text: str) -> str:
+        """Convert a markdown string to HTML through the conversion engine"""
+        with render_metrics.stage("markdown_pandoc") as stage:
+            html = self.pandoc_service.convert_text(text, "markdown", "html")
+            stage.output_bytes = len(html.encode("utf-8"))
+        return html
+    
+    def _unwrap_paragraph(self, html: str) -> str:
+        """Remove wrapping <p> tags if it's a simple line"""
+        html = html.strip()
+        if html.startswith("<p>") and html.endswith("</p>") and html.count("<p>") == 1:
+            html = html[3:-4]
+        return html
+    
+    def _is_batch_safe(self, text: str) -> bool:
+        """Check that a fragment converts the same way alone and inside a batch"""
+        # Headings get document-wide unique ids, link/footnote definitions resolve
+        # across the whole document and raw HTML blocks can span the separators
+        return not _BATCH_UNSAFE_PATTERN.search(text)
@@ -0,0 +1,172 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.config import METRICS_LATENCY_BUCKETS, METRICS_SIZE_BUCKETS
+
+# Template of the render in progress, used as a label by stages that don't know it
+_current_template: contextvars.ContextVar[str] = contextvars.ContextVar("markcv_template", default="none")
+# Stages currently running, innermost last; subprocesses are counted against all of them
+_active_stages: contextvars.ContextVar[Tuple["Stage", ...]] = contextvars.ContextVar("markcv_stages", default=())
+# Per-request stage durations for the Server-Timing header, set by the middleware
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "markcv_request_timings", default=None
+)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+    
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+    
+    def observe(self, labels: Tuple[Tuple[str, str], ...], value: float) -> None:
+        # One slot per bucket plus +Inf, followed by the sum
+        series = self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            count = 0
+            for bound, observations in zip(self.buckets + ("+Inf",), series[:-1]):
+                count += observations
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+class Counter:
+    """Monotonic counter in the Prometheus exposition format"""
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[Tuple[Tuple[str, str], ...], float] = {}
+    
+    def inc(self, labels: Tuple[Tuple[str, str], ...], amount: float = 1) -> None:
+        self._series[labels] = self._series.get(labels, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+class Stage:
+    """One timed run of a render stage; callers may set output_bytes"""
+    
+    def __init__(self, name: str, template_id: str):
+        self.name = name
+        self.template_id = template_id
+        self.subprocesses = 0
+        self.output_bytes: Optional[int] = None
+
+class RenderMetrics:
+    """Latency, subprocess, output size and error metrics for render stages, by template"""
+    
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "markcv_render_stage_seconds", "Time spent in each render stage", METRICS_LATENCY_BUCKETS
+        )
+        self.stage_output_bytes = Histogram(
+            "markcv_render_stage_output_bytes", "Size of what each render stage produced", METRICS_SIZE_BUCKETS
+        )
+        self.stage_subprocesses = Counter(
+            "markcv_render_stage_subprocesses_total", "Subprocesses started by each render stage"
+        )
+        self.stage_errors = Counter("markcv_render_stage_errors_total", "Render stages that raised an error")
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def render(self, template_id: str) -> Iterator[Stage]:
+        """Time a whole render as the `render` stage and label nested stages with its template"""
+        token = _current_template.set(template_id)
+        try:
+            with self.stage("render", template_id) as stage:
+                yield stage
+        finally:
+            _current_template.reset(token)
+    
+    @contextmanager
+    def stage(self, name: str, template_id: Optional[str] = None) -> Iterator[Stage]:
+        """Time a render stage, counting an error if it raises"""
+        stage = Stage(name, template_id or _current_template.get())
+        token = _active_stages.set(_active_stages.get() + (stage,))
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield stage
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _active_stages.reset(token)
+            self._record(stage, elapsed, failed)
+    
+    def count_subprocess(self) -> None:
+        """Attribute a newly started subprocess to the stages currently running"""
+        for stage in _active_stages.get():
+            stage.subprocesses += 1
+    
+    def render_prometheus(self, extra_lines: Optional[List[str]] = None) -> str:
+        with self._lock:
+            lines = []
+            for metric in (self.stage_seconds, self.stage_output_bytes, self.stage_subprocesses, self.stage_errors):
+                lines.extend(metric.render())
+        lines.extend(extra_lines or [])
+        return "\n".join(lines) + "\n"
+    
+    def _record(self, stage: Stage, elapsed: float, failed: bool) -> None:
+        labels = (("stage", stage.name), ("template_id", stage.template_id))
+        with self._lock:
+            self.stage_seconds.observe(labels, elapsed)
+            self.stage_subprocesses.inc(labels, stage.subprocesses)
+            if stage.output_bytes is not None:
+                self.stage_output_bytes.observe(labels, stage.output_bytes)
+            if failed:
+                self.stage_errors.inc(labels)
+        
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage.name, elapsed))
+
+@contextmanager
+def collect_request_timings() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the durations of all stages run while handling one request"""
+    timings: List[Tuple[str, float]] = []
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+def add_request_timings(timings: List[Tuple[str, float]]) -> None:
+    """Attribute stage durations measured elsewhere (like in a render job) to the current request"""
+    current = _request_timings.get()
+    if current is not None:
+        current.extend(timings)
+
+def format_server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Build a Server-Timing header value, summing stages that ran more than once"""
+    totals: Dict[str, float] = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for key, value in labels
+    )
+    return "{" + ",".join(f"{key}=\"{value}\"" for key, value in escaped) + "}"
+
+render_metrics = RenderMetrics()
@@ -0,0 +1,373 @@
+import base64
+import mimetypes
+import re
+import threading
+from collections import OrderedDict
+from html import unescape as html_unescape
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import markdown
+from jinja2 import Environment, Template, TemplateSyntaxError
+from markdown.extensions import Extension
+from markdown.extensions.toc import stashedHTML2text, unescape
+from markdown.treeprocessors import Treeprocessor
+
+from app.config import NATIVE_FRAGMENT_CACHE_SIZE
+from app.services.markdown_scanner import scan_markdown
+
+logger = logging.getLogger("markcv")
+
+# Pandoc template directives: $$, $-- comments, ${name} and $name$
+_DIRECTIVE_PATTERN = re.compile(r"\$\$|\$--[^\n]*|\$\{([^}$\n]*)\}|\$([^$\n]*)\$")
+_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*$")
+_CONDITION_PATTERN = re.compile(r"^(if|elseif|for)\(([^)]*)\)$")
+# Resources pandoc would fetch and embed itself, other than the template variables we fill in
+_EXTERNAL_RESOURCE_PATTERN = re.compile(r"<(?:script|img|link)\b[^>]*\b(?:src|href)\s*=\s*(?![\"']?\$)", re.IGNORECASE)
+_CSS_RESOURCE_PATTERN = re.compile(r"url\(|@import", re.IGNORECASE)
+_CSS_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+_STYLE_BLOCK_PATTERN = re.compile(r"(<style\b[^>]*>)(.*?)(</style>)", re.DOTALL | re.IGNORECASE)
+
+_STYLESHEET_PATTERN = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+_IMG_PATTERN = re.compile(r"<img\b([^>]*?)\s*(/?)>", re.IGNORECASE)
+_FIGURE_PATTERN = re.compile(r"<p>(<img\b[^>]*>)</p>")
+_ORDERED_LIST_PATTERN = re.compile(r"<ol(?![^>]*\btype=)([^>]*)>")
+_ATTRIBUTE_PATTERN = re.compile(r"""\b([\w-]+)\s*=\s*"([^"]*)\"""")
+_HEADING_ID_PATTERN = re.compile(r'(<h[1-6] id=")([^"]*)(")')
+# Link/footnote definitions resolve across the whole document, and fenced code or
+# raw HTML blocks can contain lines that look like section headings
+_SPLIT_UNSAFE_PATTERN = re.compile(r"^\s{0,3}\[[^\]]+\]:|\[\^|^\s{0,3}(?:```|~~~|<)", re.MULTILINE)
+# Pandoc markdown that python-markdown reads differently; documents using it render with pandoc
+_PANDOC_ONLY_PATTERN = re.compile(r"""
+    ^[ ]{2,3}(?:[-*+]|\d+[.)])[ \t]                  # lists nested by fewer than 4 spaces
+    | \n\n[ ]{1,3}\S                                 # list item paragraphs indented by fewer than 4 spaces
+    | ^[ ]{0,3}[-*+][ \t].*\n[ ]{0,3}\d+[.)][ \t]      # a list right after a list of the other kind
+    | ^[ ]{0,3}\d+[.)][ \t].*\n[ ]{0,3}[-*+][ \t]
+    | ^[ ]{0,3}(?:\(?\d+\)|\(?(?:[A-Za-z]|[ivxlcdm]+|[IVXLCDM]+|\#)[.)])[ \t]   # fancy list markers
+    | ^[ ]{0,3}[-*+][ \t]+\[[ xX]\]                   # task lists
+    | ~~ | ~[^\s~]+~ | \^[^\s^]+\^                      # strikeout, subscript, superscript
+    | [\])`]\{                                        # attributes of spans, links, images and code
+    | ^\#{1,6}[ \t].*\{[^}\n]*\}[ \t]*$              # heading attributes
+    | ^\#{1,6}[^\s\#]                                 # "#word" is a paragraph in pandoc
+    | ^[ ]{0,3}(?:`{3,}|~{3,})[ \t]*[^\s`~]           # fenced code with a language or attributes
+    | \\\n                                            # backslash hard line breaks
+    | \\[A-Za-z]                                      # raw TeX commands
+    | ^[ ]{0,3}>[ ]?>                                  # nested block quotes
+    | ^[ ]{0,3}<(?!(?:a|b|i|em|strong|span|code|br|sub|sup|small|img)\b)[A-Za-z]  # raw HTML blocks
+    | [)\]]["']                                        # quotes after links, which smarty opens
+    | <(?:[A-Za-z][A-Za-z0-9+.-]*:|[^\s<>@]+@)[^\s<>]*>  # autolinks
+    | \[\^ | \^\[                                       # footnotes
+    | \$[^\s$](?:[^$\n]*[^\s$\\])?\$(?!\d)            # TeX math
+    | ^[ ]*-{2,}(?:[ ]+-{2,})+[ ]*$ | ^\+[-=]+\+         # simple and grid tables
+    | !\[(?:\]|[^\]]*\]\((?!images/))                   # images without alt text, or not uploaded
+""", re.MULTILINE | re.VERBOSE)
+
+_HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+# Jinja delimiters that cannot clash with literal template text
+_JINJA_DELIMITERS = {
+    "block_start_string": "\x00%",
+    "block_end_string": "%\x00",
+    "variable_start_string": "\x00{",
+    "variable_end_string": "}\x00",
+    "comment_start_string": "\x00#",
+    "comment_end_string": "#\x00",
+}
+
+class UnsupportedTemplate(Exception):
+    """A template uses pandoc features the native renderer does not implement"""
+
+def pandoc_identifier(text: str) -> str:
+    """Build a heading id the way pandoc's auto_identifiers extension does"""
+    text = "".join(c for c in text if c.isalnum() or c in "_-." or c.isspace())
+    identifier = "-".join(text.split()).lower()
+    identifier = re.sub(r"^[\W\d_.-]+", "", identifier)
+    return identifier or "section"
+
+def _clean_css(css: str) -> str:
+    return "\n".join(line.strip() for line in _CSS_COMMENT_PATTERN.sub("", css).splitlines() if line.strip())
+
+def _as_list(value: Any) -> List[Any]:
+    """Iterate like a pandoc $for$: lists item by item, other set values once"""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value] if value else []
+
+class _PandocIdentifiers(Treeprocessor):
+    def run(self, root):
+        # Duplicates are numbered afterwards, across the whole document
+        for element in root.iter():
+            if element.tag in _HEADINGS and "id" not in element.attrib:
+                text = unescape(stashedHTML2text("".join(element.itertext()), self.md, strip_entities=False))
+                element.set("id", pandoc_identifier(html_unescape(text)))
+
+class _PandocIdentifiersExtension(Extension):
+    def extendMarkdown(self, md):
+        # After inline patterns and smarty substitutions, before backslash escapes are restored
+        md.treeprocessors.register(_PandocIdentifiers(md), "pandoc_identifiers", 1)
+
+class NativeRenderer:
+    """Renders pandoc HTML templates in-process with python-markdown and Jinja2.
+    
+    Covers the subset of pandoc's markdown and template language the CV
+    templates use, producing the same HTML as a self-contained pandoc render
+    with the CSS and images embedded. Templates that need anything else raise
+    UnsupportedTemplate so callers can fall back to pandoc.
+    """
+    
+    def __init__(self):
+        self._environment = Environment(autoescape=False, keep_trailing_newline=True, **_JINJA_DELIMITERS)
+        self._environment.filters["as_list"] = _as_list
+        # (template path, CSS file) -> (version, compiled template, inlined CSS)
+        self._compiled: Dict[Tuple[Path, Path], Tuple[str, Template, str]] = {}
+        # template path -> (version, reason) for templates that need pandoc
+        self._unsupported: Dict[Path, Tuple[str, str]] = {}
+        # markdown fragment -> HTML, most recently used last
+        self._fragments: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def supports(self, text: str) -> bool:
+        """Check that a markdown document uses only what python-markdown converts like pandoc.
+        
+        Checks the body as rendered, with uploaded images pointing at images/<id>.
+        """
+        return not _PANDOC_ONLY_PATTERN.search(text)
+    
+    def convert(self, text: str) -> str:
+        """Convert a markdown document to HTML like pandoc's html writer.
+        
+        Documents are converted per `## ` section and unchanged sections are
+        reused, so a re-render after an edit only converts what changed.
+        """
+        if _SPLIT_UNSAFE_PATTERN.search(text):
+            html = self._convert_cached(text)
+        else:
+            html = "\n".join(
+                self._convert_cached(text[section.start:section.end]) for section in scan_markdown(text).sections
+            )
+        return self._number_duplicate_ids(html)
+    
+    def convert_fragment(self, text: str) -> str:
+        """Convert a section item, unwrapping a single paragraph like MarkdownService does"""
+        html = self._convert_cached(text).strip()
+        if html.startswith("<p>") and html.endswith("</p>") and html.count("<p>") == 1:
+            html = html[3:-4]
+        return html
+    
+    def _convert_cached(self, text: str) -> str:
+        with self._lock:
+            html = self._fragments.get(text)
+            if html is not None:
+                self._fragments.move_to_end(text)
+                return html
+        
+        html = self._convert(text)
+        with self._lock:
+            self._fragments[text] = html
+            while len(self._fragments) > NATIVE_FRAGMENT_CACHE_SIZE:
+                self._fragments.popitem(last=False)
+        return html
+    
+    def _convert(self, text: str) -> str:
+        # Markdown instances are not thread safe, keep one per render thread
+        converter = getattr(self._local, "converter", None)
+        if converter is None:
+            converter = markdown.Markdown(
+                extensions=["tables", "fenced_code", "def_list", "sane_lists", "smarty", _PandocIdentifiersExtension()],
+                extension_configs={"smarty": {"substitutions": {
+                    "left-single-quote": "‘",
+                    "right-single-quote": "’",
+                    "left-double-quote": "“",
+                    "right-double-quote": "”",
+                    "ndash": "–",
+                    "mdash": "—",
+                    "ellipsis": "…",
+                }}},
+                output_format="xhtml"
+            )
+            self._local.converter = converter
+        
+        html = converter.reset().convert(text)
+        html = _FIGURE_PATTERN.sub(self._figure, html)
+        return _ORDERED_LIST_PATTERN.sub(r'<ol\1 type="1">', html)
+    
+    def _number_duplicate_ids(self, html: str) -> str:
+        """Suffix repeated heading ids with -1, -2, ... as pandoc does"""
+        used_ids = set()
+        
+        def unique(match: re.Match) -> str:
+            identifier = match.group(2)
+            if identifier in used_ids:
+                suffix = 1
+                while f"{identifier}-{suffix}" in used_ids:
+                    suffix += 1
+                identifier = f"{identifier}-{suffix}"
+            used_ids.add(identifier)
+            return f"{match.group(1)}{identifier}{match.group(3)}"
+        
+        return _HEADING_ID_PATTERN.sub(unique, html)
+    
+    def render(
+        self,
+        template_html: Path,
+        version: str,
+        css_file: Path,
+        variables: Dict[str, Any],
+        body: str,
+        images: Dict[str, Path]
+    ) -> str:
+        """Render a markdown body into a template with the CSS and images embedded.
+        
+        images maps the image paths used in the body and variables to the files to embed.
+        """
+        template, css = self._compile(template_html, version, css_file)
+        css_href = str(css_file.resolve())
+        html = template.render(**variables, css=[css_href], body=self.convert(body))
+        
+        html = _STYLESHEET_PATTERN.sub(lambda match: self._inline_stylesheet(match, css_href, css), html)
+        data_uris: Dict[str, Optional[str]] = {}
+        return _IMG_PATTERN.sub(lambda match: self._inline_image(match, images, data_uris), html)
+    
+    def _compile(self, template_html: Path, version: str, css_file: Path) -> Tuple[Template, str]:
+        with self._lock:
+            compiled = self._compiled.get((template_html, css_file))
+            unsupported = self._unsupported.get(template_html)
+        if compiled and compiled[0] == version:
+            return compiled[1], compiled[2]
+        if unsupported and unsupported[0] == version:
+            raise UnsupportedTemplate(unsupported[1])
+        
+        try:
+            template, css = self._load(template_html, css_file)
+        except UnsupportedTemplate as e:
+            with self._lock:
+                self._unsupported[template_html] = (version, str(e))
+            logger.warning(f"Template {template_html} needs pandoc: {e}")
+            raise
+        
+        with self._lock:
+            # A new version replaces everything compiled from older ones (each CSS bundle of the template)
+            for key in [key for key, entry in self._compiled.items() if key[0] == template_html and entry[0] != version]:
+                del self._compiled[key]
+            self._compiled[(template_html, css_file)] = (version, template, css)
+        return template, css
+    
+    def _load(self, template_html: Path, css_file: Path) -> Tuple[Template, str]:
+        """Compile a template and prepare its CSS the way pandoc embeds it"""
+        source = template_html.read_text()
+        if _EXTERNAL_RESOURCE_PATTERN.search(source):
+            raise UnsupportedTemplate("it references external resources")
+        css = css_file.read_text() if css_file.exists() else ""
+        if _CSS_RESOURCE_PATTERN.search(css):
+            raise UnsupportedTemplate("its CSS references external resources")
+        
+        # Pandoc drops comments and indentation from stylesheets, embedded or inline
+        source = _STYLE_BLOCK_PATTERN.sub(
+            lambda match: f"{match.group(1)}\n{_clean_css(match.group(2))}\n{match.group(3)}", source
+        )
+        try:
+            template = self._environment.from_string(self._translate(source))
+        except TemplateSyntaxError as e:
+            raise UnsupportedTemplate(str(e))
+        return template, _clean_css(css)
+    
+    def _translate(self, source: str) -> str:
+        """Translate pandoc template syntax to Jinja2"""
+        if "\x00" in source:
+            raise UnsupportedTemplate("it contains NUL characters")
+        
+        parts = []
+        loops: List[List[Any]] = []
+        position = 0
+        for match in _DIRECTIVE_PATTERN.finditer(source):
+            literal = source[position:match.start()]
+            if "$" in literal:
+                raise UnsupportedTemplate(f"unterminated directive near {literal[literal.index('$'):][:20]!r}")
+            parts.append(literal)
+            position = match.end()
+            
+            directive = match.group(0)
+            if directive == "$$":
+                parts.append("$")
+                continue
+            if directive.startswith("$--"):
+                continue
+            
+            expression = (match.group(1) if match.group(1) is not None else match.group(2)).strip()
+            condition = _CONDITION_PATTERN.match(expression)
+            if condition:
+                keyword, name = condition.group(1), condition.group(2).strip()
+                if not _NAME_PATTERN.match(name) or (keyword == "for" and "." in name):
+                    raise UnsupportedTemplate(f"unsupported directive ${expression}$")
+                if keyword == "for":
+                    loops.append([name, False])
+                    parts.append(f"\x00% for it in {name}|as_list %\x00\x00% set {name} = it %\x00")
+                else:
+                    parts.append(f"\x00% {keyword.replace('elseif', 'elif')} {name} %\x00")
+            elif expression == "sep" and loops:
+                loops[-1][1] = True
+                parts.append("\x00% if not loop.last %\x00")
+            elif expression == "endfor" and loops:
+                _, has_separator = loops.pop()
+                parts.append("\x00% endif %\x00\x00% endfor %\x00" if has_separator else "\x00% endfor %\x00")
+            elif expression in ("else", "endif"):
+                parts.append(f"\x00% {expression} %\x00")
+            elif _NAME_PATTERN.match(expression):
+                parts.append(f"\x00{{ {expression} }}\x00")
+            else:
+                raise UnsupportedTemplate(f"unsupported directive ${expression}$")
+        
+        literal = source[position:]
+        if "$" in literal:
+            raise UnsupportedTemplate("unterminated directive")
+        parts.append(literal)
+        if loops:
+            raise UnsupportedTemplate("unclosed $for$")
+        return "".join(parts)
+    
+    def _figure(self, match: re.Match) -> str:
+        """An image alone in a paragraph becomes a figure captioned with its alt text, as in pandoc"""
+        image = match.group(1)
+        attributes = dict(_ATTRIBUTE_PATTERN.findall(image))
+        if not attributes.get("alt"):
+            return match.group(0)
+        return f'<figure>\n{image}\n<figcaption aria-hidden="true">{attributes["alt"]}</figcaption>\n</figure>'
+    
+    def _inline_stylesheet(self, match: re.Match, css_href: str, css: str) -> str:
+        attributes = dict(_ATTRIBUTE_PATTERN.findall(match.group(0)))
+        if attributes.get("rel") != "stylesheet" or attributes.get("href") != css_href:
+            return match.group(0)
+        return f'<style type="text/css">\n{css}\n</style>'
+    
+    def _inline_image(self, match: re.Match, images: Dict[str, Path], data_uris: Dict[str, Optional[str]]) -> str:
+        attributes = match.group(1)
+        src_match = re.search(r'\bsrc="([^"]*)"', attributes)
+        if not src_match or src_match.group(1) not in images:
+            return match.group(0)
+        
+        src = src_match.group(1)
+        if src not in data_uris:
+            data_uris[src] = self._data_uri(images[src])
+        if data_uris[src] is None:
+            return match.group(0)
+        
+        # Pandoc labels the images it embeds with their alt text
+        alt = dict(_ATTRIBUTE_PATTERN.findall(attributes)).get("alt")
+        parts = [f'role="img" aria-label="{alt}"'] if alt else []
+        parts.append(f'src="{data_uris[src]}"')
+        rest = (attributes[:src_match.start()] + attributes[src_match.end():]).strip()
+        if rest:
+            parts.append(rest)
+        closing = " /" if match.group(2) else ""
+        return f"<img {' '.join(parts)}{closing}>"
+    
+    def _data_uri(self, path: Path) -> Optional[str]:
+        try:
+            data = path.read_bytes()
+        except OSError as e:
+            logger.warning(f"Could not embed image {path}: {e}")
+            return None
+        mime_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
\ No newline at end of file
@@ -0,0 +1,264 @@
+import asyncio
+import atexit
+import json
+import queue
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import List, Optional
+import logging
+
+from app.config import (
+    PANDOC_POOL_SIZE,
+    PANDOC_SERVER_ENABLED,
+    PANDOC_TIMEOUT,
+    PANDOC_WORKER_MAX_JOBS,
+)
+from app.services.metrics import render_metrics
+
+logger = logging.getLogger("markcv")
+
+class PandocServerError(Exception):
+    """Raised when a pandoc server worker fails to convert a document"""
+
+class PandocWorker:
+    """A long-lived `pandoc server` process listening on a local port"""
+    
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.jobs = 0
+        self.port = self._free_port()
+        render_metrics.count_subprocess()
+        self.process = subprocess.Popen(
+            ["pandoc", "server", "--port", str(self.port), "--timeout", str(int(timeout))],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+    
+    def wait_ready(self, deadline: float) -> None:
+        """Block until the server accepts connections or the deadline passes"""
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise PandocServerError(f"pandoc server exited with code {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.1):
+                    return
+            except OSError:
+                time.sleep(0.05)
+        raise PandocServerError("pandoc server did not start in time")
+    
+    def convert(self, text: str, from_format: str, to_format: str) -> str:
+        """Convert text through the server's JSON API"""
+        self.jobs += 1
+        payload = json.dumps({"text": text, "from": from_format, "to": to_format}).encode("utf-8")
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{self.port}/",
+            data=payload,
+            headers={"Content-Type": "application/json", "Accept": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read().decode("utf-8"))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise PandocServerError(str(e)) from e
+        
+        if not isinstance(result, dict) or "output" not in result or result.get("base64"):
+            raise PandocServerError(f"Unexpected pandoc server response: {result}")
+        return result["output"]
+    
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+    
+    def stop(self) -> None:
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+    
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+class PandocService:
+    """Conversion engine that routes pandoc jobs to a pool of warm `pandoc server`
+    workers and falls back to one pandoc subprocess per job"""
+    
+    def __init__(
+        self,
+        pool_size: int = PANDOC_POOL_SIZE,
+        timeout: float = PANDOC_TIMEOUT,
+        max_jobs_per_worker: int = PANDOC_WORKER_MAX_JOBS,
+        use_server: bool = PANDOC_SERVER_ENABLED
+    ):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.use_server = use_server and pool_size > 0
+        self._idle_workers: "queue.Queue[PandocWorker]" = queue.Queue()
+        self._workers: List[PandocWorker] = []
+        self._started = False
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+    
+    def convert_text(self, text: str, from_format: str = "markdown", to_format: str = "html") -> str:
+        """Convert a string between formats, using a warm worker when available"""
+        if self._ensure_pool():
+            try:
+                return self._convert_on_worker(text, from_format, to_format)
+            except PandocServerError as e:
+                logger.warning(f"pandoc server conversion failed, using subprocess: {e}")
+        
+        result = self.run(["-f", from_format, "-t", to_format], input_text=text)
+        return result.stdout
+    
+    def run(self, args: List[str], input_text: Optional[str] = None) -> subprocess.CompletedProcess:
+        """Run a one-off pandoc subprocess, for jobs that read or write files"""
+        render_metrics.count_subprocess()
+        return subprocess.run(
+            ["pandoc", *args],
+            input=input_text,
+            check=True,
+            capture_output=True,
+            text=True,
+            timeout=self.timeout
+        )
+    
+    async def convert_text_async(self, text: str, from_format: str = "markdown", to_format: str = "html") -> str:
+        """Async counterpart of convert_text"""
+        if await asyncio.to_thread(self._ensure_pool):
+            try:
+                return await asyncio.to_thread(self._convert_on_worker, text, from_format, to_format)
+            except PandocServerError as e:
+                logger.warning(f"pandoc server conversion failed, using subprocess: {e}")
+        
+        result = await self.run_async(["-f", from_format, "-t", to_format], input_text=text)
+        return result.stdout
+    
+    async def run_async(self, args: List[str], input_text: Optional[str] = None) -> subprocess.CompletedProcess:
+        """Async counterpart of run, using asyncio subprocesses"""
+        cmd = ["pandoc", *args]
+        render_metrics.count_subprocess()
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(input_text.encode("utf-8") if input_text is not None else None),
+                timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(cmd, self.timeout)
+        
+        stdout_text = stdout.decode("utf-8")
+        stderr_text = stderr.decode("utf-8")
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stdout_text, stderr_text)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout_text, stderr_text)
+    
+    def shutdown(self) -> None:
+        """Stop all pandoc server workers"""
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._workers = []
+            self._idle_workers = queue.Queue()
+            self._started = False
+    
+    def _ensure_pool(self) -> bool:
+        """Start the worker pool on first use; returns whether server mode is usable"""
+        if not self.use_server:
+            return False
+        if self._started:
+            return True
+        
+        with self._lock:
+            if self._started:
+                return True
+            try:
+                for _ in range(self.pool_size):
+                    worker = self._start_worker()
+                    self._workers.append(worker)
+                    self._idle_workers.put(worker)
+                self._started = True
+                logger.info(f"Started {self.pool_size} pandoc server workers")
+            except (PandocServerError, OSError) as e:
+                logger.warning(f"pandoc server mode unavailable, using subprocesses: {e}")
+                for worker in self._workers:
+                    worker.stop()
+                self._workers = []
+                self._idle_workers = queue.Queue()
+                self.use_server = False
+        
+        return self._started
+    
+    def _start_worker(self) -> PandocWorker:
+        """Start a worker and check that it can actually convert a document"""
+        worker = PandocWorker(self.timeout)
+        try:
+            worker.wait_ready(time.monotonic() + 10)
+            worker.convert("ok", "markdown", "html")
+        except PandocServerError:
+            worker.stop()
+            raise
+        worker.jobs = 0
+        return worker
+    
+    def _convert_on_worker(self, text: str, from_format: str, to_format: str) -> str:
+        try:
+            worker = self._idle_workers.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PandocServerError("Timed out waiting for a pandoc server worker")
+        
+        try:
+            return worker.convert(text, from_format, to_format)
+        except PandocServerError:
+            # A worker that failed a job is replaced rather than reused
+            worker.jobs = self.max_jobs_per_worker
+            raise
+        finally:
+            self._release_worker(worker)
+    
+    def _release_worker(self, worker: PandocWorker) -> None:
+        """Return a worker to the pool, recycling it once it has served max_jobs"""
+        with self._lock:
+            if worker not in self._workers:
+                # The pool was shut down while the worker was checked out
+                worker.stop()
+                return
+            if worker.jobs < self.max_jobs_per_worker and worker.is_alive():
+                self._idle_workers.put(worker)
+                return
+            self._workers.remove(worker)
+            idle_workers = self._idle_workers
+        
+        # Recycled outside the lock: the readiness wait must not stall other threads or shutdown
+        worker.stop()
+        try:
+            replacement = self._start_worker()
+        except (PandocServerError, OSError) as e:
+            logger.error(f"Could not recycle pandoc server worker: {e}")
+            with self._lock:
+                if self._idle_workers is idle_workers and not self._workers:
+                    self._started = False
+                    self.use_server = False
+            return
+        
+        with self._lock:
+            # Unless the pool was shut down (and perhaps restarted) meanwhile
+            if self._started and self._idle_workers is idle_workers:
+                self._workers.append(replacement)
+                idle_workers.put(replacement)
+                return
+        replacement.stop()
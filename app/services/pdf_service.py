@@ -0,0 +1,124 @@
+import asyncio
+import functools
+import importlib.metadata
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+import logging
+
+from fastapi import HTTPException
+from app.config import OUTPUT_FORMATS, PDF_WORKERS
+from app.services.metrics import render_metrics
+from app.services.render_cache import RenderCache
+
+logger = logging.getLogger("markcv")
+
+# CSS page sizes for the paper sizes templates offer
+PAGE_SIZES = {"a4": "A4", "letter": "letter", "legal": "legal"}
+
+def _init_worker() -> None:
+    """Import WeasyPrint and lay out a page once, so the first real job starts warm"""
+    import weasyprint
+    weasyprint.HTML(string="<p>MarkCV</p>").write_pdf()
+
+def _write_pdf(html_file: str, pdf_file: str, paper_size: str) -> int:
+    """Convert a self-contained HTML file to PDF, returning the PDF's size"""
+    import weasyprint
+    page_css = weasyprint.CSS(string=f"@page {{ size: {PAGE_SIZES.get(paper_size, 'A4')}; }}")
+    weasyprint.HTML(filename=html_file).write_pdf(pdf_file, stylesheets=[page_css])
+    return Path(pdf_file).stat().st_size
+
+def check_formats(output_formats: Iterable[str]) -> None:
+    """Reject unknown output formats, and PDF when WeasyPrint is not installed"""
+    unknown = sorted(set(output_formats) - set(OUTPUT_FORMATS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown formats: {', '.join(unknown)}")
+    if "pdf" in output_formats and not PDFService.available():
+        raise HTTPException(status_code=501, detail="PDF output needs WeasyPrint and its system libraries (pango)")
+
+class PDFService:
+    """Converts rendered HTML to PDF with WeasyPrint.
+    
+    Conversions run on a pool of worker processes that keep WeasyPrint
+    imported and warm (workers=0 converts in the calling thread). PDFs are
+    cached next to the HTML renders, keyed by the HTML they were made from.
+    """
+    
+    def __init__(self, render_cache: RenderCache, workers: int = PDF_WORKERS):
+        self.render_cache = render_cache
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def available() -> bool:
+        """Whether WeasyPrint and the system libraries it loads are installed"""
+        try:
+            import weasyprint  # noqa: F401
+            return True
+        except (ImportError, OSError) as e:
+            logger.warning(f"PDF output is unavailable: {e}")
+            return False
+    
+    def render_pdf(self, html_file: Path, paper_size: str = "a4") -> Path:
+        """Convert a cached HTML render to PDF and return the cached PDF"""
+        cache_key = self._cache_key(html_file, paper_size)
+        cached_pdf = self.render_cache.get(cache_key, ".pdf")
+        if cached_pdf:
+            logger.info(f"Serving cached PDF for {html_file.name}")
+            return cached_pdf
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_file = Path(temp_dir) / "cv.pdf"
+            with render_metrics.stage("pdf") as stage:
+                if self.workers > 0:
+                    stage.output_bytes = self._get_pool().submit(
+                        _write_pdf, str(html_file), str(pdf_file), paper_size
+                    ).result()
+                else:
+                    stage.output_bytes = _write_pdf(str(html_file), str(pdf_file), paper_size)
+            return self.render_cache.put(cache_key, pdf_file, ".pdf")
+    
+    async def render_pdf_async(self, html_file: Path, paper_size: str = "a4") -> Path:
+        """Convert a cached HTML render to PDF without blocking the event loop"""
+        cache_key = self._cache_key(html_file, paper_size)
+        cached_pdf = self.render_cache.get(cache_key, ".pdf")
+        if cached_pdf:
+            logger.info(f"Serving cached PDF for {html_file.name}")
+            return cached_pdf
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_file = Path(temp_dir) / "cv.pdf"
+            with render_metrics.stage("pdf") as stage:
+                if self.workers > 0:
+                    stage.output_bytes = await asyncio.wrap_future(
+                        self._get_pool().submit(_write_pdf, str(html_file), str(pdf_file), paper_size)
+                    )
+                else:
+                    stage.output_bytes = await asyncio.to_thread(_write_pdf, str(html_file), str(pdf_file), paper_size)
+            return await asyncio.to_thread(self.render_cache.put, cache_key, pdf_file, ".pdf")
+    
+    def shutdown(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def _cache_key(self, html_file: Path, paper_size: str) -> str:
+        # HTML cache entries are named by the hash of their render inputs
+        return self.render_cache.make_key("pdf", html_file.name, paper_size, importlib.metadata.version("weasyprint"))
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that runs threads (the server, pandoc pools) is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+                logger.info(f"Started {self.workers} PDF workers")
+            return self._pool
\ No newline at end of file
@@ -0,0 +1,164 @@
+import base64
+import mimetypes
+import re
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+from urllib.parse import unquote
+import logging
+
+from app.config import INLINE_ASSETS, MINIFY_HTML, POST_PROCESS_CHUNK_SIZE, TEMPLATE_DIR
+from app.services.storage import default_storage
+
+logger = logging.getLogger("markcv")
+
+# A post-processor transforms a stream of HTML text chunks into another one
+PostProcessor = Callable[[Iterable[str]], Iterator[str]]
+
+PRINT_SCRIPT = """
+        <script>
+        window.onload = function() {
+            setTimeout(function() {
+                window.print();
+            }, 500);
+        }
+        </script>
+        """
+
+# URL prefixes the app serves files under (see app.main), for inlining references to them
+ASSET_ROOTS = {
+    "/static/": Path("static"),
+    "/cv_templates/": TEMPLATE_DIR
+}
+# Served from storage instead of a directory (see app.routes)
+STORAGE_URL_PREFIX = "/data/"
+ASSET_URL_MAX_LENGTH = 512
+# A multiple of 3, so each block base64-encodes without padding
+ASSET_READ_SIZE = 48 * 1024
+
+BODY_END_PATTERN = re.compile(re.escape("</body>"))
+# Whitespace around line breaks, except inside elements where it is significant
+MINIFY_PATTERN = re.compile(r"<(pre|textarea|script)\b.*?(?:</\1\s*>|\Z)|[ \t]*\n[ \t\r\n]*", re.IGNORECASE | re.DOTALL)
+ASSET_PATTERN = re.compile(
+    r"""(\ssrc=)(["'])((?:%s)[^"'?#<>\s]{1,%d})\2"""
+    % ("|".join(re.escape(prefix) for prefix in (*ASSET_ROOTS, STORAGE_URL_PREFIX)), ASSET_URL_MAX_LENGTH)
+)
+
+def default_post_processors() -> List[PostProcessor]:
+    """The post-processing chain for rendered HTML, as configured"""
+    processors: List[PostProcessor] = [inject_print_script]
+    if MINIFY_HTML:
+        processors.append(minify_html)
+    if INLINE_ASSETS:
+        processors.append(inline_assets)
+    return processors
+
+def read_chunks(path: Path, chunk_size: int = POST_PROCESS_CHUNK_SIZE) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def post_process(chunks: Iterable[str], processors: Iterable[PostProcessor]) -> Iterator[str]:
+    """Chain post-processors over a stream of chunks; nothing is read until the result is"""
+    for processor in processors:
+        chunks = processor(chunks)
+    return iter(chunks)
+
+def substitute(
+    chunks: Iterable[str],
+    pattern: "re.Pattern[str]",
+    replace: Callable[["re.Match[str]"], Iterable[str]],
+    max_match: int,
+    hold: str = ""
+) -> Iterator[str]:
+    """re.sub over a stream of chunks, where replace yields each replacement in pieces.
+    
+    Only a few characters are held back between chunks: the last max_match
+    (the longest a match that ends in the next chunk can start before it), or
+    from the start of a match that runs to the end of the chunk and might
+    continue. Patterns should not match more than max_match characters unless
+    they can end at \\Z, or the characters a longer match starts with are
+    given as hold: a chunk's trailing run of them is also held back.
+    """
+    pending = ""
+    for chunk in chunks:
+        buffer = pending + chunk
+        position = 0
+        cut = len(buffer) - max_match
+        if hold:
+            cut = min(cut, len(buffer.rstrip(hold)))
+        for match in pattern.finditer(buffer):
+            if match.end() >= len(buffer):
+                cut = min(cut, match.start())
+                break
+            yield buffer[position:match.start()]
+            yield from replace(match)
+            position = match.end()
+        cut = max(cut, position)
+        yield buffer[position:cut]
+        pending = buffer[cut:]
+    
+    position = 0
+    for match in pattern.finditer(pending):
+        yield pending[position:match.start()]
+        yield from replace(match)
+        position = match.end()
+    yield pending[position:]
+
+def inject_print_script(chunks: Iterable[str]) -> Iterator[str]:
+    """Open the print dialog once the page has loaded"""
+    return substitute(chunks, BODY_END_PATTERN, lambda match: (PRINT_SCRIPT, match.group(0)), len("</body>"))
+
+def minify_html(chunks: Iterable[str]) -> Iterator[str]:
+    """Drop indentation, trailing spaces and blank lines outside pre, textarea and script elements"""
+    def replace(match: "re.Match[str]") -> Iterable[str]:
+        return (match.group(0) if match.group(1) else "\n",)
+    
+    # Trailing spaces before a line break can run past any fixed max_match
+    return substitute(chunks, MINIFY_PATTERN, replace, len("<textarea"), hold=" \t")
+
+def inline_assets(chunks: Iterable[str]) -> Iterator[str]:
+    """Embed files referenced by app URL in src attributes as data URIs, so the file works offline"""
+    def replace(match: "re.Match[str]") -> Iterator[str]:
+        path = _asset_path(match.group(3))
+        if path is None:
+            yield match.group(0)
+            return
+        
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        yield f"{match.group(1)}{match.group(2)}data:{media_type};base64,"
+        # Encoded block by block, so large images never sit in memory whole
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(ASSET_READ_SIZE)
+                if not block:
+                    break
+                yield base64.b64encode(block).decode("ascii")
+        yield match.group(2)
+    
+    return substitute(chunks, ASSET_PATTERN, replace, ASSET_URL_MAX_LENGTH + 16)
+
+def _asset_path(url: str) -> Optional[Path]:
+    """The file an app URL serves, or None for URLs outside the asset roots or missing files"""
+    if url.startswith(STORAGE_URL_PREFIX):
+        try:
+            path = default_storage().local_path(unquote(url[len(STORAGE_URL_PREFIX):]))
+        except ValueError:
+            path = None
+        if path is not None and path.is_file():
+            return path
+        logger.warning(f"Not inlining {url}: no such asset")
+        return None
+    
+    for prefix, root in ASSET_ROOTS.items():
+        if not url.startswith(prefix):
+            continue
+        root = root.resolve()
+        path = (root / unquote(url[len(prefix):])).resolve()
+        if path.is_relative_to(root) and path.is_file():
+            return path
+        logger.warning(f"Not inlining {url}: no such asset")
+        return None
+    return None
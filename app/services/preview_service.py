@@ -0,0 +1,94 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from app.config import PREVIEW_CACHE_SIZE, PREVIEW_VERSION_HISTORY
+from app.services.markdown_scanner import scan_markdown
+from app.services.markdown_service import MarkdownService
+
+logger = logging.getLogger("markcv")
+
+class PreviewService:
+    """Incremental live preview: renders the CV per `## ` section and only
+    re-renders sections whose source changed"""
+    
+    def __init__(self, markdown_service: MarkdownService):
+        self.markdown_service = markdown_service
+        self.pandoc_service = markdown_service.pandoc_service
+        self._fragments: "OrderedDict[str, str]" = OrderedDict()
+        self._versions: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def render_preview(self, markdown: str, since_version: Optional[str] = None) -> Dict[str, Any]:
+        """Render the preview, returning only fragments the client does not have yet"""
+        order, sources = self._split_sections(markdown)
+        rendered = {
+            section_id: self.pandoc_service.convert_text(sources[section_id])
+            for section_id in self._missing_fragments(sources)
+        }
+        return self._build_response(order, rendered, since_version)
+    
+    async def render_preview_async(self, markdown: str, since_version: Optional[str] = None) -> Dict[str, Any]:
+        """Async counterpart of render_preview"""
+        order, sources = self._split_sections(markdown)
+        rendered = {}
+        for section_id in self._missing_fragments(sources):
+            rendered[section_id] = await self.pandoc_service.convert_text_async(sources[section_id])
+        return self._build_response(order, rendered, since_version)
+    
+    def _split_sections(self, markdown: str) -> Tuple[List[str], Dict[str, str]]:
+        """Split the CV on `## ` headings into section ids (hashes of their source)
+        in document order and a map of id to section markdown"""
+        order = []
+        sources = {}
+        for section in scan_markdown(markdown).sections:
+            source = markdown[section.start:section.end]
+            section_id = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+            order.append(section_id)
+            sources[section_id] = source
+        return order, sources
+    
+    def _missing_fragments(self, sources: Dict[str, str]) -> List[str]:
+        """Return the ids of sections that have no cached HTML yet"""
+        with self._lock:
+            missing = []
+            for section_id in sources:
+                if section_id in self._fragments:
+                    self._fragments.move_to_end(section_id)
+                else:
+                    missing.append(section_id)
+            return missing
+    
+    def _build_response(
+        self,
+        order: List[str],
+        rendered: Dict[str, str],
+        since_version: Optional[str]
+    ) -> Dict[str, Any]:
+        version = hashlib.sha256(",".join(order).encode("utf-8")).hexdigest()[:16]
+        
+        with self._lock:
+            for section_id, html in rendered.items():
+                self._fragments[section_id] = html
+            while len(self._fragments) > PREVIEW_CACHE_SIZE:
+                self._fragments.popitem(last=False)
+            
+            known = set(self._versions.get(since_version, [])) if since_version else set()
+            self._versions[version] = order
+            self._versions.move_to_end(version)
+            while len(self._versions) > PREVIEW_VERSION_HISTORY:
+                self._versions.popitem(last=False)
+            
+            fragments = {}
+            for section_id in order:
+                if section_id not in known:
+                    fragments[section_id] = rendered.get(section_id) or self._fragments.get(section_id, "")
+        
+        logger.debug(f"Preview {version}: {len(fragments)} of {len(set(order))} sections changed")
+        return {
+            "version": version,
+            "sections": order,
+            "fragments": fragments
+        }
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import logging
+
+from app.config import PRECOMPRESS_MIN_BYTES, PRECOMPRESS_SUFFIXES, RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES
+from app.services.http_cache import ENCODING_SUFFIXES, precompress
+
+logger = logging.getLogger("markcv")
+
+class RenderCache:
+    """Content-addressed on-disk cache of rendered outputs with LRU eviction.
+    
+    Entries keep the mtime of when they were rendered (served as Last-Modified);
+    recency of use is tracked in the atime. HTML entries get precompressed
+    .gz/.br copies, which are evicted together with their entry.
+    """
+    
+    def __init__(self, cache_dir: Path = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Compression runs off the request path; until it finishes the entry is served uncompressed
+        self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="markcv-compress")
+    
+    def make_key(self, *parts: Union[str, bytes]) -> str:
+        """Hash the given render inputs into a cache key"""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            # Length prefix keeps ("ab", "c") and ("a", "bc") apart
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+    
+    def get(self, key: str, suffix: str = ".html") -> Optional[Path]:
+        """Return the cached output for a key, or None on a miss"""
+        path = self._entry_path(key, suffix)
+        try:
+            # Bump the atime so eviction sees this entry as recently used
+            os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return path
+    
+    def put(self, key: str, source: Path, suffix: str = ".html") -> Path:
+        """Store a rendered file under a key and return the cached path"""
+        temp_path = self._temp_path()
+        shutil.copyfile(source, temp_path)
+        return self._commit(key, temp_path, suffix)
+    
+    def put_chunks(self, key: str, chunks: Iterable[str], suffix: str = ".html") -> Path:
+        """Write a stream of text under a key as it is produced and return the cached path"""
+        temp_path = self._temp_path()
+        try:
+            with open(temp_path, "w", encoding="utf-8", newline="") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return self._commit(key, temp_path, suffix)
+    
+    def clear(self) -> None:
+        """Remove every cached entry"""
+        for entry in self._files():
+            if entry.is_file():
+                entry.unlink(missing_ok=True)
+    
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current cache size"""
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes
+        }
+    
+    def _precompress(self, path: Path) -> None:
+        try:
+            precompress(path)
+        except FileNotFoundError:
+            # Evicted before we got to it
+            pass
+        except Exception as e:
+            logger.error(f"Error precompressing {path.name}: {e}")
+    
+    def _commit(self, key: str, temp_path: Path, suffix: str) -> Path:
+        path = self._entry_path(key, suffix)
+        os.replace(temp_path, path)
+        if suffix in PRECOMPRESS_SUFFIXES and path.stat().st_size >= PRECOMPRESS_MIN_BYTES:
+            self._compressor.submit(self._precompress, path)
+        self._evict(keep=path)
+        return path
+    
+    def _entry_path(self, key: str, suffix: str) -> Path:
+        return self.cache_dir / f"{key}{suffix}"
+    
+    def _temp_path(self) -> Path:
+        # Created on the first write, not when the service is constructed
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return self.cache_dir / f".{uuid.uuid4().hex}.tmp"
+    
+    def _files(self) -> List[Path]:
+        return list(self.cache_dir.iterdir()) if self.cache_dir.is_dir() else []
+    
+    def _evict(self, keep: Optional[Path] = None) -> None:
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, files in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if keep in files:
+                    # Never evict the entry that is about to be served
+                    continue
+                for entry in files:
+                    entry.unlink(missing_ok=True)
+                total -= size
+                self.evictions += 1
+                logger.info(f"Evicted render cache entry {files[0].name}")
+    
+    def _entries(self) -> List[Tuple[float, int, List[Path]]]:
+        """(last use, total size, files) per entry, with precompressed copies grouped under their entry"""
+        sidecar_suffixes = tuple(ENCODING_SUFFIXES.values())
+        entries: Dict[Path, list] = {}
+        for entry in self._files():
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            is_sidecar = entry.suffix in sidecar_suffixes
+            main = entry.with_suffix("") if is_sidecar else entry
+            grouped = entries.setdefault(main, [0.0, 0, []])
+            if not is_sidecar:
+                grouped[0] = stat.st_atime
+            grouped[1] += stat.st_size
+            # The entry itself goes first, so it is the one named in logs
+            grouped[2].insert(len(grouped[2]) if is_sidecar else 0, entry)
+        return [tuple(grouped) for grouped in entries.values()]
\ No newline at end of file
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+import logging
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+from app.config import DEFAULT_DOCUMENT_ID, RENDER_JOB_QUEUE_SIZE, RENDER_JOB_TTL_SECONDS, RENDER_JOB_WORKERS
+from app.services.html_service import HTMLService
+from app.services.metrics import add_request_timings, collect_request_timings
+from app.services.pdf_service import check_formats
+
+logger = logging.getLogger("markcv")
+
+class RenderJobService:
+    """In-process queue of renders served by a bounded pool of worker tasks.
+    
+    Requests for the same document content, template and settings share one
+    job while it is queued or running (single-flight). Finished jobs are kept
+    for RENDER_JOB_TTL_SECONDS so clients can poll them and fetch the result;
+    the output itself is the job's render cache entry.
+    """
+    
+    def __init__(
+        self,
+        html_service: HTMLService,
+        workers: int = RENDER_JOB_WORKERS,
+        queue_size: int = RENDER_JOB_QUEUE_SIZE,
+        ttl: float = RENDER_JOB_TTL_SECONDS
+    ):
+        self.html_service = html_service
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # Queued or running job per render inputs
+        self._inflight: Dict[str, str] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    async def submit(
+        self,
+        template_id: str = "europass",
+        paper_size: str = "a4",
+        theme_color: str = "blue",
+        document_id: str = DEFAULT_DOCUMENT_ID,
+        output_format: str = "html"
+    ) -> Dict[str, Any]:
+        """Queue a render, or join the identical one already queued or running, and return its job"""
+        self.html_service.document_store.validate(document_id)
+        check_formats([output_format])
+        # Unknown ids render with the fallback template, so they share its jobs
+        template_id = self.html_service.template_service.resolve_id(template_id)
+        self._start_workers()
+        
+        content = await self.html_service.markdown_service.get_markdown_async(document_id)
+        key = self._job_key(content, template_id, paper_size, theme_color, document_id, output_format)
+        job_id = self._inflight.get(key)
+        if job_id:
+            logger.info(f"Joining render job {job_id} for identical inputs")
+            return self.job_status(job_id)
+        
+        if self._queue.full():
+            raise HTTPException(status_code=503, detail="Render queue is full", headers={"Retry-After": "1"})
+        
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "key": key,
+            "status": "queued",
+            "params": {
+                "template_id": template_id,
+                "paper_size": paper_size,
+                "theme_color": theme_color,
+                "document_id": document_id,
+                "output_format": output_format
+            },
+            # Rendered as read here, so the output always matches the key it is shared under
+            "content": content,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "output": None,
+            "error": None,
+            "status_code": None,
+            "timings": [],
+            "done": asyncio.Event()
+        }
+        self._jobs[job_id] = job
+        self._inflight[key] = job_id
+        self._queue.put_nowait(job)
+        return self.job_status(job_id)
+    
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        job = self._get_job(job_id)
+        status = {
+            "id": job["id"],
+            "status": job["status"],
+            **job["params"],
+            "queued_seconds": _elapsed(job["created"], job["started"]),
+            "render_seconds": _elapsed(job["started"], job["finished"]) if job["started"] else None
+        }
+        if job["error"]:
+            status["error"] = job["error"]
+        return status
+    
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Wait (up to timeout seconds) for a job to finish and return its status"""
+        job = self._get_job(job_id)
+        try:
+            await asyncio.wait_for(job["done"].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.job_status(job_id)
+    
+    def job_response(self, job_id: str) -> FileResponse:
+        """Serve the output of a finished job"""
+        job = self._get_job(job_id)
+        if job["status"] == "failed":
+            raise HTTPException(status_code=job["status_code"], detail=job["error"])
+        if job["status"] != "done":
+            raise HTTPException(status_code=409, detail=f"Render job is {job['status']}")
+        if not job["output"].exists():
+            raise HTTPException(status_code=410, detail="Render job output has expired")
+        
+        add_request_timings(job["timings"])
+        return self.html_service.output_response(job["output"], job["params"]["output_format"])
+    
+    async def render(self, **params: Any) -> FileResponse:
+        """Render through the queue and serve the result: the synchronous /api/pdf"""
+        job = await self.submit(**params)
+        await self.wait(job["id"])
+        return self.job_response(job["id"])
+    
+    async def shutdown(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+    
+    def _start_workers(self) -> None:
+        # Started on first use, inside the running event loop (again if that loop changed)
+        if self._worker_tasks and self._loop is asyncio.get_running_loop():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"markcv-render-job-{i}") for i in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} render job workers")
+    
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job["status"] = "running"
+            job["started"] = time.time()
+            try:
+                with collect_request_timings() as timings:
+                    job["output"] = await self.html_service.render_output_async(**job["params"], content=job["content"])
+                job["timings"] = [("queue", job["started"] - job["created"])] + timings
+                job["status"] = "done"
+            except Exception as e:
+                job["status"] = "failed"
+                job["status_code"] = e.status_code if isinstance(e, HTTPException) else 500
+                job["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"Render job {job['id']} failed: {job['error']}")
+            finally:
+                if job["status"] == "running":
+                    # Cancelled by shutdown
+                    job.update(status="failed", status_code=503, error="Render was cancelled")
+                job["finished"] = time.time()
+                job["content"] = None
+                self._inflight.pop(job["key"], None)
+                job["done"].set()
+                self._queue.task_done()
+    
+    def _job_key(self, content: str, template_id: str, *settings: str) -> str:
+        digest = hashlib.sha256()
+        template_version = self.html_service.template_service.get_template_version(template_id)
+        for part in (content, template_id, template_version, *settings):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+    
+    def _get_job(self, job_id: str) -> Dict[str, Any]:
+        self._expire_jobs()
+        job = self._jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Render job not found")
+        return job
+    
+    def _expire_jobs(self) -> None:
+        """Forget jobs that finished more than ttl seconds ago"""
+        cutoff = time.time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job["finished"] and job["finished"] < cutoff:
+                del self._jobs[job_id]
+
+def _elapsed(start: Optional[float], end: Optional[float]) -> float:
+    return round((end or time.time()) - start, 3)
\ No newline at end of file
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+from app.config import REVISION_HISTORY, REVISION_SNAPSHOT_INTERVAL
+from app.services.storage import Storage
+
+logger = logging.getLogger("markcv")
+
+# (start, end, text): replace content[start:end] with text. Offsets count UTF-16
+# code units, as JavaScript strings do, so the editor can send them unconverted.
+Edit = Tuple[int, int, str]
+
+def content_version(content: str) -> str:
+    """Version of a document: a hash of its content"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+def apply_edits(content: str, edits: Sequence[Edit]) -> str:
+    """Apply sorted, non-overlapping edits to content; raises ValueError if they do not fit it"""
+    units = content.encode("utf-16-le")
+    parts = []
+    position = 0
+    for start, end, text in edits:
+        if not position <= start <= end <= len(units) // 2:
+            raise ValueError(f"Edit {start}-{end} is out of order or outside the document")
+        parts.append(units[position * 2:start * 2])
+        parts.append(text.encode("utf-16-le"))
+        position = end
+    parts.append(units[position * 2:])
+    try:
+        return b"".join(parts).decode("utf-16-le")
+    except UnicodeDecodeError:
+        raise ValueError("Edit offsets split a character")
+
+def diff_edits(old: str, new: str) -> List[Edit]:
+    """The single edit that turns old into new, keeping their common prefix and suffix"""
+    prefix = _common_prefix(old, new)
+    suffix = _common_prefix(old[prefix:][::-1], new[prefix:][::-1])
+    start = _utf16_length(old[:prefix])
+    end = start + _utf16_length(old[prefix:len(old) - suffix])
+    return [(start, end, new[prefix:len(new) - suffix])]
+
+def _common_prefix(a: str, b: str, step: int = 1024) -> int:
+    limit = min(len(a), len(b))
+    position = 0
+    # Compare in chunks; only the chunk that differs is scanned character by character
+    while position < limit:
+        chunk_end = min(position + step, limit)
+        if a[position:chunk_end] != b[position:chunk_end]:
+            while a[position] == b[position]:
+                position += 1
+            return position
+        position = chunk_end
+    return limit
+
+def _utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+@dataclass
+class Revision:
+    revision: int
+    version: str
+    saved_at: str
+    size: int
+
+class RevisionLog:
+    """Append-only JSON lines log of a document's revisions.
+    
+    Every REVISION_SNAPSHOT_INTERVAL-th revision (and any revision that does not
+    follow from the logged one, like an edit made outside MarkCV) is stored in
+    full; the others only as the edits from the revision before. Once the log
+    holds more than REVISION_HISTORY + REVISION_SNAPSHOT_INTERVAL revisions it is
+    rewritten with the newest REVISION_HISTORY, starting from a fresh snapshot.
+    
+    The log is an object in shared storage; the head is cached and reloaded
+    when the object's etag shows another process changed it. Callers hold
+    the document's storage lock around head() and append().
+    """
+    
+    def __init__(
+        self,
+        storage: Storage,
+        key: str,
+        history: int = REVISION_HISTORY,
+        snapshot_interval: int = REVISION_SNAPSHOT_INTERVAL
+    ):
+        self.storage = storage
+        self.key = key
+        self.history = history
+        self.snapshot_interval = snapshot_interval
+        self._head: Optional[Revision] = None
+        self._count = 0
+        # Etag of the log when the head was read, None before that
+        self._etag: Optional[str] = None
+        self._lock = threading.Lock()
+    
+    def head(self) -> Optional[Revision]:
+        """The latest revision, or None for a document without history"""
+        with self._lock:
+            self._load()
+            return self._head
+    
+    def append(self, content: str, previous: Optional[str], edits: Optional[Sequence[Edit]] = None) -> Revision:
+        """Log content as a new revision; previous is the content it replaced"""
+        with self._lock:
+            self._load()
+            head = self._head
+            revision = Revision(
+                revision=head.revision + 1 if head else 1,
+                version=content_version(content),
+                saved_at=datetime.now().isoformat(),
+                size=len(content.encode("utf-8"))
+            )
+            entry: Dict[str, Any] = asdict(revision)
+            
+            follows_head = head is not None and previous is not None and head.version == content_version(previous)
+            if follows_head and revision.revision % self.snapshot_interval:
+                entry["edits"] = [list(edit) for edit in (edits or diff_edits(previous, content))]
+            else:
+                entry["snapshot"] = content
+            
+            # One write per line, so a crash can at worst leave a torn last line, which reads skip
+            self.storage.append(self.key, _entry_line(entry).encode("utf-8"))
+            self._head = revision
+            self._count += 1
+            self._etag = self._current_etag()
+            
+            if self._count > self.history + self.snapshot_interval:
+                self._compact()
+            return revision
+    
+    def revisions(self) -> List[Revision]:
+        """Every revision still in the log, oldest first"""
+        with self._lock:
+            return [revision for revision, _ in self._replay()]
+    
+    def content_at(self, revision_number: int) -> Optional[str]:
+        """Content of a logged revision, or None if it is no longer (or was never) kept"""
+        with self._lock:
+            for revision, content in self._replay():
+                if revision.revision == revision_number:
+                    return content
+        return None
+    
+    def _load(self) -> None:
+        etag = self._current_etag()
+        if self._etag is not None and etag == self._etag:
+            return
+        try:
+            text = self.storage.read_text(self.key)
+        except FileNotFoundError:
+            text = ""
+        if text and not text.endswith("\n"):
+            # End the torn line a crash left behind, so the next entry starts on its own line
+            self.storage.append(self.key, b"\n")
+            etag = self._current_etag()
+        entries = list(self._parse(text))
+        self._head = _revision(entries[-1]) if entries else None
+        self._count = len(entries)
+        self._etag = etag or ""
+    
+    def _current_etag(self) -> Optional[str]:
+        stored = self.storage.stat(self.key)
+        return stored.etag if stored else None
+    
+    def _read(self) -> Iterator[Dict[str, Any]]:
+        try:
+            text = self.storage.read_text(self.key)
+        except FileNotFoundError:
+            return
+        yield from self._parse(text)
+    
+    def _parse(self, text: str) -> Iterator[Dict[str, Any]]:
+        # Not splitlines(): unescaped U+2028 and friends can occur inside entries
+        for line in text.split("\n"):
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping a damaged entry in {self.key}")
+    
+    def _replay(self) -> Iterator[Tuple[Revision, Optional[str]]]:
+        """Yield (revision, content) for each entry; content is None where the chain of edits is broken"""
+        content: Optional[str] = None
+        for entry in self._read():
+            if "snapshot" in entry:
+                content = entry["snapshot"]
+            elif content is not None:
+                try:
+                    content = apply_edits(content, [tuple(edit) for edit in entry["edits"]])
+                except (ValueError, TypeError, KeyError):
+                    content = None
+            revision = _revision(entry)
+            if content is not None and content_version(content) != revision.version:
+                content = None
+            yield revision, content
+    
+    def _compact(self) -> None:
+        """Rewrite the log with only the newest revisions, the oldest of them as a snapshot"""
+        entries = []
+        previous: Optional[str] = None
+        for revision, content in list(self._replay())[-self.history:]:
+            if content is None:
+                # Cannot be rebuilt from a damaged log; the next good revision starts a new snapshot
+                previous = None
+                continue
+            entry: Dict[str, Any] = asdict(revision)
+            if previous is None:
+                entry["snapshot"] = content
+            else:
+                entry["edits"] = [list(edit) for edit in diff_edits(previous, content)]
+            entries.append(entry)
+            previous = content
+        
+        self.storage.write_text(self.key, "".join(_entry_line(entry) for entry in entries))
+        self._count = len(entries)
+        self._etag = self._current_etag()
+        logger.info(f"Compacted {self.key} to {self._count} revisions")
+
+def _entry_line(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def _revision(entry: Dict[str, Any]) -> Revision:
+    return Revision(
+        revision=entry["revision"],
+        version=entry["version"],
+        saved_at=entry["saved_at"],
+        size=entry["size"]
+    )
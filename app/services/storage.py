@@ -0,0 +1,411 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+from stat import S_ISREG
+from typing import ContextManager, Iterator, List, NamedTuple, Optional
+import logging
+
+from app.config import (
+    DATA_DIR,
+    STORAGE_BACKEND,
+    STORAGE_CACHE_DIR,
+    STORAGE_DB_FILE,
+    STORAGE_LOCK_LEASE_SECONDS,
+    STORAGE_LOCK_TIMEOUT,
+)
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: locks there only exclude threads of the same process
+    fcntl = None
+
+logger = logging.getLogger("markcv")
+
+# Objects of the local layout a new SQLite database imports on its first start; caches stay behind
+LOCAL_IMPORT_KEYS = ("cv.md", "cv.revisions.jsonl", "cv.html", "cv.pdf")
+LOCAL_IMPORT_PREFIXES = ("documents/", "images/")
+
+# Seconds between attempts to take a lock someone else holds
+LOCK_POLL_INTERVAL = 0.005
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    modified: float
+    # Changes whenever the content does
+    etag: str
+
+def check_key(key: str) -> str:
+    """Keys are relative POSIX paths ("cv.md", "images/<id>") without hidden or parent parts"""
+    parts = PurePosixPath(key).parts
+    if not parts or key.startswith("/") or any(part.startswith(".") for part in parts):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+def image_key(image_id: str) -> str:
+    return check_key(f"images/{image_id}")
+
+class Storage:
+    """Where documents, their revision logs and published outputs, and uploaded images are kept.
+    
+    Objects are addressed by key and always replaced whole, except for
+    append; lock(key) excludes every process sharing the storage, not only
+    threads of this one. Render caches and image derivatives are derived
+    data and stay on each machine's local disk.
+    """
+    
+    def read_bytes(self, key: str) -> bytes:
+        """Content of an object; raises FileNotFoundError if there is none"""
+        raise NotImplementedError
+    
+    def read_text(self, key: str) -> str:
+        """Content of an object as text, with universal newlines like a file opened in text mode"""
+        return self.read_bytes(key).decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    
+    def write_bytes(self, key: str, data: bytes) -> None:
+        """Atomically create or replace an object"""
+        raise NotImplementedError
+    
+    def write_text(self, key: str, text: str) -> None:
+        self.write_bytes(key, text.encode("utf-8"))
+    
+    def write_file(self, key: str, source: Path) -> None:
+        """Atomically create or replace an object with the content of a local file"""
+        self.write_bytes(key, source.read_bytes())
+    
+    def append(self, key: str, data: bytes) -> None:
+        """Add data to the end of an object, creating it if needed"""
+        raise NotImplementedError
+    
+    def stat(self, key: str) -> Optional[StoredObject]:
+        """Size, modification time and etag of an object, or None if there is none"""
+        raise NotImplementedError
+    
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+    
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+    
+    def list(self, prefix: str = "") -> List[str]:
+        """Keys of all objects under a prefix ("documents/"), sorted"""
+        raise NotImplementedError
+    
+    def local_path(self, key: str) -> Path:
+        """A local file with an object's content, for code that needs a path (pandoc, Pillow, FileResponse).
+        
+        The file must not be modified. For a missing object the path does not exist.
+        """
+        raise NotImplementedError
+    
+    def lock(self, key: str, timeout: float = STORAGE_LOCK_TIMEOUT) -> ContextManager[None]:
+        """Hold an exclusive lock named after key; raises TimeoutError if it cannot be taken in time"""
+        raise NotImplementedError
+
+class LocalStorage(Storage):
+    """Objects as files under a directory, laid out as data/ always has been.
+    
+    Several processes (or machines sharing the directory over a file system
+    with working flock) can use it at once: writes go through a temporary
+    file and a rename, locks are flock()ed .<name>.lock files.
+    """
+    
+    def __init__(self, root: Path = DATA_DIR):
+        self.root = root
+    
+    def read_bytes(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+    
+    def write_bytes(self, key: str, data: bytes) -> None:
+        temp_path = self._temp_path(key)
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        # Readers see the old or the new object, never a truncated one
+        os.replace(temp_path, self._path(key))
+    
+    def write_file(self, key: str, source: Path) -> None:
+        temp_path = self._temp_path(key)
+        try:
+            # Sources (renders, uploads) are never modified in place, so a hard link saves copying them
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, self._path(key))
+    
+    def append(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data)
+    
+    def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            stat = self._path(key).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return StoredObject(
+            key=key,
+            size=stat.st_size,
+            modified=stat.st_mtime,
+            etag=f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        )
+    
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+    
+    def list(self, prefix: str = "") -> List[str]:
+        keys = []
+        # Only the directory the prefix points into is walked, not the whole data directory
+        for directory, dirnames, filenames in os.walk(self.root / prefix.rpartition("/")[0]):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            relative = Path(directory).relative_to(self.root).as_posix()
+            for name in filenames:
+                key = name if relative == "." else f"{relative}/{name}"
+                if key.startswith(prefix) and not name.startswith("."):
+                    keys.append(key)
+        return sorted(keys)
+    
+    def local_path(self, key: str) -> Path:
+        return self._path(key)
+    
+    @contextmanager
+    def lock(self, key: str, timeout: float = STORAGE_LOCK_TIMEOUT) -> Iterator[None]:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = path.with_name(f".{path.name}.lock")
+        with _thread_lock(lock_path, timeout), open(lock_path, "a") as f:
+            if fcntl is not None:
+                deadline = time.monotonic() + timeout
+                while True:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() > deadline:
+                            raise TimeoutError(f"Timed out waiting for the lock on {key}")
+                        time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    
+    def _path(self, key: str) -> Path:
+        return self.root / check_key(key)
+    
+    def _temp_path(self, key: str) -> Path:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+class SQLiteStorage(Storage):
+    """Objects as rows of one SQLite database, a stand-in for an object store.
+    
+    Every process (or machine) pointed at the same database file shares the
+    documents and images in it. Locks are leases in a table, so a crashed
+    holder's lock expires after STORAGE_LOCK_LEASE_SECONDS. local_path()
+    copies objects into a per-machine cache directory, named by content hash.
+    """
+    
+    def __init__(
+        self,
+        db_file: Path = STORAGE_DB_FILE,
+        cache_dir: Path = STORAGE_CACHE_DIR,
+        lease_seconds: float = STORAGE_LOCK_LEASE_SECONDS,
+        import_source: Optional["LocalStorage"] = None
+    ):
+        self.db_file = db_file
+        self.cache_dir = cache_dir
+        self.lease_seconds = lease_seconds
+        # Imported once into a new database by import_local()
+        self.import_source = import_source
+        self._local = threading.local()
+        self._prepared = False
+        self._prepare_lock = threading.Lock()
+    
+    def read_bytes(self, key: str) -> bytes:
+        row = self._connection().execute("SELECT data FROM objects WHERE key = ?", (check_key(key),)).fetchone()
+        if row is None:
+            raise FileNotFoundError(key)
+        return row[0]
+    
+    def write_bytes(self, key: str, data: bytes) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO objects (key, data, size, modified, etag) VALUES (?, ?, ?, ?, ?)",
+            (check_key(key), data, len(data), time.time(), hashlib.sha256(data).hexdigest())
+        )
+    
+    def append(self, key: str, data: bytes) -> None:
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so no other append can slip in between
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM objects WHERE key = ?", (check_key(key),)).fetchone()
+            data = (row[0] if row else b"") + data
+            conn.execute(
+                "INSERT OR REPLACE INTO objects (key, data, size, modified, etag) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), time.time(), hashlib.sha256(data).hexdigest())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def stat(self, key: str) -> Optional[StoredObject]:
+        row = self._connection().execute(
+            "SELECT size, modified, etag FROM objects WHERE key = ?", (check_key(key),)
+        ).fetchone()
+        return StoredObject(key, *row) if row else None
+    
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM objects WHERE key = ?", (check_key(key),))
+    
+    def list(self, prefix: str = "") -> List[str]:
+        rows = self._connection().execute(
+            "SELECT key FROM objects WHERE substr(key, 1, ?) = ? ORDER BY key", (len(prefix), prefix)
+        ).fetchall()
+        return [row[0] for row in rows]
+    
+    def local_path(self, key: str) -> Path:
+        suffix = PurePosixPath(check_key(key)).suffix
+        stored = self.stat(key)
+        if stored is None:
+            return self.cache_dir / "missing" / key
+        
+        path = self.cache_dir / stored.etag[:2] / f"{stored.etag}{suffix}"
+        if not path.exists():
+            try:
+                data = self.read_bytes(key)
+            except FileNotFoundError:
+                return self.cache_dir / "missing" / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+            temp_path.write_bytes(data)
+            os.replace(temp_path, path)
+        return path
+    
+    @contextmanager
+    def lock(self, key: str, timeout: float = STORAGE_LOCK_TIMEOUT) -> Iterator[None]:
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self._acquire(check_key(key), owner):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for the lock on {key}")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self._connection().execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+    
+    def import_local(self, source: "LocalStorage") -> None:
+        """Copy the objects of a local data/ directory in, once per database, without overwriting any"""
+        keys = [key for key in LOCAL_IMPORT_KEYS if source.stat(key)]
+        keys += [key for prefix in LOCAL_IMPORT_PREFIXES for key in source.list(prefix)]
+        imported = 0
+        with self._connection() as conn:
+            # The write lock makes one process import while the others wait and then find it done
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM imports WHERE name = 'local'").fetchone():
+                return
+            for key in keys:
+                stored = source.stat(key)
+                if stored is None:
+                    continue
+                data = source.read_bytes(key)
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO objects (key, data, size, modified, etag) VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data), stored.modified, hashlib.sha256(data).hexdigest())
+                )
+                imported += cursor.rowcount
+            conn.execute("INSERT INTO imports (name, imported) VALUES ('local', ?)", (time.time(),))
+        if imported:
+            logger.info(f"Imported {imported} objects from {source.root} into {self.db_file}")
+    
+    def _acquire(self, key: str, owner: str) -> bool:
+        now = time.time()
+        conn = self._connection()
+        # Statements commit on their own; the primary key lets only one owner in
+        conn.execute("DELETE FROM locks WHERE key = ? AND expires < ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO locks (key, owner, expires) VALUES (?, ?, ?)",
+            (key, owner, now + self.lease_seconds)
+        )
+        return cursor.rowcount > 0
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._prepare()
+        return conn
+    
+    def _prepare(self) -> None:
+        """Create the schema and run the one-time import on first use, not at construction"""
+        with self._prepare_lock:
+            if self._prepared:
+                return
+            self._create_schema()
+            if self.import_source is not None:
+                self.import_local(self.import_source)
+            self._prepared = True
+    
+    def _create_schema(self) -> None:
+        conn = self._connection()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                modified REAL NOT NULL,
+                etag TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+        # One-time imports already done, by name
+        conn.execute("CREATE TABLE IF NOT EXISTS imports (name TEXT PRIMARY KEY, imported REAL NOT NULL)")
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+@contextmanager
+def _thread_lock(path: Path, timeout: float) -> Iterator[None]:
+    """flock() excludes processes; this also keeps threads of one process out of each other's way"""
+    with _thread_locks_lock:
+        lock = _thread_locks.setdefault(str(path), threading.Lock())
+    if not lock.acquire(timeout=timeout):
+        raise TimeoutError(f"Timed out waiting for the lock on {path}")
+    try:
+        yield
+    finally:
+        lock.release()
+
+@lru_cache(maxsize=None)
+def default_storage() -> Storage:
+    """The storage backend selected by MARKCV_STORAGE, shared by every service of the process"""
+    if STORAGE_BACKEND == "sqlite":
+        logger.info(f"Using shared SQLite storage {STORAGE_DB_FILE}")
+        return SQLiteStorage(import_source=LocalStorage())
+    return LocalStorage()
\ No newline at end of file
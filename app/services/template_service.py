@@ -1,50 +1,223 @@
+import hashlib
 import json
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, NamedTuple, Optional, Set, Tuple
 import logging
 
-from app.config import TEMPLATE_DIR
+from app.config import TEMPLATE_DIR, TEMPLATE_POLL_INTERVAL, THEME_CSS_DIR
 
 logger = logging.getLogger("markcv")
 
+DEFAULT_TEMPLATES = [{
+    "id": "default",
+    "name": "Default",
+    "description": "Default CV template",
+    "paperSizes": ["a4", "letter"],
+    "recommendedFonts": ["DejaVu Sans", "Helvetica", "Arial"]
+}]
+# Unknown template ids come from requests, so only this many are remembered to warn about once
+MAX_WARNED_IDS = 256
+
+class TemplateEntry(NamedTuple):
+    """A loaded template: its metadata, files and a version that changes with any of them"""
+    id: str
+    metadata: Dict[str, Any]
+    template_html: Optional[Path]
+    css_file: Path
+    version: str
+    # (size, mtime) of metadata.json, template.html and the theme CSS when loaded
+    signature: Tuple[Tuple[int, int], ...]
+
 class TemplateService:
+    """Registry of CV templates, loaded once and kept in memory.
+    
+    Templates are loaded on the first lookup (or by load() during warm-up).
+    From then on a background thread polls the template and theme CSS files
+    for changes and reloads only the templates that changed, so lookups
+    never touch disk.
+    """
+    
+    def __init__(
+        self,
+        template_dir: Path = TEMPLATE_DIR,
+        css_dir: Path = THEME_CSS_DIR,
+        poll_interval: float = TEMPLATE_POLL_INTERVAL
+    ):
+        self.template_dir = template_dir
+        self.css_dir = css_dir
+        self.poll_interval = poll_interval
+        self._templates: Dict[str, TemplateEntry] = {}
+        self._warned_ids: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+    
+    def load(self) -> None:
+        """Load the templates and start watching them for changes, once"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.reload()
+            if self.poll_interval > 0:
+                threading.Thread(target=self._watch, name="markcv-templates", daemon=True).start()
+            self._loaded = True
+    
     def get_templates(self) -> List[Dict[str, Any]]:
         """Get list of available templates"""
-        templates = []
-        
-        for template_dir in TEMPLATE_DIR.iterdir():
-            if template_dir.is_dir():
-                metadata_file = template_dir / "metadata.json"
-                if metadata_file.exists():
-                    try:
-                        with open(metadata_file, "r") as f:
-                            metadata = json.load(f)
-                            templates.append(metadata)
-                    except Exception as e:
-                        logger.error(f"Error reading template metadata: {e}")
-        
-        if not templates:
-            templates.append({
-                "id": "default",
-                "name": "Default",
-                "description": "Default CV template",
-                "paperSizes": ["a4", "letter"],
-                "recommendedFonts": ["DejaVu Sans", "Helvetica", "Arial"]
-            })
-        
-        return templates
+        self.load()
+        with self._lock:
+            templates = [
+                {**entry.metadata, "version": entry.version}
+                for entry in self._templates.values() if entry.metadata is not None
+            ]
+        return templates or [dict(template) for template in DEFAULT_TEMPLATES]
     
     def get_template_path(self, template_id: str) -> Path:
         """Get the path to a template's HTML file"""
-        template_dir = TEMPLATE_DIR / template_id
-        if not template_dir.exists() or not template_dir.is_dir():
-            logger.warning(f"Template {template_id} not found, using default")
-            template_id = "europass"
-            template_dir = TEMPLATE_DIR / template_id
-        
-        template_html = template_dir / "template.html"
-        if not template_html.exists():
+        entry = self._resolve(template_id)
+        if not entry or not entry.template_html:
             logger.warning(f"Template HTML not found for {template_id}")
             raise FileNotFoundError(f"Template HTML not found for {template_id}")
-            
-        return template_html
\ No newline at end of file
+        
+        return entry.template_html
+    
+    def get_template_css(self, template_id: str) -> Path:
+        """Get the path to a template's theme CSS file"""
+        entry = self._resolve(template_id)
+        return entry.css_file if entry else self.css_dir / f"{template_id}.css"
+    
+    def resolve_id(self, template_id: str) -> str:
+        """Id of the template a render with this id uses: europass for unknown ids"""
+        entry = self._resolve(template_id)
+        return entry.id if entry else template_id
+    
+    def get_template_metadata(self, template_id: str) -> Dict[str, Any]:
+        """Get a template's metadata.json, or an empty dict if it has none"""
+        self.load()
+        with self._lock:
+            entry = self._templates.get(template_id)
+        return dict(entry.metadata) if entry and entry.metadata else {}
+    
+    def get_template_version(self, template_id: str) -> str:
+        """Version of the template a render with this id uses; changes whenever its files do"""
+        entry = self._resolve(template_id)
+        return entry.version if entry else ""
+    
+    def get_templates_version(self) -> str:
+        """Version of the whole template list, usable as an ETag"""
+        self.load()
+        with self._lock:
+            versions = sorted(f"{template_id}:{entry.version}" for template_id, entry in self._templates.items())
+        return hashlib.sha256(",".join(versions).encode("utf-8")).hexdigest()[:16]
+    
+    def reload(self) -> List[str]:
+        """Reload templates whose files changed, returning the ids that were (re)loaded or removed"""
+        template_ids = set()
+        if self.template_dir.is_dir():
+            template_ids = {entry.name for entry in self.template_dir.iterdir() if entry.is_dir()}
+        
+        changed = []
+        with self._lock:
+            current = dict(self._templates)
+        
+        for template_id in sorted(template_ids):
+            signature = self._signature(template_id)
+            existing = current.get(template_id)
+            if existing and existing.signature == signature:
+                continue
+            current[template_id] = self._load(template_id, signature)
+            changed.append(template_id)
+        
+        for template_id in set(current) - template_ids:
+            del current[template_id]
+            changed.append(template_id)
+        
+        if changed:
+            with self._lock:
+                self._templates = current
+                self._warned_ids.clear()
+            logger.info(f"Loaded templates: {', '.join(changed)}")
+        return changed
+    
+    def stop(self) -> None:
+        """Stop watching for template changes"""
+        self._stop.set()
+    
+    def _resolve(self, template_id: str) -> Optional[TemplateEntry]:
+        """Look up a template, falling back to europass for unknown ids like the directory lookup did"""
+        self.load()
+        with self._lock:
+            entry = self._templates.get(template_id)
+            if entry:
+                return entry
+            first_lookup = template_id not in self._warned_ids and len(self._warned_ids) < MAX_WARNED_IDS
+            if first_lookup:
+                self._warned_ids.add(template_id)
+            default = self._templates.get("europass")
+        
+        if first_lookup:
+            logger.warning(f"Template {template_id} not found, using default")
+        else:
+            logger.debug(f"Template {template_id} not found, using default")
+        return default
+    
+    def _files(self, template_id: str) -> Tuple[Path, Path, Path]:
+        template_path = self.template_dir / template_id
+        return template_path / "metadata.json", template_path / "template.html", self.css_dir / f"{template_id}.css"
+    
+    def _signature(self, template_id: str) -> Tuple[Tuple[int, int], ...]:
+        signature = []
+        for path in self._files(template_id):
+            try:
+                stat = path.stat()
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append((-1, 0))
+        return tuple(signature)
+    
+    def _load(self, template_id: str, signature: Tuple[Tuple[int, int], ...]) -> TemplateEntry:
+        """Read and validate one template's files"""
+        metadata_file, template_html, css_file = self._files(template_id)
+        digest = hashlib.sha256()
+        
+        metadata = None
+        if metadata_file.exists():
+            try:
+                with open(metadata_file, "r") as f:
+                    metadata = json.load(f)
+                if not isinstance(metadata, dict):
+                    raise ValueError("metadata.json must contain an object")
+                if metadata.get("id") != template_id:
+                    logger.warning(f"Template {template_id} declares id {metadata.get('id')!r} in metadata.json")
+                digest.update(json.dumps(metadata, sort_keys=True).encode("utf-8"))
+            except Exception as e:
+                logger.error(f"Error reading template metadata: {e}")
+                metadata = None
+        
+        for path in (template_html, css_file):
+            if path.exists():
+                digest.update(hashlib.sha256(path.read_bytes()).digest())
+            else:
+                digest.update(b"missing")
+                logger.warning(f"Template {template_id} has no {path}")
+        
+        return TemplateEntry(
+            id=template_id,
+            metadata=metadata,
+            template_html=template_html if template_html.exists() else None,
+            css_file=css_file,
+            version=digest.hexdigest()[:16],
+            signature=signature
+        )
+    
+    def _watch(self) -> None:
+        """Poll template files for changes until stopped"""
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Error reloading templates: {e}")
\ No newline at end of file
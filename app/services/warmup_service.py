@@ -0,0 +1,102 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+from app.config import DEFAULT_DOCUMENT_ID, WARMUP_ENABLED
+from app.services.html_service import HTMLService
+from app.services.pdf_service import PDFService
+from app.services.preview_service import PreviewService
+
+logger = logging.getLogger("markcv")
+
+class WarmupService:
+    """Brings a freshly started process to steady-state render latency.
+    
+    Runs once after startup: reloads the templates, compiles their CSS
+    bundles, starts pandoc, renders the default CV with every template
+    (filling the render cache and the native renderer's caches without
+    publishing anything), renders its
+    preview and, when WeasyPrint is installed, converts one render to PDF
+    to start the PDF workers and load fonts. A failing stage is logged and
+    skipped; the service reports ready once all stages have run.
+    """
+    
+    def __init__(self, html_service: HTMLService, preview_service: PreviewService, enabled: bool = WARMUP_ENABLED):
+        self.html_service = html_service
+        self.preview_service = preview_service
+        self.enabled = enabled
+        self.status = "starting"
+        self.stages: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._rendered: List[Path] = []
+    
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+    
+    def report(self) -> Dict[str, Any]:
+        """Readiness and per-stage durations in seconds, as served by /health/ready"""
+        report: Dict[str, Any] = {"status": self.status, "stages": dict(self.stages)}
+        if self.errors:
+            report["errors"] = dict(self.errors)
+        return report
+    
+    async def run(self) -> None:
+        if not self.enabled:
+            self.status = "ready"
+            return
+        
+        self.status = "warming"
+        start = time.perf_counter()
+        await self._stage("templates", self._load_templates)
+        await self._stage("css", self._compile_css)
+        await self._stage("pandoc", self._start_pandoc)
+        await self._stage("render", self._render_templates)
+        await self._stage("preview", self._render_preview)
+        if self._rendered and await asyncio.to_thread(PDFService.available):
+            await self._stage("pdf", self._render_pdf)
+        self.status = "ready"
+        logger.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+    
+    async def _stage(self, name: str, func: Callable[[], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        try:
+            await func()
+        except Exception as e:
+            self.errors[name] = str(e)
+            logger.warning(f"Warm-up stage {name} failed: {e}")
+        self.stages[name] = round(time.perf_counter() - start, 3)
+    
+    async def _load_templates(self) -> None:
+        await asyncio.to_thread(self.html_service.template_service.load)
+    
+    async def _compile_css(self) -> None:
+        await asyncio.to_thread(self.html_service.css_bundler.precompile)
+    
+    async def _start_pandoc(self) -> None:
+        await self.html_service.pandoc_service.convert_text_async("MarkCV")
+    
+    async def _render_templates(self) -> None:
+        content = await self.html_service.markdown_service.get_markdown_async(DEFAULT_DOCUMENT_ID)
+        for template in self.html_service.template_service.get_templates():
+            rendered = await self._render_template(content, template["id"])
+            if rendered:
+                self._rendered.append(rendered)
+    
+    async def _render_template(self, content: str, template_id: str) -> Optional[Path]:
+        try:
+            self.html_service.template_service.get_template_path(template_id)
+        except FileNotFoundError:
+            return None
+        # document_id=None: cached for the first real request, which publishes it as cv.html.
+        # Takes a render slot like any request, so a burst during warm-up stays within the limit
+        return await self.html_service.render_content_async(content, template_id, "a4", "blue", None)
+    
+    async def _render_preview(self) -> None:
+        content = await self.html_service.markdown_service.get_markdown_async(DEFAULT_DOCUMENT_ID)
+        await self.preview_service.render_preview_async(content)
+    
+    async def _render_pdf(self) -> None:
+        await self.html_service.pdf_service.render_pdf_async(self._rendered[0], "a4")
@@ -0,0 +1,231 @@
+"""Compare the native render engine against pandoc.
+
+Renders the bundled example CVs, synthetic CVs and a sample of markdown
+constructs through both engines in a scratch workspace, and diffs the
+results after normalizing what does not change the rendered page
+(whitespace, attribute order, self-closing tags):
+    
+    python -m benchmarks.engine_diff --template europass --repeat 5
+
+Prints a JSON report with the differences and the render time of each
+engine, and exits with status 1 if any case renders differently.
+"""
+import argparse
+import base64
+import difflib
+import hashlib
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.synthetic_cv import EXAMPLE_FILES, REPO_ROOT, generate_cv, generate_images, image_name
+
+# Markdown constructs beyond what the example CVs use
+CONSTRUCTS = """# Jane "JD" Doe
+
+![profile](/data/images/bench-0.jpg){.x-offset=10 .y-offset=-5}
+
+**Engineer** | jane@example.com | [Site](https://example.com "Personal site")
+
+## Skills
+
+- *Python* -- 10 years
+- `Go`, Rust... and C
+
+## Experience
+
+### Lead --- Acme & Co. (2020 - now)
+
+It's a "quoted" line with a hard
+break and <span class="note">raw HTML</span>.
+
+![diagram|width=300px](/data/images/bench-1.jpg)
+
+1. First
+2. Second
+
+> A quote
+
+---
+
+| Year | Role |
+|------|------|
+| 2020 | Lead |
+
+## Experience
+
+Duplicate heading ids get a numeric suffix, [references][ref] resolve across sections.
+
+[ref]: https://example.com/ref
+"""
+
+class _Normalizer(HTMLParser):
+    """Flatten HTML to one token per tag or text run"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens: List[str] = []
+    
+    def handle_starttag(self, tag, attrs):
+        normalized = []
+        for name, value in sorted(attrs):
+            if value and value.startswith("data:"):
+                # Embedded files compare by content, not by their base64 text
+                payload = base64.b64decode(value.split(",", 1)[1])
+                value = f"data:{hashlib.sha256(payload).hexdigest()[:16]}"
+            normalized.append(f"{name}={value!r}")
+        self.tokens.append(f"<{tag} {' '.join(normalized)}>".replace(" >", ">"))
+    
+    handle_startendtag = handle_starttag
+    
+    def handle_endtag(self, tag):
+        self.tokens.append(f"</{tag}>")
+    
+    def handle_data(self, data):
+        text = " ".join(data.split())
+        if text:
+            self.tokens.append(text)
+
+def normalize(html: str) -> List[str]:
+    parser = _Normalizer()
+    parser.feed(html)
+    parser.close()
+    return parser.tokens
+
+def load_cases(args: argparse.Namespace) -> Dict[str, str]:
+    """Markdown documents to render, with image links pointing at generated images"""
+    cases = {}
+    for example_file in EXAMPLE_FILES:
+        content = example_file.read_text()
+        cases[str(example_file.relative_to(REPO_ROOT))] = re.sub(
+            r"\(/data/images/[^)]*\)", f"(/data/images/{image_name(0)})", content
+        )
+    for sections, bullets in ((1, 1), (5, 5), (args.sections, args.bullets)):
+        cases[f"synthetic-{sections}x{bullets}"] = generate_cv(sections, bullets, args.images)
+    cases["constructs"] = CONSTRUCTS
+    return cases
+
+def render_pandoc(html_service, content: str, template_id: str, paper_size: str, theme_color: str) -> str:
+    template_html = html_service.template_service.get_template_path(template_id)
+    css_file = html_service.template_service.get_template_css(template_id)
+    print_sizes = html_service.template_service.get_template_metadata(template_id).get("printImages", {})
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file = Path(temp_dir) / "cv.html"
+        cmd_html = html_service._build_render_command(
+            content, Path(temp_dir), output_file, template_html, css_file, paper_size, theme_color, print_sizes
+        )
+        html_service.pandoc_service.run(cmd_html[1:])
+        return output_file.read_text()
+
+def render_native(html_service, content: str, template_id: str, paper_size: str, theme_color: str) -> str:
+    template_html = html_service.template_service.get_template_path(template_id)
+    css_file = html_service.template_service.get_template_css(template_id)
+    print_sizes = html_service.template_service.get_template_metadata(template_id).get("printImages", {})
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file = Path(temp_dir) / "cv.html"
+        if not html_service._render_native(
+            content, output_file, template_id, template_html, css_file, paper_size, theme_color, print_sizes
+        ):
+            raise SystemExit(f"Template {template_id} does not render with the native engine")
+        return output_file.read_text()
+
+def timed(func, repeat: int) -> Dict[str, Any]:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return {
+        "result": result,
+        "first_ms": seconds[0] * 1000,
+        "median_ms": statistics.median(seconds) * 1000,
+        "min_ms": min(seconds) * 1000
+    }
+
+def run_diff(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported here: app.config resolves data/ relative to the workspace we just entered
+    from app.services.html_service import HTMLService
+    from app.services.markdown_service import MarkdownService
+    from app.services.pandoc_service import PandocService
+    from app.services.template_service import TemplateService
+    
+    pandoc_service = PandocService()
+    html_service = HTMLService(
+        TemplateService(poll_interval=0), MarkdownService(pandoc_service), pandoc_service=pandoc_service
+    )
+    render_args = (args.template, args.paper_size, args.theme_color)
+    
+    cases = {}
+    for name, content in load_cases(args).items():
+        pandoc = timed(lambda: render_pandoc(html_service, content, *render_args), args.repeat)
+        native = timed(lambda: render_native(html_service, content, *render_args), args.repeat)
+        diff = list(difflib.unified_diff(
+            normalize(pandoc["result"]), normalize(native["result"]), "pandoc", "native", lineterm="", n=2
+        ))
+        cases[name] = {
+            "identical": not diff,
+            "diff": diff[:args.max_diff_lines],
+            "pandoc_median_ms": pandoc["median_ms"],
+            # The first native render converts every section, later ones reuse them
+            "native_first_ms": native["first_ms"],
+            "native_median_ms": native["median_ms"],
+            "native_min_ms": native["min_ms"]
+        }
+    
+    pandoc_service.shutdown()
+    return {
+        "template": args.template,
+        "identical": all(case["identical"] for case in cases.values()),
+        "cases": cases
+    }
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Diff native and pandoc renders of the same CVs")
+    parser.add_argument("--template", default="europass")
+    parser.add_argument("--paper-size", default="a4")
+    parser.add_argument("--theme-color", default="blue")
+    parser.add_argument("--sections", type=int, default=20, help="Sections in the largest synthetic CV")
+    parser.add_argument("--bullets", type=int, default=8, help="Bullets per section in the largest synthetic CV")
+    parser.add_argument("--images", type=int, default=3, help="Images in the synthetic CVs")
+    parser.add_argument("--repeat", type=int, default=3, help="Renders per engine and case")
+    parser.add_argument("--max-diff-lines", type=int, default=40, help="Diff lines reported per case")
+    parser.add_argument("--output", type=Path, help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv: List[str] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    output = args.output.resolve() if args.output else None
+    
+    original_cwd = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="markcv-engine-diff-") as workspace:
+        workspace = Path(workspace)
+        for name in ("cv_templates", "static"):
+            (workspace / name).symlink_to(REPO_ROOT / name)
+        image_dir = workspace / "data" / "images"
+        image_dir.mkdir(parents=True)
+        generate_images(image_dir, max(args.images, 2), 800, seed=0)
+        
+        os.chdir(workspace)
+        try:
+            results = run_diff(args)
+        finally:
+            os.chdir(original_cwd)
+    
+    report = json.dumps(results, indent=2)
+    if output:
+        output.write_text(report)
+    else:
+        print(report)
+    sys.exit(0 if results["identical"] else 1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
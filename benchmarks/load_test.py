@@ -0,0 +1,477 @@
+"""Load test the HTTP API with concurrent editors and renderers.
+
+Starts uvicorn on a scratch workspace (or targets a running server with
+--url) and has virtual users, each on its own keep-alive connection,
+repeatedly pick an action from a weighted mix:
+    
+    python -m benchmarks.load_test --users 20 --duration 30 --output load.json
+
+- autosave: POST /api/markdown with the user's document and the version it
+  last saw; a 409 (another user saved in between) is counted as a conflict
+  and the user reloads the document
+- upload: POST /api/images/upload with a new JPEG, then references it in the
+  document so renders embed it
+- position: POST /api/images/{id}/position for one of the user's images
+- render: GET /api/pdf of the user's document with a random theme color
+
+Users share documents when --documents is lower than --users. The report
+lists throughput, p50/p95/p99 latency and error rates per route, then the
+results of integrity checks against the server: every acknowledged upload
+is listed with its last position and served with its original size, and
+every document holds the content of its latest acknowledged save, which is
+also the head of its revision log. It exits with status 1 if requests
+failed or a check did not pass. Set MARKCV_STORAGE=sqlite and
+--server-workers to load a multi-process deployment.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from PIL import Image
+
+from benchmarks.startup_benchmark import child_env, prepare_workspace
+from benchmarks.synthetic_cv import generate_cv
+
+ACTIONS = ("autosave", "upload", "position", "render")
+THEME_COLORS = ("blue", "green", "red", "purple")
+# Edit lines kept at the end of a document, so saves stay about the same size
+EDIT_HISTORY = 20
+
+class HTTPConnection:
+    """Minimal HTTP/1.1 client on one keep-alive connection, so no client library is needed"""
+    
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+    
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, bytes]:
+        try:
+            return await asyncio.wait_for(self._request(method, path, body, headers or {}), self.timeout)
+        except BaseException:
+            # The connection is in an unknown state after an error or timeout
+            self.close()
+            raise
+    
+    async def _request(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self._writer.drain()
+        
+        status_line = await self._reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self._reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunks.append(await self._reader.readexactly(size + 2))
+                if not size:
+                    break
+            response_body = b"".join(chunk[:-2] for chunk in chunks)
+        elif "content-length" in response_headers:
+            response_body = await self._reader.readexactly(int(response_headers["content-length"]))
+        else:
+            response_body = await self._reader.read()
+            self.close()
+        
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, response_body
+    
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+@dataclass
+class RouteStats:
+    """Latencies and outcomes of the requests to one route"""
+    latencies: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    errors: int = 0
+    conflicts: int = 0
+    
+    def summary(self, duration: float) -> Dict[str, Any]:
+        count = len(self.latencies)
+        latencies_ms = sorted(latency * 1000 for latency in self.latencies)
+        percentiles = statistics.quantiles(latencies_ms, n=100, method="inclusive") if count > 1 else latencies_ms * 99
+        return {
+            "requests": count,
+            "throughput_rps": count / duration if duration else 0,
+            "p50_ms": percentiles[49] if count else None,
+            "p95_ms": percentiles[94] if count else None,
+            "p99_ms": percentiles[98] if count else None,
+            "max_ms": latencies_ms[-1] if count else None,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0,
+            "conflicts": self.conflicts,
+            "statuses": dict(sorted(self.statuses.items()))
+        }
+
+@dataclass
+class Upload:
+    image_id: str
+    size: int
+    position: Tuple[int, int] = (0, 0)
+
+@dataclass
+class DocumentState:
+    """What the users of a document were told by the server"""
+    # Latest acknowledged save: (revision, version, content)
+    saved: Tuple[int, str, str] = (0, "", "")
+    uploads: Dict[str, Upload] = field(default_factory=dict)
+
+@dataclass
+class VirtualUser:
+    index: int
+    document_id: str
+    rng: random.Random
+    version: Optional[str] = None
+    edits: List[str] = field(default_factory=list)
+    uploads: List[str] = field(default_factory=list)
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, host: str, port: int):
+        self.args = args
+        self.host = host
+        self.port = port
+        self.rng = random.Random(args.seed)
+        self.routes: Dict[str, RouteStats] = defaultdict(RouteStats)
+        self.documents = {f"load-{index}": DocumentState() for index in range(args.documents)}
+        self.base_content = generate_cv(sections=args.sections, bullets=5, images=0)
+        self.weights = [args.autosave, args.upload, args.position, args.render]
+        self.deadline = 0.0
+    
+    async def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        self.deadline = start + self.args.duration
+        await asyncio.gather(*(self._user(index) for index in range(self.args.users)))
+        duration = time.perf_counter() - start
+        
+        routes = {route: stats.summary(duration) for route, stats in sorted(self.routes.items())}
+        requests = sum(route["requests"] for route in routes.values())
+        errors = sum(route["errors"] for route in routes.values())
+        return {
+            "duration_seconds": duration,
+            "total": {
+                "requests": requests,
+                "throughput_rps": requests / duration,
+                "errors": errors,
+                "error_rate": errors / requests if requests else 0
+            },
+            "routes": routes
+        }
+    
+    async def _call(
+        self,
+        connection: HTTPConnection,
+        route: str,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+        conflict_ok: bool = False
+    ) -> Tuple[int, bytes]:
+        """Send a request and record its latency and outcome under route"""
+        stats = self.routes[route]
+        start = time.perf_counter()
+        try:
+            status, response_body = await connection.request(method, path, body, headers)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            status, response_body = 0, type(e).__name__.encode()
+        stats.latencies.append(time.perf_counter() - start)
+        stats.statuses[str(status) if status else response_body.decode()] += 1
+        if status == 409 and conflict_ok:
+            stats.conflicts += 1
+        elif not 200 <= status < 400:
+            stats.errors += 1
+        return status, response_body
+    
+    async def _user(self, index: int) -> None:
+        connection = HTTPConnection(self.host, self.port, self.args.timeout)
+        document_id = f"load-{index % self.args.documents}"
+        user = VirtualUser(index, document_id, random.Random(self.rng.random()))
+        try:
+            await self._load(connection, user)
+            while time.perf_counter() < self.deadline:
+                action = user.rng.choices(ACTIONS, self.weights)[0]
+                if action == "position" and not user.uploads:
+                    action = "upload"
+                await getattr(self, f"_{action}")(connection, user)
+                if self.args.think:
+                    await asyncio.sleep(user.rng.expovariate(1 / self.args.think))
+        finally:
+            connection.close()
+    
+    async def _load(self, connection: HTTPConnection, user: VirtualUser) -> None:
+        status, body = await self._call(
+            connection, "GET /api/markdown", "GET", f"/api/markdown?{urlencode({'document_id': user.document_id})}"
+        )
+        if status == 200:
+            user.version = json.loads(body)["version"]
+    
+    async def _autosave(self, connection: HTTPConnection, user: VirtualUser) -> None:
+        user.edits = (user.edits + [f"- Edit {user.index}-{uuid.uuid4().hex[:8]}"])[-EDIT_HISTORY:]
+        lines = [self.base_content] + [f"![Photo](/data/images/{image_id})" for image_id in user.uploads[-1:]]
+        content = "\n".join(lines + user.edits) + "\n"
+        body = json.dumps({"markdown": content, "base_version": user.version}).encode("utf-8")
+        status, response_body = await self._call(
+            connection, "POST /api/markdown", "POST", f"/api/markdown?{urlencode({'document_id': user.document_id})}",
+            body, {"Content-Type": "application/json"}, conflict_ok=True
+        )
+        if status == 200:
+            saved = json.loads(response_body)
+            user.version = saved["version"]
+            document = self.documents[user.document_id]
+            if saved["revision"] > document.saved[0]:
+                document.saved = (saved["revision"], saved["version"], content)
+        elif status == 409:
+            await self._load(connection, user)
+    
+    async def _upload(self, connection: HTTPConnection, user: VirtualUser) -> None:
+        image = jpeg_bytes(user.rng, self.args.image_size)
+        boundary = uuid.uuid4().hex
+        body = b"".join([
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="photo.jpg"\r\n'.encode(),
+            b"Content-Type: image/jpeg\r\n\r\n", image, b"\r\n",
+            f'--{boundary}\r\nContent-Disposition: form-data; name="alt_text"\r\n\r\nPhoto\r\n'.encode(),
+            f"--{boundary}--\r\n".encode()
+        ])
+        status, response_body = await self._call(
+            connection, "POST /api/images/upload", "POST",
+            f"/api/images/upload?{urlencode({'document_id': user.document_id})}",
+            body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        )
+        if status == 200:
+            image_id = json.loads(response_body)["id"]
+            user.uploads.append(image_id)
+            self.documents[user.document_id].uploads[image_id] = Upload(image_id, len(image))
+    
+    async def _position(self, connection: HTTPConnection, user: VirtualUser) -> None:
+        image_id = user.rng.choice(user.uploads)
+        position = (user.rng.randint(-50, 50), user.rng.randint(-50, 50))
+        query = urlencode({"document_id": user.document_id, "x_offset": position[0], "y_offset": position[1]})
+        status, _ = await self._call(
+            connection, "POST /api/images/{id}/position", "POST", f"/api/images/{image_id}/position?{query}"
+        )
+        if status == 200:
+            self.documents[user.document_id].uploads[image_id].position = position
+    
+    async def _render(self, connection: HTTPConnection, user: VirtualUser) -> None:
+        query = urlencode({"document_id": user.document_id, "theme_color": user.rng.choice(THEME_COLORS)})
+        await self._call(connection, "GET /api/pdf", "GET", f"/api/pdf?{query}")
+    
+    async def check_integrity(self) -> List[str]:
+        """Compare what the server stores with what it acknowledged, and return the problems found"""
+        connection = HTTPConnection(self.host, self.port, self.args.timeout)
+        problems = []
+        try:
+            for document_id, document in self.documents.items():
+                problems.extend(await self._check_document(connection, document_id, document))
+                problems.extend(await self._check_images(connection, document_id, document))
+        finally:
+            connection.close()
+        return problems
+    
+    async def _check_document(self, connection: HTTPConnection, document_id: str, document: DocumentState) -> List[str]:
+        query = urlencode({"document_id": document_id})
+        status, body = await connection.request("GET", f"/api/markdown?{query}")
+        if status != 200:
+            return [f"{document_id}: GET /api/markdown answered {status}"]
+        current = json.loads(body)
+        
+        problems = []
+        revision, version, content = document.saved
+        if revision and (current["content"] != content or current["version"] != version):
+            problems.append(f"{document_id}: content is not that of the last acknowledged save (revision {revision})")
+        
+        status, body = await connection.request("GET", f"/api/markdown/revisions?{query}")
+        revisions = json.loads(body) if status == 200 else []
+        if not revisions:
+            if revision:
+                problems.append(f"{document_id}: revision log is empty or unreadable ({status})")
+            return problems
+        head = revisions[-1]
+        if revision and head["revision"] != revision:
+            problems.append(f"{document_id}: revision log head is {head['revision']}, last acknowledged save {revision}")
+        if head["version"] != current["version"]:
+            problems.append(f"{document_id}: revision log head {head['revision']} does not match the stored content")
+        
+        status, body = await connection.request("GET", f"/api/markdown/revisions/{head['revision']}?{query}")
+        if status != 200 or json.loads(body)["content"] != current["content"]:
+            problems.append(f"{document_id}: content of revision {head['revision']} does not match the stored content")
+        return problems
+    
+    async def _check_images(self, connection: HTTPConnection, document_id: str, document: DocumentState) -> List[str]:
+        status, body = await connection.request("GET", f"/api/images?{urlencode({'document_id': document_id})}")
+        if status != 200:
+            return [f"{document_id}: GET /api/images answered {status}"]
+        listed = {image["id"]: image for image in json.loads(body)}
+        
+        problems = []
+        for upload in document.uploads.values():
+            image = listed.get(upload.image_id)
+            if image is None:
+                problems.append(f"{document_id}: uploaded image {upload.image_id} is missing from the metadata")
+            elif (image["x_offset"], image["y_offset"]) != upload.position:
+                problems.append(f"{document_id}: image {upload.image_id} lost its last position {upload.position}")
+        
+        for image in listed.values():
+            status, body = await connection.request("GET", image["url"])
+            upload = document.uploads.get(image["id"])
+            if status != 200:
+                problems.append(f"{document_id}: image {image['id']} is listed but {image['url']} answered {status}")
+            elif upload and len(body) != upload.size:
+                problems.append(f"{document_id}: image {image['id']} has {len(body)} bytes, {upload.size} were uploaded")
+        return problems
+
+def jpeg_bytes(rng: random.Random, size: int) -> bytes:
+    """A photo-like JPEG that differs from every other one, so uploads are never deduplicated"""
+    image = Image.effect_noise((size, size), rng.randint(20, 80)).convert("RGB")
+    image.putpixel((0, 0), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_ready(host: str, port: int, timeout: float) -> None:
+    """Poll /health/ready until the server (each worker, when it answers in turn) has warmed up"""
+    deadline = time.perf_counter() + timeout
+    connection = HTTPConnection(host, port, timeout)
+    while True:
+        try:
+            status, _ = await connection.request("GET", "/health/ready")
+            if status == 200:
+                return
+        except (OSError, asyncio.IncompleteReadError):
+            connection.close()
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"Server on port {port} was not ready after {timeout:.0f}s")
+        await asyncio.sleep(0.2)
+
+async def run_load_test(args: argparse.Namespace, host: str, port: int) -> Dict[str, Any]:
+    await wait_until_ready(host, port, args.startup_timeout)
+    load_test = LoadTest(args, host, port)
+    results = await load_test.run()
+    problems = await load_test.check_integrity()
+    results["integrity"] = {"ok": not problems, "problems": problems}
+    return results
+
+def run_against_server(args: argparse.Namespace) -> Dict[str, Any]:
+    """Start uvicorn in a scratch workspace and load it"""
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="markcv-load-") as workspace:
+        prepare_workspace(Path(workspace))
+        env = child_env(warmup=True)
+        log = open(Path(workspace) / "server.log", "w")
+        server = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(args.server_workers), "--no-access-log"
+            ],
+            cwd=workspace, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            return asyncio.run(run_load_test(args, "127.0.0.1", port))
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            log.close()
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.url:
+        url = urlsplit(args.url)
+        results = asyncio.run(run_load_test(args, url.hostname, url.port or 80))
+    else:
+        results = run_against_server(args)
+    
+    parameters = {name: value for name, value in vars(args).items() if name != "output"}
+    return {
+        "parameters": parameters,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "storage": os.environ.get("MARKCV_STORAGE", "local")
+        },
+        **results
+    }
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the MarkCV HTTP API and check data integrity afterwards")
+    parser.add_argument("--url", help="Load a running server instead of starting one, e.g. http://localhost:9876")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker processes of the started server")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--documents", type=int, help="Documents the users edit (default: one per user)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--think", type=float, default=0.2, help="Mean pause in seconds between a user's requests")
+    parser.add_argument("--autosave", type=float, default=60, help="Weight of autosaves in the mix")
+    parser.add_argument("--upload", type=float, default=5, help="Weight of image uploads in the mix")
+    parser.add_argument("--position", type=float, default=15, help="Weight of image position updates in the mix")
+    parser.add_argument("--render", type=float, default=20, help="Weight of /api/pdf renders in the mix")
+    parser.add_argument("--sections", type=int, default=8, help="Sections in the edited CVs")
+    parser.add_argument("--image-size", type=int, default=600, help="Width and height of uploaded images in pixels")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a request counts as failed")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="Seconds to wait for /health/ready")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    args.documents = min(args.documents or args.users, args.users)
+    return args
+
+def main(argv: List[str] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    results = run_benchmark(args)
+    
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    else:
+        print(report)
+    sys.exit(0 if results["integrity"]["ok"] and not results["total"]["errors"] else 1)
+
+if __name__ == "__main__":
+    main()
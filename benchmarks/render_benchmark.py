@@ -0,0 +1,252 @@
+"""Benchmark the printable HTML render pipeline on synthetic CVs.
+
+Runs in a scratch workspace so it never touches the real data/ directory:
+    
+    python -m benchmarks.render_benchmark --sections 20 --bullets 8 --images 4 \\
+        --image-size 2400 --repeat 5 --output results.json
+
+Each pipeline stage is timed separately and reports its wall time, the
+number of subprocesses it started, the peak RSS of this process and of its
+children so far, and the size of what it produced. End-to-end numbers for a
+cold render and a render-cache hit are reported as well.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.synthetic_cv import REPO_ROOT, generate_cv, generate_images
+
+class StageTimer:
+    """Collects per-stage samples across repeated runs"""
+    
+    def __init__(self):
+        self.samples: Dict[str, List[Dict[str, Any]]] = {}
+        self.subprocesses = 0
+    
+    @contextmanager
+    def count_subprocesses(self):
+        """Count every subprocess started, including pandoc started by asyncio"""
+        original_init = subprocess.Popen.__init__
+        timer = self
+        
+        def counting_init(popen, *args, **kwargs):
+            timer.subprocesses += 1
+            original_init(popen, *args, **kwargs)
+        
+        subprocess.Popen.__init__ = counting_init
+        try:
+            yield
+        finally:
+            subprocess.Popen.__init__ = original_init
+    
+    def measure(self, stage: str, func: Callable, output_bytes: Callable[[Any], int] = None):
+        """Run func once as the given stage and record its sample"""
+        subprocesses_before = self.subprocesses
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        
+        self.samples.setdefault(stage, []).append({
+            "seconds": elapsed,
+            "subprocesses": self.subprocesses - subprocesses_before,
+            # ru_maxrss is in KiB on Linux and a high-water mark, not a per-stage delta
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "peak_child_rss_kib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            "output_bytes": output_bytes(result) if output_bytes else 0
+        })
+        return result
+    
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        summary = {}
+        for stage, samples in self.samples.items():
+            seconds = [sample["seconds"] for sample in samples]
+            summary[stage] = {
+                "runs": len(samples),
+                "mean_ms": statistics.mean(seconds) * 1000,
+                "median_ms": statistics.median(seconds) * 1000,
+                "min_ms": min(seconds) * 1000,
+                "max_ms": max(seconds) * 1000,
+                "subprocesses": samples[-1]["subprocesses"],
+                "peak_rss_kib": max(sample["peak_rss_kib"] for sample in samples),
+                "peak_child_rss_kib": max(sample["peak_child_rss_kib"] for sample in samples),
+                "output_bytes": samples[-1]["output_bytes"]
+            }
+        return summary
+
+def prepare_workspace(workspace: Path, args: argparse.Namespace) -> None:
+    """Lay out a throwaway copy of the app's working directory with a synthetic CV"""
+    for name in ("cv_templates", "static"):
+        (workspace / name).symlink_to(REPO_ROOT / name)
+    
+    image_dir = workspace / "data" / "images"
+    image_dir.mkdir(parents=True)
+    generate_images(image_dir, args.images, args.image_size, seed=args.seed)
+    (workspace / "data" / "cv.md").write_text(generate_cv(args.sections, args.bullets, args.images))
+
+def directory_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+def run_stages(timer: StageTimer, html_service, template_id: str, paper_size: str, theme_color: str) -> None:
+    """Run the render pipeline one stage at a time, mirroring HTMLService._build_render_command"""
+    from app.services import post_processing
+    
+    markdown_service = html_service.markdown_service
+    template_html = html_service.template_service.get_template_path(template_id)
+    css_file = html_service.template_service.get_template_css(template_id)
+    print_sizes = html_service.template_service.get_template_metadata(template_id).get("printImages", {})
+    content = markdown_service.get_markdown()
+    
+    def extract():
+        first_image, first_image_id, stripped = markdown_service.extract_profile_image(content)
+        attributes = markdown_service.extract_image_attributes(stripped)
+        sections = markdown_service.extract_sections(stripped)
+        return first_image, first_image_id, stripped, attributes, sections
+    
+    first_image, first_image_id, stripped, _, sections = timer.measure(
+        "extraction", extract, lambda result: len(result[2].encode("utf-8"))
+    )
+    timer.measure(
+        "section_processing",
+        lambda: markdown_service.process_sections(sections),
+        lambda processed: sum(len(item.encode("utf-8")) for items in processed.values() for item in items)
+    )
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir_path = Path(temp_dir)
+        output_file = temp_dir_path / "cv.html"
+        temp_images_dir = temp_dir_path / "images"
+        temp_images_dir.mkdir()
+        
+        def copy_images():
+            html_service._process_images(stripped, temp_images_dir, print_sizes)
+            if first_image_id:
+                profile_source = html_service._print_image(
+                    first_image_id, print_sizes.get("profileWidth"), print_sizes.get("profileHeight")
+                )
+                if profile_source.exists():
+                    shutil.copy(profile_source, temp_images_dir / first_image_id)
+        
+        timer.measure("image_copy", copy_images, lambda _: directory_bytes(temp_images_dir))
+        
+        # The command builder repeats the cheap steps above; only pandoc itself is timed here
+        cmd_html = html_service._build_render_command(
+            content, temp_dir_path, output_file, template_html, css_file, paper_size, theme_color, print_sizes
+        )
+        timer.measure(
+            "pandoc",
+            lambda: html_service.pandoc_service.run(cmd_html[1:]),
+            lambda _: output_file.stat().st_size
+        )
+        
+        def post_process():
+            # Streams into a file, as HTMLService._finish_render streams into the cache entry
+            processed_file = temp_dir_path / "cv.processed.html"
+            chunks = post_processing.post_process(post_processing.read_chunks(output_file), html_service.post_processors)
+            with open(processed_file, "w", encoding="utf-8", newline="") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return processed_file
+        
+        timer.measure("post_processing", post_process, lambda processed_file: processed_file.stat().st_size)
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported here: app.config resolves data/ relative to the workspace we just entered
+    from app.services.html_service import HTMLService
+    from app.services.markdown_service import MarkdownService
+    from app.services.pandoc_service import PandocService
+    from app.services.template_service import TemplateService
+    
+    pandoc_service = PandocService()
+    markdown_service = MarkdownService(pandoc_service)
+    html_service = HTMLService(TemplateService(), markdown_service, pandoc_service=pandoc_service)
+    
+    timer = StageTimer()
+    with timer.count_subprocesses():
+        for _ in range(args.repeat):
+            run_stages(timer, html_service, args.template, args.paper_size, args.theme_color)
+        
+        for _ in range(args.repeat):
+            html_service.render_cache.clear()
+            timer.measure(
+                "end_to_end_cold",
+                lambda: html_service.generate_printable_html(args.template, args.paper_size, args.theme_color),
+                lambda response: Path(response.path).stat().st_size
+            )
+            timer.measure(
+                "end_to_end_cached",
+                lambda: html_service.generate_printable_html(args.template, args.paper_size, args.theme_color),
+                lambda response: Path(response.path).stat().st_size
+            )
+    
+    pandoc_service.shutdown()
+    pandoc_version = subprocess.run(["pandoc", "--version"], capture_output=True, text=True).stdout.split("\n")[0]
+    
+    return {
+        "parameters": {
+            "sections": args.sections,
+            "bullets": args.bullets,
+            "images": args.images,
+            "image_size": args.image_size,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "template": args.template,
+            "paper_size": args.paper_size,
+            "theme_color": args.theme_color
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pandoc": pandoc_version
+        },
+        "markdown_bytes": len(markdown_service.get_markdown().encode("utf-8")),
+        "stages": timer.summary(),
+        "samples": timer.samples
+    }
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the MarkCV render pipeline")
+    parser.add_argument("--sections", type=int, default=5, help="Body sections in the synthetic CV")
+    parser.add_argument("--bullets", type=int, default=5, help="Bullets per section")
+    parser.add_argument("--images", type=int, default=1, help="Images, the first one is the profile photo")
+    parser.add_argument("--image-size", type=int, default=1200, help="Edge length of generated images in px")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for generated image content")
+    parser.add_argument("--template", default="europass")
+    parser.add_argument("--paper-size", default="a4")
+    parser.add_argument("--theme-color", default="blue")
+    parser.add_argument("--output", type=Path, help="Write the JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv: List[str] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    output = args.output.resolve() if args.output else None
+    
+    original_cwd = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="markcv-bench-") as workspace:
+        prepare_workspace(Path(workspace), args)
+        os.chdir(workspace)
+        try:
+            results = run_benchmark(args)
+        finally:
+            os.chdir(original_cwd)
+    
+    report = json.dumps(results, indent=2)
+    if output:
+        output.write_text(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
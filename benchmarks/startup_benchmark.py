@@ -0,0 +1,156 @@
+"""Measure MarkCV's startup cost and the latency of the first renders after it.
+
+Runs in a scratch workspace with the example CV, each measurement in a fresh
+process:
+    
+    python -m benchmarks.startup_benchmark --top 15 --output startup.json
+
+- imports: `python -X importtime -c "import app.main"`, reported as the total
+  and the slowest app modules and third-party packages by cumulative time
+- cold: the startup hook without warm-up, then the first /api/pdf render of
+  the example CV and a render with settings that are not cached yet
+- warm: the same after the startup warm-up has finished, with its stages
+
+Comparing the first render of the two runs shows what the warm-up saves; the
+uncached render shows the steady-state latency of a warm process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.synthetic_cv import REPO_ROOT
+
+def prepare_workspace(workspace: Path) -> None:
+    """Lay out a throwaway copy of the app's working directory with the example CV"""
+    for name in ("cv_templates", "static", "templates"):
+        (workspace / name).symlink_to(REPO_ROOT / name)
+    
+    image_dir = workspace / "data" / "images" / "examples"
+    image_dir.mkdir(parents=True)
+    shutil.copy(REPO_ROOT / "example-data" / "images" / "profile.jpg", image_dir)
+    shutil.copy(REPO_ROOT / "example-data" / "cv.md.example", workspace / "data" / "cv.md")
+
+def child_env(warmup: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")]))
+    env["MARKCV_WARMUP"] = "1" if warmup else "0"
+    env["MARKCV_TEMPLATE_POLL_SECONDS"] = "0"
+    return env
+
+def profile_imports(workspace: Path, top: int) -> Dict[str, Any]:
+    """Import app.main with -X importtime and summarize the import graph"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=workspace, env=child_env(False), capture_output=True, text=True, check=True
+    )
+    
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000
+        })
+    
+    by_cumulative = sorted(modules, key=lambda module: module["cumulative_ms"], reverse=True)
+    total = next(module for module in modules if module["module"] == "app.main")
+    return {
+        "total_ms": total["cumulative_ms"],
+        "app_modules": [m for m in by_cumulative if m["module"].startswith("app.")][:top],
+        # Third-party packages, each where it was first imported
+        "packages": [
+            m for m in by_cumulative
+            if "." not in m["module"] and m["module"] != "app" and m["module"] not in sys.stdlib_module_names
+        ][:top]
+    }
+
+def measure_start(workspace: Path, warmup: bool) -> Dict[str, Any]:
+    """Start the app in a fresh process and time its first renders"""
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup_benchmark", "--child"],
+        cwd=workspace, env=child_env(warmup), capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout)
+
+async def first_renders() -> Dict[str, Any]:
+    """In the child process: run the startup hook, wait until ready, then render"""
+    start = time.perf_counter()
+    from app.main import app
+    from app.routes import render_job_service, warmup_service
+    import_seconds = time.perf_counter() - start
+    
+    async with app.router.lifespan_context(app):
+        start = time.perf_counter()
+        while not warmup_service.ready:
+            await asyncio.sleep(0.01)
+        ready_seconds = time.perf_counter() - start
+        
+        renders = {}
+        for name, theme_color in (("first_render", "blue"), ("uncached_render", "green")):
+            start = time.perf_counter()
+            await render_job_service.render(template_id="europass", paper_size="a4", theme_color=theme_color)
+            renders[f"{name}_ms"] = (time.perf_counter() - start) * 1000
+    
+    return {
+        "import_ms": import_seconds * 1000,
+        "ready_ms": ready_seconds * 1000,
+        **renders,
+        "warmup": warmup_service.report()
+    }
+
+def run_benchmark(top: int) -> Dict[str, Any]:
+    pandoc_version = subprocess.run(["pandoc", "--version"], capture_output=True, text=True).stdout.split("\n")[0]
+    results: Dict[str, Any] = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pandoc": pandoc_version
+        }
+    }
+    
+    for name, measure in (
+        ("imports", lambda workspace: profile_imports(workspace, top)),
+        ("cold", lambda workspace: measure_start(workspace, warmup=False)),
+        ("warm", lambda workspace: measure_start(workspace, warmup=True))
+    ):
+        # A fresh workspace each time, so no run finds another's render cache
+        with tempfile.TemporaryDirectory(prefix="markcv-startup-") as workspace:
+            prepare_workspace(Path(workspace))
+            results[name] = measure(Path(workspace))
+    return results
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark MarkCV startup and first-render latency")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules and packages to list")
+    parser.add_argument("--output", type=Path, help="Write the JSON results here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv: List[str] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.child:
+        print(json.dumps(asyncio.run(first_renders())))
+        return
+    
+    report = json.dumps(run_benchmark(args.top), indent=2)
+    if args.output:
+        args.output.write_text(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
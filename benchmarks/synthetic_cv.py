@@ -0,0 +1,94 @@
+"""Synthetic CV generator for benchmarks.
+
+Builds CVs of arbitrary length from the lines of the bundled example CVs
+(example-data/cv.md.example and cv_templates/europass/example.md), so the
+generated markdown exercises the same constructs real CVs use.
+"""
+import itertools
+import random
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+EXAMPLE_FILES = [
+    REPO_ROOT / "example-data" / "cv.md.example",
+    REPO_ROOT / "cv_templates" / "europass" / "example.md",
+]
+
+def load_example_lines() -> Dict[str, List[str]]:
+    """Collect reusable lines from the example CVs, grouped by kind"""
+    pools = {"title": [], "contact": [], "skills": [], "languages": [], "sections": [], "entries": [], "bullets": []}
+    
+    for example_file in EXAMPLE_FILES:
+        section = None
+        for line in example_file.read_text().split("\n"):
+            if line.startswith("# "):
+                pools["title"].append(line)
+                section = "contact"
+            elif line.startswith("## "):
+                section = line[3:].strip()
+                if section not in ("Skills", "Languages"):
+                    pools["sections"].append(section)
+            elif line.startswith("### "):
+                pools["entries"].append(line)
+            elif line.startswith("- "):
+                if section == "Skills":
+                    pools["skills"].append(line)
+                elif section == "Languages":
+                    pools["languages"].append(line)
+                else:
+                    pools["bullets"].append(line)
+            elif section == "contact" and line.strip() and not line.startswith("!["):
+                pools["contact"].append(line)
+    
+    return pools
+
+def generate_cv(sections: int = 5, bullets: int = 5, images: int = 1) -> str:
+    """Generate a CV with the given number of body sections, bullets per entry and images.
+    
+    The first image is placed under the title, where the templates treat it
+    as the profile photo; the others are spread over the body sections.
+    """
+    pools = load_example_lines()
+    skills = itertools.cycle(pools["skills"])
+    languages = itertools.cycle(pools["languages"])
+    section_names = itertools.cycle(pools["sections"])
+    entries = itertools.cycle(pools["entries"])
+    body_bullets = itertools.cycle(pools["bullets"])
+    
+    lines = [pools["title"][0], ""]
+    if images:
+        lines += [f"![profile|align=center|width=150px](/data/images/{image_name(0)})", ""]
+    lines += [pools["contact"][0], "", "## Skills", ""]
+    lines += [next(skills) for _ in range(bullets)]
+    lines += ["", "## Languages", ""]
+    lines += [next(languages) for _ in range(len(pools["languages"]))]
+    
+    body_images = list(range(1, images))
+    for index in range(sections):
+        lines += ["", f"## {next(section_names)}", "", next(entries), ""]
+        lines += [next(body_bullets) for _ in range(bullets)]
+        # Spread the remaining images evenly over the sections
+        while body_images and body_images[0] * sections <= (index + 1) * max(images - 1, 1):
+            lines += ["", f"![figure {body_images[0]}|width=300px](/data/images/{image_name(body_images.pop(0))})"]
+    
+    for image_index in body_images:
+        lines += ["", f"![figure {image_index}|width=300px](/data/images/{image_name(image_index)})"]
+    
+    return "\n".join(lines) + "\n"
+
+def image_name(index: int) -> str:
+    return f"bench-{index}.jpg"
+
+def generate_images(image_dir: Path, images: int, size: int, seed: int = 0) -> List[Path]:
+    """Write deterministic photo-like JPEGs of size x size pixels"""
+    rng = random.Random(seed)
+    paths = []
+    for index in range(images):
+        image = Image.effect_noise((size, size), 40 + rng.randint(0, 40)).convert("RGB")
+        path = image_dir / image_name(index)
+        image.save(path, "JPEG", quality=92)
+        paths.append(path)
+    return paths
@@ -3,17 +3,21 @@ import { initTheme } from './modules/theme.js';
 import { initApiClient } from './modules/api-client.js';
 import { initImageHandler } from './modules/image-handler.js';
 import { initUIController } from './modules/ui-controller.js';
+import { initLiveChannel } from './modules/live-channel.js';
 
 document.addEventListener('DOMContentLoaded', () => {
     const editor = initEditor();
     const apiClient = initApiClient();
+    const liveChannel = initLiveChannel(editor, apiClient);
     
     initTheme(editor);
     initImageHandler(editor, apiClient);
-    initUIController(editor);
+    initUIController(editor, apiClient, liveChannel);
     
     apiClient.loadMarkdown().then(content => {
         editor.setValue(content);
+        // Without a loaded version there is nothing to sync edits against
+        if (apiClient.getBase()) liveChannel.connect();
     });
     
     apiClient.loadTemplates();
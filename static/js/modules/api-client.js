@@ -1,9 +1,42 @@
+// The CV being edited, taken from ?document=<id> in the page URL
+export const documentId = new URLSearchParams(window.location.search).get('document') || 'default';
+
+export function documentQuery() {
+    return `document_id=${encodeURIComponent(documentId)}`;
+}
+
+export class ConflictError extends Error {}
+
+// The smallest single edit turning oldText into newText, with offsets in UTF-16 code units
+export function diffEdit(oldText, newText) {
+    const limit = Math.min(oldText.length, newText.length);
+    let start = 0;
+    while (start < limit && oldText.charCodeAt(start) === newText.charCodeAt(start)) start++;
+    let oldEnd = oldText.length;
+    let newEnd = newText.length;
+    while (oldEnd > start && newEnd > start && oldText.charCodeAt(oldEnd - 1) === newText.charCodeAt(newEnd - 1)) {
+        oldEnd--;
+        newEnd--;
+    }
+    // Keep surrogate pairs whole
+    if (start > 0 && /[\uD800-\uDBFF]/.test(oldText[start - 1])) start--;
+    if (oldEnd < oldText.length && /[\uDC00-\uDFFF]/.test(oldText[oldEnd])) {
+        oldEnd++;
+        newEnd++;
+    }
+    return { start, end: oldEnd, text: newText.slice(start, newEnd) };
+}
+
 export function initApiClient() {
+    // The document as last loaded or saved: saves send only the edits since then
+    let base = null;
+
     async function loadMarkdown() {
         try {
-            const response = await fetch('/api/markdown');
+            const response = await fetch(`/api/markdown?${documentQuery()}`);
             if (!response.ok) throw new Error('Failed to load markdown content');
             const data = await response.json();
+            base = { content: data.content, version: data.version };
             return data.content;
         } catch (error) {
             console.error('Error loading markdown:', error);
@@ -11,18 +44,34 @@ export function initApiClient() {
         }
     }
 
-    async function saveMarkdown(markdown) {
+    async function sendSave(method, body) {
+        const response = await fetch(`/api/markdown?${documentQuery()}`, {
+            method,
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(body)
+        });
+        
+        if (response.status === 409) throw new ConflictError('The CV was changed elsewhere since it was loaded');
+        if (!response.ok) throw new Error('Failed to save markdown content');
+        return response.json();
+    }
+
+    async function saveMarkdown(markdown, { overwrite = false } = {}) {
         try {
-            const response = await fetch('/api/markdown', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ markdown })
-            });
-            
-            if (!response.ok) throw new Error('Failed to save markdown content');
+            let result;
+            if (base && !overwrite) {
+                if (markdown === base.content) return true;
+                result = await sendSave('PATCH', {
+                    base_version: base.version,
+                    edits: [diffEdit(base.content, markdown)]
+                });
+            } else {
+                result = await sendSave('POST', { markdown });
+            }
             
+            base = { content: markdown, version: result.version };
             return true;
         } catch (error) {
             console.error('Error saving markdown:', error);
@@ -30,6 +79,20 @@ export function initApiClient() {
         }
     }
 
+    async function renderPreview(markdown, version) {
+        const response = await fetch('/api/preview', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ markdown, version })
+        });
+        
+        if (!response.ok) throw new Error('Failed to render preview');
+        
+        return response.json();
+    }
+
     async function loadTemplates() {
         try {
             const response = await fetch('/api/templates');
@@ -60,7 +123,7 @@ export function initApiClient() {
         
         return new Promise((resolve, reject) => {
             const xhr = new XMLHttpRequest();
-            xhr.open('POST', '/api/images/upload', true);
+            xhr.open('POST', `/api/images/upload?${documentQuery()}`, true);
             
             xhr.upload.onprogress = function(e) {
                 if (e.lengthComputable) {
@@ -93,12 +156,17 @@ export function initApiClient() {
     }
 
     async function generatePdf(templateId, paperSize) {
-        window.location.href = `/api/pdf?template_id=${templateId}&paper_size=${paperSize}`;
+        window.location.href = `/api/pdf?template_id=${templateId}&paper_size=${paperSize}&${documentQuery()}`;
     }
 
     return {
         loadMarkdown,
         saveMarkdown,
+        getBase: () => base,
+        setBase: (content, version) => {
+            base = { content, version };
+        },
+        renderPreview,
         loadTemplates,
         uploadImage,
         generatePdf
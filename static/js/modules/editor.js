@@ -29,7 +29,26 @@ export function initEditor() {
     renderer.image = function(href, title, text) {
         const dimensions = parseImageDimensions(text);
         const altText = dimensions.alt || '';
+        const { imgClass, style } = imageStyle(dimensions);
         
+        return `<img src="${href}" alt="${altText}" title="${title || ''}" class="${imgClass}" style="${style}">`;
+    };
+
+    marked.setOptions({
+        renderer: renderer
+    });
+
+    // While the live channel is connected the server renders the preview
+    let livePreview = false;
+
+    editor.codemirror.on('change', () => {
+        if (livePreview) return;
+        const markdown = editor.value();
+        const html = marked.parse(markdown);
+        document.getElementById('preview').innerHTML = html;
+    });
+
+    function imageStyle(dimensions) {
         let imgClass = 'cv-image';
         let style = '';
         
@@ -51,18 +70,21 @@ export function initEditor() {
             }
         }
         
-        return `<img src="${href}" alt="${altText}" title="${title || ''}" class="${imgClass}" style="${style}">`;
-    };
-
-    marked.setOptions({
-        renderer: renderer
-    });
+        return { imgClass, style };
+    }
 
-    editor.codemirror.on('change', () => {
-        const markdown = editor.value();
-        const html = marked.parse(markdown);
-        document.getElementById('preview').innerHTML = html;
-    });
+    function showRenderedPreview(html) {
+        const preview = document.getElementById('preview');
+        preview.innerHTML = html;
+        // Server-rendered images keep "alt|width=..." as their alt text; style them like the local preview does
+        preview.querySelectorAll('img').forEach(img => {
+            const dimensions = parseImageDimensions(img.getAttribute('alt'));
+            const { imgClass, style } = imageStyle(dimensions);
+            img.setAttribute('alt', dimensions.alt || '');
+            img.className = imgClass;
+            img.setAttribute('style', style);
+        });
+    }
 
     function parseImageDimensions(alt) {
         if (!alt || !alt.includes('|')) {
@@ -104,6 +126,10 @@ export function initEditor() {
             document.getElementById('preview').innerHTML = html;
         },
         getEditor: () => editor,
+        setLivePreview: (enabled) => {
+            livePreview = enabled;
+        },
+        showRenderedPreview,
         parseImageDimensions
     };
 }
\ No newline at end of file
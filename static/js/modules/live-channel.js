@@ -0,0 +1,140 @@
+import { ConflictError, diffEdit, documentQuery } from './api-client.js';
+
+// Edits are sent after this pause in typing; the server coalesces whatever arrives while it saves
+const SEND_DELAY_MS = 300;
+const RECONNECT_DELAY_MS = 2000;
+
+export function initLiveChannel(editor, apiClient) {
+    let socket = null;
+    let ready = false;
+    // Text as of the last message sent, which the server applies the next edits to
+    let sent = null;
+    let seq = 0;
+    let timer = null;
+    const sentContent = new Map();
+    const waiting = [];
+    const fragments = new Map();
+
+    function connect() {
+        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        socket = new WebSocket(`${protocol}://${window.location.host}/api/live?${documentQuery()}`);
+
+        socket.onopen = () => sync();
+        socket.onmessage = (event) => handleMessage(JSON.parse(event.data));
+        socket.onclose = () => {
+            ready = false;
+            editor.setLivePreview(false);
+            editor.refreshPreview();
+            rejectWaiting(new Error('Live connection closed'));
+            setTimeout(connect, RECONNECT_DELAY_MS);
+        };
+    }
+
+    function sync() {
+        const base = apiClient.getBase();
+        socket.send(JSON.stringify({ type: 'sync', version: base ? base.version : null }));
+    }
+
+    function send(message) {
+        seq += 1;
+        sentContent.set(seq, sent);
+        socket.send(JSON.stringify({ ...message, seq }));
+        return seq;
+    }
+
+    function sendEdits() {
+        clearTimeout(timer);
+        timer = null;
+        if (!ready) return;
+
+        const markdown = editor.getValue();
+        if (markdown === sent) return;
+        const edit = diffEdit(sent, markdown);
+        sent = markdown;
+        send({ type: 'edit', edits: [edit] });
+    }
+
+    function scheduleSend() {
+        if (!ready) return;
+        clearTimeout(timer);
+        timer = setTimeout(sendEdits, SEND_DELAY_MS);
+    }
+
+    async function resolveConflict() {
+        const overwrite = confirm('This CV was changed elsewhere since it was loaded. Overwrite those changes with yours?');
+        if (overwrite) {
+            sent = editor.getValue();
+            ready = true;
+            send({ type: 'replace', markdown: sent });
+        } else {
+            editor.setValue(await apiClient.loadMarkdown());
+            sync();
+        }
+    }
+
+    function handleMessage(message) {
+        switch (message.type) {
+            case 'ready':
+                ready = true;
+                sent = apiClient.getBase().content;
+                editor.setLivePreview(true);
+                // Catch up on anything typed before the connection was ready
+                sendEdits();
+                break;
+            case 'saved':
+                apiClient.setBase(sentContent.get(message.seq), message.version);
+                for (const key of sentContent.keys()) {
+                    if (key <= message.seq) sentContent.delete(key);
+                }
+                resolveWaiting(message.seq);
+                break;
+            case 'preview':
+                message.sections.forEach(id => {
+                    if (id in message.fragments) fragments.set(id, message.fragments[id]);
+                });
+                editor.showRenderedPreview(message.sections.map(id => fragments.get(id) || '').join('\n'));
+                break;
+            case 'conflict':
+                ready = false;
+                rejectWaiting(Object.assign(new ConflictError('The CV was changed elsewhere'), { live: true }));
+                resolveConflict();
+                break;
+            case 'error':
+                console.error('Live editing error:', message.detail);
+                if (message.resync) {
+                    ready = false;
+                    sync();
+                }
+                break;
+        }
+    }
+
+    function resolveWaiting(savedSeq) {
+        for (let i = waiting.length - 1; i >= 0; i--) {
+            if (waiting[i].seq <= savedSeq) {
+                waiting[i].resolve(true);
+                waiting.splice(i, 1);
+            }
+        }
+    }
+
+    function rejectWaiting(error) {
+        waiting.splice(0).forEach(entry => entry.reject(error));
+    }
+
+    // Send pending edits now and resolve once the server has saved them
+    function flush() {
+        if (!ready) return Promise.reject(new Error('Live connection is not ready'));
+        sendEdits();
+        if (!sentContent.size) return Promise.resolve(true);
+        return new Promise((resolve, reject) => waiting.push({ seq, resolve, reject }));
+    }
+
+    editor.getEditor().codemirror.on('change', scheduleSend);
+
+    return {
+        connect,
+        flush,
+        isReady: () => ready
+    };
+}
@@ -1,4 +1,6 @@
-export function initUIController(editor) {
+import { ConflictError, documentQuery } from './api-client.js';
+
+export function initUIController(editor, apiClient, liveChannel) {
     const editorPanel = document.getElementById('editor-panel');
     const previewPanel = document.getElementById('preview-panel');
     const mobileEditorBtn = document.getElementById('mobile-editor-btn');
@@ -61,15 +63,19 @@ export function initUIController(editor) {
     saveBtn.addEventListener('click', async () => {
         try {
             const markdown = editor.getValue();
-            const response = await fetch('/api/markdown', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ markdown })
-            });
-            
-            if (!response.ok) throw new Error('Failed to save markdown content');
+            try {
+                if (liveChannel.isReady()) {
+                    await liveChannel.flush();
+                } else {
+                    await apiClient.saveMarkdown(markdown);
+                }
+            } catch (error) {
+                if (!(error instanceof ConflictError)) throw error;
+                // The live channel asks the user how to resolve its own conflicts
+                if (liveChannel.isReady() || error.live) return;
+                if (!confirm(`${error.message}. Overwrite those changes with yours?`)) return;
+                await apiClient.saveMarkdown(markdown, { overwrite: true });
+            }
             
             const originalText = saveBtn.textContent;
             saveBtn.textContent = 'Saved!';
@@ -91,7 +97,7 @@ export function initUIController(editor) {
         const templateId = document.getElementById('template-select').value;
         const paperSize = document.getElementById('paper-size').value;
         
-        window.location.href = `/api/pdf?template_id=${templateId}&paper_size=${paperSize}`;
+        window.location.href = `/api/pdf?template_id=${templateId}&paper_size=${paperSize}&${documentQuery()}`;
     });
 
     return {
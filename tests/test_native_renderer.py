@@ -0,0 +1,132 @@
+"""Output-diff tests of the native render engine against pandoc.
+
+Each case renders through the public render pipeline, which picks the engine
+the template selects and falls back to pandoc for markdown the native engine
+does not support. The output must be the same as a render with the native
+engine disabled, after normalize() from benchmarks/engine_diff.py.
+"""
+import re
+import shutil
+
+import pytest
+
+import app.services.html_service as html_service_module
+from app.services.css_bundler import CSSBundler
+from app.services.document_store import DocumentStore
+from app.services.html_service import HTMLService
+from app.services.image_processing import ImageProcessor
+from app.services.markdown_service import MarkdownService
+from app.services.metrics import collect_request_timings
+from app.services.pandoc_service import PandocService
+from app.services.render_cache import RenderCache
+from app.services.storage import LocalStorage
+from app.services.template_service import TemplateService
+from benchmarks.engine_diff import CONSTRUCTS, normalize
+from benchmarks.synthetic_cv import EXAMPLE_FILES, REPO_ROOT, generate_cv, generate_images
+
+pytestmark = pytest.mark.skipif(shutil.which("pandoc") is None, reason="pandoc is not installed")
+
+TEMPLATE_ID = "europass"
+HEADER = "# Jane Doe\n\n![Profile](/data/images/bench-0.jpg)\n\n## Experience\n\n"
+
+# Rendered natively, and identical to pandoc
+NATIVE_CASES = {
+    "constructs": CONSTRUCTS,
+    "synthetic": generate_cv(5, 5, 2),
+    "nested-list-4-spaces": HEADER + "- Role\n    - detail\n",
+    "inline-image": HEADER + "Text ![diagram](/data/images/bench-1.jpg) more\n",
+    "emphasis": HEADER + "*emph*, **strong**, ***both***, _em_ and __strong__, snake_case_name\n",
+    "smart-punctuation": HEADER + "Some \"quotes\" and 'single' -- dash --- em... 2019--2020\n",
+    "hard-break-spaces": HEADER + "Line one  \nline two\n",
+    "pipe-table": HEADER + "| Year | Role |\n|------|------|\n| 2020 | Lead |\n",
+    "definition-list": HEADER + "Term\n:   Definition\n",
+    "raw-inline-html": HEADER + "Hello & <b>bold</b> &amp; <span>inline *md*</span> a<br>b\n",
+    "reference-link": HEADER + "[ref link][r]\n\n[r]: http://r.example\n",
+}
+
+# Pandoc markdown python-markdown reads differently: rendered with pandoc instead
+PANDOC_CASES = {
+    "nested-list-2-spaces": "- Role\n  - detail\n",
+    "nested-ordered-list-3-spaces": "1. First\n   1. detail\n",
+    "list-paragraph-2-spaces": "- item\n\n  continued paragraph\n",
+    "list-after-other-list": "- a\n- b\n1. c\n",
+    "strikeout": "~~strike~~\n",
+    "subscript-superscript": "H~2~O and 2^10^\n",
+    "image-attributes": "Text ![x](/data/images/bench-1.jpg){width=50%}\n",
+    "image-without-alt": "![](/data/images/bench-1.jpg)\n",
+    "external-image": "![alt](http://example.com/a.png)\n",
+    "heading-attributes": "### Project {#proj}\n",
+    "span-attributes": "[x]{.smallcaps}\n",
+    "code-attributes": "`code`{.py}\n",
+    "fenced-code-language": "```python\nx = 1\n```\n",
+    "backslash-hard-break": "line\\\nbreak\n",
+    "uri-autolink": "<https://example.com>\n",
+    "email-autolink": "<me@example.com>\n",
+    "footnote": "A footnote[^1]\n\n[^1]: The note.\n",
+    "inline-footnote": "Inline^[note]\n",
+    "letter-list": "a. alpha\nb. beta\n",
+    "parenthesis-list": "1) one\n2) two\n",
+    "task-list": "- [ ] task\n- [x] done\n",
+    "math": "Price $x^2$ here\n",
+    "simple-table": "  a   b\n----- -----\n  1   2\n",
+    "hashtag": "#hashtag not heading\n",
+    "html-block": "<div class=\"box\">\n**md inside**\n</div>\n",
+    "nested-quote": "> a\n>> nested\n",
+    "quote-after-link": "\"quoted [link](http://a.b)\"\n",
+    "raw-tex": "C:\\Path\\to\n",
+}
+
+@pytest.fixture(scope="module")
+def storage(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    (data_dir / "images").mkdir()
+    generate_images(data_dir / "images", 2, 200, seed=0)
+    return LocalStorage(data_dir)
+
+@pytest.fixture(scope="module")
+def pandoc_service():
+    pandoc_service = PandocService()
+    yield pandoc_service
+    pandoc_service.shutdown()
+
+@pytest.fixture
+def html_service(storage, pandoc_service, tmp_path):
+    template_service = TemplateService(REPO_ROOT / "cv_templates", REPO_ROOT / "static" / "css" / "themes", poll_interval=0)
+    return HTMLService(
+        template_service,
+        MarkdownService(pandoc_service, DocumentStore(storage)),
+        render_cache=RenderCache(tmp_path / "renders"),
+        pandoc_service=pandoc_service,
+        image_processor=ImageProcessor(tmp_path / "images", storage),
+        css_bundler=CSSBundler(template_service, tmp_path / "css")
+    )
+
+def render(html_service, content: str):
+    """Render with render_content, returning the engine that produced the HTML and the HTML"""
+    with collect_request_timings() as timings:
+        output_file = html_service.render_content(content, TEMPLATE_ID, "a4", "blue")
+    engine = "pandoc" if "pandoc" in {stage for stage, _ in timings} else "native"
+    return engine, output_file.read_text()
+
+def assert_same_as_pandoc(html_service, monkeypatch, content: str, engine: str) -> None:
+    used_engine, html = render(html_service, content)
+    assert used_engine == engine
+    
+    monkeypatch.setattr(html_service_module, "NATIVE_RENDER_ENABLED", False)
+    reference_engine, reference_html = render(html_service, content)
+    assert reference_engine == "pandoc"
+    assert normalize(html) == normalize(reference_html)
+
+@pytest.mark.parametrize("example_file", EXAMPLE_FILES, ids=lambda path: path.name)
+def test_example_cvs_render_natively_like_pandoc(html_service, monkeypatch, example_file):
+    content = re.sub(r"\(/data/images/[^)]*\)", "(/data/images/bench-0.jpg)", example_file.read_text())
+    assert_same_as_pandoc(html_service, monkeypatch, content, "native")
+
+@pytest.mark.parametrize("name", NATIVE_CASES)
+def test_native_output_matches_pandoc(html_service, monkeypatch, name):
+    assert_same_as_pandoc(html_service, monkeypatch, NATIVE_CASES[name], "native")
+
+@pytest.mark.parametrize("name", PANDOC_CASES)
+def test_unsupported_markdown_falls_back_to_pandoc(html_service, monkeypatch, name):
+    assert not html_service.native_renderer.supports(PANDOC_CASES[name])
+    assert_same_as_pandoc(html_service, monkeypatch, HEADER + PANDOC_CASES[name], "pandoc")
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""Tests of streaming post-processing: any chunking must give the same output as re.sub on the whole text."""
+import pytest
+
+from app.services.post_processing import (
+    BODY_END_PATTERN,
+    MINIFY_PATTERN,
+    PRINT_SCRIPT,
+    inject_print_script,
+    minify_html,
+)
+
+CHUNK_SIZES = [1, 2, 3, 5, 7, 8, 9, 10, 13, 64, 4096]
+
+HTML = (
+    "<!DOCTYPE html>\r\n<html>\n  <head>\n    <title>CV</title>\n"
+    "    <script>\n      var  x = 1;\n\n      var y = 2;\n    </script>\n  </head>\n"
+    "  <body>\n    <h1>Jane   Doe</h1>   \t\n\n\n"
+    "    <pre>\n  keep   this\n\n    indented\n  </pre>\n"
+    "    <TEXTAREA rows=2>\n  typed\n</TEXTAREA >\n"
+    "    <p>text with trailing spaces" + " " * 40 + "\n" + "\t" * 12 + "and tabs</p>\n"
+    "    <p>not a </bodyx> tag, nor </ body></p>\n"
+    "  </body>\n</html>\n"
+)
+
+DOCUMENTS = {
+    "page": HTML,
+    "two-body-ends": "<body>a</body>b</body>\n",
+    "body-end-at-the-end": "<body>\n  x\n</body>",
+    "unclosed-pre": "<p>a</p>\n  <pre>\n  keep\n\n  to the end   \n",
+    "no-matches": "plain text",
+    "empty": "",
+}
+
+def chunked(text: str, size: int):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+def expected_print_script(text: str) -> str:
+    return BODY_END_PATTERN.sub(lambda match: PRINT_SCRIPT + match.group(0), text)
+
+def expected_minified(text: str) -> str:
+    return MINIFY_PATTERN.sub(lambda match: match.group(0) if match.group(1) else "\n", text)
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", DOCUMENTS)
+def test_inject_print_script_matches_re_sub(name, size):
+    text = DOCUMENTS[name]
+    assert "".join(inject_print_script(chunked(text, size))) == expected_print_script(text)
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", DOCUMENTS)
+def test_minify_html_matches_re_sub(name, size):
+    text = DOCUMENTS[name]
+    assert "".join(minify_html(chunked(text, size))) == expected_minified(text)
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_chained_processors_match_re_sub(size):
+    assert "".join(minify_html(inject_print_script(chunked(HTML, size)))) == expected_minified(expected_print_script(HTML))
\ No newline at end of file
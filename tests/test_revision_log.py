@@ -0,0 +1,123 @@
+"""Tests of the revision log: UTF-16 edit offsets, compaction and recovery from torn writes."""
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.document_store import DocumentStore
+from app.services.markdown_service import MarkdownService
+from app.services.pandoc_service import PandocService
+from app.services.revision_log import RevisionLog, apply_edits, content_version, diff_edits
+from app.services.storage import LocalStorage
+
+# "😀" is one code point but two UTF-16 code units, as the editor counts them
+ASTRAL = "a😀b"
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(tmp_path)
+
+def read_entries(storage, key: str):
+    return [json.loads(line) for line in storage.read_text(key).splitlines()]
+
+@pytest.mark.parametrize("edits, expected", [
+    ([(3, 4, "c")], "a😀c"),
+    ([(1, 3, "")], "ab"),
+    ([(1, 3, "🎉")], "a🎉b"),
+    ([(0, 0, "x"), (3, 3, "y")], "xa😀yb"),
+    ([(4, 4, "!")], "a😀b!"),
+])
+def test_apply_edits_counts_utf16_code_units(edits, expected):
+    assert apply_edits(ASTRAL, edits) == expected
+
+@pytest.mark.parametrize("edits", [
+    [(2, 2, "x")],
+    [(1, 2, "")],
+    [(2, 3, "x")],
+])
+def test_apply_edits_rejects_offsets_that_split_a_surrogate_pair(edits):
+    with pytest.raises(ValueError, match="split a character"):
+        apply_edits(ASTRAL, edits)
+
+@pytest.mark.parametrize("edits", [
+    [(3, 4, "x"), (0, 1, "y")],
+    [(0, 2, "x"), (1, 3, "y")],
+    [(2, 1, "x")],
+    [(0, 5, "x")],
+    [(-1, 0, "x")],
+])
+def test_apply_edits_rejects_out_of_order_overlapping_and_out_of_range_edits(edits):
+    with pytest.raises(ValueError, match="out of order or outside"):
+        apply_edits(ASTRAL, edits)
+
+@pytest.mark.parametrize("old, new", [
+    ("", ""),
+    ("", "😀"),
+    (ASTRAL, "a😀😀b"),
+    (ASTRAL, "ab"),
+    ("😀😀", "😀🎉😀"),
+    ("x" * 3000 + "😀", "x" * 3000 + "🎉"),
+    ("same", "same"),
+])
+def test_diff_edits_round_trips_through_apply_edits(old, new):
+    edits = diff_edits(old, new)
+    assert len(edits) == 1
+    assert apply_edits(old, edits) == new
+
+def test_compaction_keeps_history_revisions_starting_with_a_snapshot(storage):
+    log = RevisionLog(storage, "cv.revisions.jsonl", history=3, snapshot_interval=2)
+    contents = [f"# CV {'😀' * number}\n" for number in range(1, 7)]
+    previous = None
+    for content in contents:
+        log.append(content, previous)
+        previous = content
+    
+    entries = read_entries(storage, "cv.revisions.jsonl")
+    assert [entry["revision"] for entry in entries] == [4, 5, 6]
+    assert "snapshot" in entries[0]
+    assert all("edits" in entry for entry in entries[1:])
+    assert [revision.revision for revision in log.revisions()] == [4, 5, 6]
+    for number in (4, 5, 6):
+        assert log.content_at(number) == contents[number - 1]
+    assert log.content_at(3) is None
+
+def test_torn_last_line_is_skipped_and_terminated(storage):
+    key = "cv.revisions.jsonl"
+    log = RevisionLog(storage, key, history=10, snapshot_interval=5)
+    log.append("one", None)
+    log.append("one two", "one")
+    # A crash in the middle of writing the next entry
+    storage.append(key, b'{"revision":3,"version":"')
+    
+    reopened = RevisionLog(storage, key, history=10, snapshot_interval=5)
+    assert reopened.head().revision == 2
+    revision = reopened.append("one two three", "one two")
+    
+    assert revision.revision == 3
+    assert storage.read_text(key).endswith("\n")
+    assert [entry.revision for entry in reopened.revisions()] == [1, 2, 3]
+    assert reopened.content_at(3) == "one two three"
+
+@pytest.fixture
+def markdown_service(storage):
+    return MarkdownService(PandocService(use_server=False), DocumentStore(storage))
+
+def test_patch_on_a_stale_base_version_is_a_conflict(markdown_service):
+    markdown_service.save_markdown("# CV 😀\n")
+    stale_version = content_version("# CV 😀\n")
+    markdown_service.save_markdown("# CV 🎉\n", base_version=stale_version)
+    
+    with pytest.raises(HTTPException) as excinfo:
+        markdown_service.patch_markdown([(0, 1, "#")], stale_version)
+    
+    assert excinfo.value.status_code == 409
+    assert excinfo.value.detail["version"] == content_version("# CV 🎉\n")
+    assert markdown_service.get_markdown() == "# CV 🎉\n"
+
+def test_patch_applies_utf16_offsets_against_the_current_version(markdown_service):
+    markdown_service.save_markdown("# CV 😀\n")
+    revision = markdown_service.patch_markdown([(5, 7, "🎉")], content_version("# CV 😀\n"))
+    
+    assert markdown_service.get_markdown() == "# CV 🎉\n"
+    assert revision.version == content_version("# CV 🎉\n")
+    assert markdown_service.get_revision(revision.revision) == "# CV 🎉\n"
\ No newline at end of file